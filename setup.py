@@ -29,6 +29,10 @@ setup(
         "sqlalchemy>=1.4.0,<3", "psycopg2-binary"
     ],
     extras_require={
+        "numpy": ["numpy"],
+        "arrow": ["numpy", "pyarrow"],
+        "asyncpg": ["asyncpg", "greenlet"],
+        "psycopg": ["psycopg>=3.0.7", "greenlet"],
     },
     setup_requires=["pytest-runner"],
     tests_require=["pytest", "mock"],
@@ -54,7 +58,10 @@ setup(
     entry_points={
         "sqlalchemy.dialects": [
             "greenplum = sqlalchemy_greenplum.dialect:GreenplumDialect",
-            "greenplum.psycopg2 = sqlalchemy_greenplum.dialect:GreenplumDialect"
+            "greenplum.psycopg2 = sqlalchemy_greenplum.dialect:GreenplumDialect",
+            "greenplum.asyncpg = sqlalchemy_greenplum.asyncpg:GreenplumDialect_asyncpg",
+            "greenplum.psycopg = sqlalchemy_greenplum.psycopg:GreenplumDialect_psycopg",
+            "greenplum.psycopg_async = sqlalchemy_greenplum.psycopg:GreenplumDialectAsync_psycopg"
         ]
     },
 )
@@ -1,14 +1,228 @@
+import sqlalchemy
 from sqlalchemy.ext.compiler import compiles
+from sqlalchemy_greenplum import ddl as gp_ddl
+from sqlalchemy_greenplum.reflection import invalidate_reflection_cache
+from sqlalchemy_greenplum.staging import parse_distributed_by
+
+# The storage parameters autogenerate compares (appendonly being the older name of appendoptimized), with the
+# value the server uses when a table does not set them
+STORAGE_PARAM_DEFAULTS = {
+    'appendoptimized': 'false', 'orientation': 'row', 'compresstype': 'none', 'compresslevel': '0',
+    'blocksize': '32768',
+}
+
+
+def _storage_params_dict(storage_params):
+    params = {}
+    for option in (storage_params or '').split(','):
+        if '=' in option:
+            name, value = option.split('=', 1)
+            name = name.strip().lower()
+            params['appendoptimized' if name == 'appendonly' else name] = value.strip().lower()
+    return params
+
+
+def _typed_storage_params(params):
+    typed = {}
+    for name, value in params.items():
+        if name == 'appendoptimized':
+            value = value == 'true'
+        elif name in ('compresslevel', 'blocksize'):
+            value = int(value)
+        typed[name] = value
+    return typed
+
+
+def model_storage_params(table):
+    """The storage parameters a Table asks for, as a dict of lower case names and values"""
+    gp_opts = table.dialect_options['greenplum']
+    params = _storage_params_dict(gp_opts['storage_params'])
+    for name in STORAGE_PARAM_DEFAULTS:
+        value = gp_opts[name]
+        if value is not None:
+            if name == 'appendoptimized':
+                value = 'true' if value else 'false'
+            params[name] = str(value).lower()
+    return params
+
+
+def distribution_change(conn_distributed_by, metadata_table):
+    """The greenplum_distributed_by a Table asks for when it differs from the one of the database, else None
+
+    Note:
+        Only tables giving greenplum_distributed_by are compared, the default distribution is left to the server.
+    """
+    distributed_by = metadata_table.dialect_options['greenplum']['distributed_by']
+    if distributed_by is None:
+        return None
+    if conn_distributed_by is not None and \
+            parse_distributed_by(conn_distributed_by) == parse_distributed_by(distributed_by):
+        return None
+    return distributed_by
+
+
+def storage_params_change(conn_storage_params, metadata_table):
+    """The storage parameters of a Table that differ from the ones of the database
+
+    Note:
+        Only the append optimized storage options given on the Table are compared, a parameter the database
+        does not report compares against its default.
+
+    Returns:
+        A ``(storage_params, existing_storage_params)`` tuple of dicts of typed storage options, or None
+    """
+    conn_params = dict(STORAGE_PARAM_DEFAULTS, **_storage_params_dict(conn_storage_params))
+    changed = dict(
+        (name, value) for name, value in model_storage_params(metadata_table).items()
+        if name in STORAGE_PARAM_DEFAULTS and conn_params[name] != value
+    )
+    if not changed:
+        return None
+    return _typed_storage_params(changed), _typed_storage_params(dict((name, conn_params[name]) for name in changed))
+
 
 try:
     from alembic.ddl import postgresql
 except ImportError:
     pass
 else:
+    from alembic.autogenerate import comparators, renderers
     from alembic.ddl.base import AlterColumn, RenameTable
+    from alembic.operations import MigrateOperation, Operations
     compiles(AlterColumn, 'greenplum')(postgresql.visit_column_type)
     compiles(RenameTable, 'greenplum')(postgresql.visit_rename_table)
 
     class GreenplumImpl(postgresql.PostgresqlImpl):
         __dialect__ = 'greenplum'
-        transactional_ddl = True
\ No newline at end of file
+        transactional_ddl = True
+
+        def _exec(self, construct, *args, **kw):
+            result = super(GreenplumImpl, self)._exec(construct, *args, **kw)
+            if not self.as_sql and self.dialect.reflection_cache_ttl is not None:
+                # operations can run DDL as plain SQL strings, which the dialect cannot tell from other statements
+                invalidate_reflection_cache(self.connection.engine.url)
+            return result
+
+    @Operations.register_operation('set_distributed_by')
+    class SetDistributedByOp(MigrateOperation):
+        """ALTER TABLE ... SET DISTRIBUTED, ``op.set_distributed_by('sales', '"customer_id"')``"""
+        def __init__(self, table_name, distributed_by, schema=None, reorganize=None, existing_distributed_by=None):
+            self.table_name = table_name
+            self.distributed_by = distributed_by
+            self.schema = schema
+            self.reorganize = reorganize
+            self.existing_distributed_by = existing_distributed_by
+
+        @classmethod
+        def set_distributed_by(cls, operations, table_name, distributed_by, schema=None, reorganize=None,
+                               existing_distributed_by=None):
+            return operations.invoke(cls(table_name, distributed_by, schema=schema, reorganize=reorganize,
+                                         existing_distributed_by=existing_distributed_by))
+
+        def reverse(self):
+            if self.existing_distributed_by is None:
+                raise ValueError('The distribution of %s before the change is unknown' % self.table_name)
+            return SetDistributedByOp(self.table_name, self.existing_distributed_by, schema=self.schema,
+                                      existing_distributed_by=self.distributed_by)
+
+    @Operations.register_operation('reorganize_table')
+    class ReorganizeTableOp(MigrateOperation):
+        """ALTER TABLE ... SET WITH (REORGANIZE=true), ``op.reorganize_table('sales')``"""
+        def __init__(self, table_name, schema=None):
+            self.table_name = table_name
+            self.schema = schema
+
+        @classmethod
+        def reorganize_table(cls, operations, table_name, schema=None):
+            return operations.invoke(cls(table_name, schema=schema))
+
+    @Operations.register_operation('expand_table')
+    class ExpandTableOp(MigrateOperation):
+        """ALTER TABLE ... EXPAND TABLE, ``op.expand_table('sales')``"""
+        def __init__(self, table_name, schema=None):
+            self.table_name = table_name
+            self.schema = schema
+
+        @classmethod
+        def expand_table(cls, operations, table_name, schema=None):
+            return operations.invoke(cls(table_name, schema=schema))
+
+    @Operations.register_operation('set_storage_params')
+    class SetStorageParamsOp(MigrateOperation):
+        """ALTER TABLE ... SET WITH (...), ``op.set_storage_params('sales', {'compresstype': 'zstd'})``"""
+        def __init__(self, table_name, storage_params, schema=None, existing_storage_params=None):
+            self.table_name = table_name
+            self.storage_params = storage_params
+            self.schema = schema
+            self.existing_storage_params = existing_storage_params
+
+        @classmethod
+        def set_storage_params(cls, operations, table_name, storage_params, schema=None,
+                               existing_storage_params=None):
+            return operations.invoke(cls(table_name, storage_params, schema=schema,
+                                         existing_storage_params=existing_storage_params))
+
+        def reverse(self):
+            if self.existing_storage_params is None:
+                raise ValueError('The storage parameters of %s before the change are unknown' % self.table_name)
+            return SetStorageParamsOp(self.table_name, self.existing_storage_params, schema=self.schema,
+                                      existing_storage_params=self.storage_params)
+
+    def _table(op):
+        return sqlalchemy.table(op.table_name, schema=op.schema)
+
+    @Operations.implementation_for(SetDistributedByOp)
+    def set_distributed_by(operations, op):
+        operations.execute(gp_ddl.SetDistributedBy(_table(op), op.distributed_by, reorganize=op.reorganize))
+
+    @Operations.implementation_for(ReorganizeTableOp)
+    def reorganize_table(operations, op):
+        operations.execute(gp_ddl.ReorganizeTable(_table(op)))
+
+    @Operations.implementation_for(ExpandTableOp)
+    def expand_table(operations, op):
+        operations.execute(gp_ddl.ExpandTable(_table(op)))
+
+    @Operations.implementation_for(SetStorageParamsOp)
+    def set_storage_params(operations, op):
+        operations.execute(gp_ddl.SetStorageParams(_table(op), op.storage_params))
+
+    def _render_args(op, *args, **kw):
+        rendered = [repr(op.table_name)] + [repr(arg) for arg in args]
+        kw['schema'] = op.schema
+        rendered.extend('%s=%r' % (name, value) for name, value in sorted(kw.items()) if value is not None)
+        return ', '.join(rendered)
+
+    @renderers.dispatch_for(SetDistributedByOp)
+    def render_set_distributed_by(autogen_context, op):
+        return 'op.set_distributed_by(%s)' % _render_args(
+            op, op.distributed_by, reorganize=op.reorganize, existing_distributed_by=op.existing_distributed_by)
+
+    @renderers.dispatch_for(ReorganizeTableOp)
+    def render_reorganize_table(autogen_context, op):
+        return 'op.reorganize_table(%s)' % _render_args(op)
+
+    @renderers.dispatch_for(ExpandTableOp)
+    def render_expand_table(autogen_context, op):
+        return 'op.expand_table(%s)' % _render_args(op)
+
+    @renderers.dispatch_for(SetStorageParamsOp)
+    def render_set_storage_params(autogen_context, op):
+        return 'op.set_storage_params(%s)' % _render_args(
+            op, op.storage_params, existing_storage_params=op.existing_storage_params)
+
+    @comparators.dispatch_for('table', qualifier='greenplum')
+    def compare_table_options(autogen_context, modify_table_ops, schema, table_name, conn_table, metadata_table):
+        """Detect a distribution or storage of a model table that differs from the database"""
+        if conn_table is None or metadata_table is None or autogen_context.dialect.greenplum_version_info is None:
+            return
+        conn_opts = conn_table.dialect_options['greenplum']
+        distributed_by = distribution_change(conn_opts['distributed_by'], metadata_table)
+        if distributed_by is not None and conn_opts['distributed_by'] is not None:
+            modify_table_ops.ops.append(SetDistributedByOp(
+                table_name, distributed_by, schema=schema, existing_distributed_by=conn_opts['distributed_by']))
+        change = storage_params_change(conn_opts['storage_params'], metadata_table)
+        if change is not None:
+            storage_params, existing_storage_params = change
+            modify_table_ops.ops.append(SetStorageParamsOp(
+                table_name, storage_params, schema=schema, existing_storage_params=existing_storage_params))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import importlib
+import importlib.abc
+import sys
+import threading
+
+_lock = threading.Lock()
+
+
+def _register():
+    importlib.import_module('sqlalchemy_greenplum.alembic_gp')
+
+
+class _RegisteringLoader(importlib.abc.Loader):
+    """Wraps the loader of the alembic package to register the Greenplum support once alembic is imported"""
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        _register()
+
+    def __getattr__(self, name):
+        # resource readers and the like of the wrapped loader
+        return getattr(self._loader, name)
+
+
+class _AlembicFinder(importlib.abc.MetaPathFinder):
+    """Finds the alembic package through the other finders, with a loader registering the Greenplum support"""
+    def find_spec(self, fullname, path, target=None):
+        if fullname != 'alembic':
+            return None
+        sys.meta_path.remove(self)
+        for finder in sys.meta_path:
+            find_spec = getattr(finder, 'find_spec', None)
+            spec = find_spec(fullname, path, target) if find_spec is not None else None
+            if spec is not None:
+                if spec.loader is not None:
+                    spec.loader = _RegisteringLoader(spec.loader)
+                return spec
+        return None
+
+
+def install():
+    """Register the Greenplum Alembic implementation, operations and comparators when alembic gets imported
+
+    Note:
+        Alembic takes a while to import and most processes using the dialect never migrate anything, so instead of
+        importing alembic with the dialect this registers the Greenplum support right after the alembic package is
+        imported, or right away when it is already.
+    """
+    with _lock:
+        if 'alembic' in sys.modules:
+            _register()
+        elif not any(isinstance(finder, _AlembicFinder) for finder in sys.meta_path):
+            sys.meta_path.insert(0, _AlembicFinder())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy_greenplum import copy as gp_copy
+
+COPY_FORMATS = ('text', 'csv', 'binary')
+
+# The amount of COPY text handed to the driver at a time
+COPY_CHUNK_SIZE = 65536
+
+
+async def stream_chunks(stream, chunk_size=COPY_CHUNK_SIZE):
+    """Read a CopyInStream as an async iterator of chunks of COPY text"""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+async def _rows(rows):
+    if hasattr(rows, '__aiter__'):
+        async for row in rows:
+            yield row
+    else:
+        for row in rows:
+            yield row
+
+
+async def _row_chunks(rows, processors, counter, chunk_size):
+    lines = []
+    length = 0
+    async for row in _rows(rows):
+        line = gp_copy.encode_copy_row([
+            processor(value) if processor is not None else value
+            for processor, value in zip(processors, row)
+        ])
+        lines.append(line)
+        length += len(line)
+        counter[0] += 1
+        if length >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+            length = 0
+    if lines:
+        yield ''.join(lines)
+
+
+def _greenplum_dialect(connection):
+    dialect = connection.dialect
+    if not getattr(dialect, 'is_async', False) or not hasattr(dialect, '_copy_in'):
+        raise exc.InvalidRequestError(
+            'COPY streaming needs an AsyncConnection of the greenplum+asyncpg or greenplum+psycopg_async dialect')
+    return dialect
+
+
+async def _driver_connection(connection):
+    """The adapted driver connection of an AsyncConnection, in a transaction begun like for a statement"""
+    if not connection.in_transaction():
+        await connection.begin()
+    raw_connection = await connection.get_raw_connection()
+    return raw_connection.dbapi_connection
+
+
+async def copy_in(connection, table, rows, columns=None, chunk_size=COPY_CHUNK_SIZE):
+    """Stream rows into a table through ``COPY ... FROM STDIN`` on an AsyncConnection
+
+    Note:
+        Rows are encoded in COPY text format after the bind processing of their column types and handed to the
+        driver in chunks of about ``chunk_size`` characters while they are produced, so an async generator of
+        rows is loaded without holding it in memory. The COPY is part of the transaction of the connection.
+
+    Args:
+        connection: an AsyncConnection of the greenplum+asyncpg or greenplum+psycopg_async dialect
+        table: the Table to load
+        rows: an iterable or async iterable of sequences of values, in the order of ``columns``
+        columns: the Columns (or column names) to load, all columns of the table by default
+
+    Returns:
+        The number of rows loaded
+    """
+    dialect = _greenplum_dialect(connection)
+    if columns is None:
+        columns = list(table.columns)
+    else:
+        columns = [table.c[column] if isinstance(column, str) else column for column in columns]
+    processors = [column.type._cached_bind_processor(dialect) for column in columns]
+    counter = [0]
+    await dialect._copy_in(
+        await _driver_connection(connection), table, columns, _row_chunks(rows, processors, counter, chunk_size))
+    return counter[0]
+
+
+async def copy_out(connection, statement, format='text'):
+    """Stream the result of a SELECT out through ``COPY (...) TO STDOUT`` on an AsyncConnection
+
+    Note:
+        Chunks are yielded as the server sends them, without waiting for the end of the query. Closing the
+        iterator before the end cancels the COPY with psycopg, which aborts the current transaction, while asyncpg
+        reads and discards the rest of it.
+
+    Args:
+        connection: an AsyncConnection of the greenplum+asyncpg or greenplum+psycopg_async dialect
+        statement: a Select, or a Table to copy all of
+        format: 'text', 'csv' or 'binary'
+
+    Returns:
+        An async iterator of bytes
+    """
+    dialect = _greenplum_dialect(connection)
+    if format not in COPY_FORMATS:
+        raise exc.ArgumentError('Unknown COPY format %r, expected one of %s' % (format, ', '.join(COPY_FORMATS)))
+    if isinstance(statement, sqlalchemy.Table):
+        statement = sqlalchemy.select(statement)
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    processors = compiled._bind_processors
+    params = dict(
+        (key, processors[key](value) if key in processors else value)
+        for key, value in params.items()
+    )
+    chunks = dialect._copy_out(await _driver_connection(connection), compiled, params, format)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        # an async generator is only closed by the event loop once collected, too late to abort the COPY
+        await chunks.aclose()
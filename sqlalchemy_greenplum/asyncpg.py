@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import asyncio
+
+from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg, PGExecutionContext_asyncpg
+from sqlalchemy.util import await_only
+from sqlalchemy_greenplum import async_copy as gp_async_copy
+from sqlalchemy_greenplum.dialect import GreenplumDialectMixin, GreenplumExecutionContextMixin
+
+
+class GreenplumExecutionContext_asyncpg(GreenplumExecutionContextMixin, PGExecutionContext_asyncpg):
+    """Execution context for Greenplum over asyncpg"""
+
+
+class GreenplumDialect_asyncpg(GreenplumDialectMixin, PGDialect_asyncpg):
+    """Greenplum dialect over asyncpg, for ``create_async_engine('greenplum+asyncpg://...')``
+
+    Note:
+        Inherits the driver specific parts from PGDialect_asyncpg. COPY goes straight to the asyncpg connection,
+        after beginning the transaction SQLAlchemy would otherwise begin with the next statement. A COPY out whose
+        iterator is closed before the end runs to completion, discarding the rest of its output.
+    """
+    supports_statement_cache = True
+    execution_ctx_cls = GreenplumExecutionContext_asyncpg
+
+    async def _begin(self, adapted_connection):
+        if not adapted_connection._started:
+            await adapted_connection._start_transaction()
+
+    async def _encoded(self, chunks):
+        # asyncpg always talks UTF8 to the server
+        async for chunk in chunks:
+            yield chunk.encode('utf-8')
+
+    async def _copy_in(self, adapted_connection, table, columns, chunks):
+        await self._begin(adapted_connection)
+        await adapted_connection.driver_connection.copy_to_table(
+            table.name, schema_name=table.schema, columns=[column.name for column in columns],
+            source=self._encoded(chunks))
+
+    async def _copy_out(self, adapted_connection, compiled, params, format):
+        await self._begin(adapted_connection)
+        args = [params[name] for name in compiled.positiontup]
+        query = compiled.string
+        if self.paramstyle == 'format':
+            # SQLAlchemy 1.4 renders %s placeholders the adapted cursor turns into $n
+            query = query % tuple('$%d' % position for position in range(1, len(args) + 1))
+        chunks = asyncio.Queue(maxsize=4)
+        closed = []
+
+        async def output(data):
+            if not closed:
+                await chunks.put(bytes(data))
+
+        copy = asyncio.ensure_future(adapted_connection.driver_connection.copy_from_query(
+            query, *args, output=output, format=format))
+        try:
+            while not copy.done() or not chunks.empty():
+                chunk = await self._next_chunk(chunks, copy)
+                if chunk is not None:
+                    yield chunk
+            copy.result()
+        finally:
+            if not copy.done():
+                # asyncpg can hang cancelling a COPY the server already finished, the rest is read and dropped instead
+                closed.append(True)
+                while not chunks.empty():
+                    chunks.get_nowait()
+                await copy
+
+    async def _next_chunk(self, chunks, copy):
+        """The next chunk of a COPY out, or None when the COPY finished first"""
+        get = asyncio.ensure_future(chunks.get())
+        await asyncio.wait([get, copy], return_when=asyncio.FIRST_COMPLETED)
+        if get.done():
+            return get.result()
+        get.cancel()
+        return None
+
+    def _copy_from_stream(self, cursor, context, table, columns, stream):
+        await_only(self._copy_in(
+            context._dbapi_connection.dbapi_connection, table, columns, gp_async_copy.stream_chunks(stream)))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import logging
+import warnings
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy.sql import expression, operators
+
+from sqlalchemy_greenplum.staging import table_distribution
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+COLOCATION_CHECKS = ('log', 'warn', 'raise')
+
+
+class ColocationWarning(exc.SAWarning):
+    """A join of tables that are not co-located, which needs a Redistribute or Broadcast Motion"""
+
+
+class DistributedFrom(object):
+    """A Table (or an alias of one) in a FROM clause, with the distribution Greenplum gives it"""
+    def __init__(self, from_, table):
+        self.from_ = from_
+        self.table = table
+        self.distribution = table_distribution(table)
+
+    @property
+    def name(self):
+        return getattr(self.from_, 'name', None) or self.table.name
+
+    def describe(self):
+        if isinstance(self.distribution, list):
+            return '%s (distributed by %s)' % (self.name, ', '.join(self.distribution))
+        return '%s (distributed %s)' % (self.name, 'randomly' if self.distribution == 'RANDOM' else 'replicated')
+
+
+def _distributed_from(from_):
+    from_ = from_._deannotate()
+    table = from_.element if isinstance(from_, expression.Alias) else from_
+    if isinstance(table, sqlalchemy.Table):
+        return DistributedFrom(from_, table._deannotate())
+    return None
+
+
+def _base_froms(from_):
+    """The tables joined in a FROM object, None for the ones whose distribution is unknown (subqueries...)"""
+    if isinstance(from_, expression.Join):
+        return _base_froms(from_.left) + _base_froms(from_.right)
+    return [_distributed_from(from_)]
+
+
+def _equated_columns(onclause):
+    """The pairs of ``((from, column name), (from, column name))`` a join condition equates"""
+    pairs = set()
+    pending = [onclause] if onclause is not None else []
+    while pending:
+        clause = pending.pop()
+        if isinstance(clause, expression.BooleanClauseList) and clause.operator is operators.and_:
+            pending.extend(clause.clauses)
+        elif isinstance(clause, expression.BinaryExpression) and clause.operator is operators.eq:
+            left, right = clause.left, clause.right
+            if isinstance(left, expression.ColumnClause) and isinstance(right, expression.ColumnClause) and \
+                    left.table is not None and right.table is not None:
+                left = (left.table._deannotate(), left.name)
+                right = (right.table._deannotate(), right.name)
+                pairs.add((left, right))
+                pairs.add((right, left))
+    return pairs
+
+
+def colocated(left, right, equated):
+    """Whether a join of two DistributedFrom objects on the equated columns runs without motion"""
+    if left.distribution == 'REPLICATED' or right.distribution == 'REPLICATED':
+        return True
+    if not isinstance(left.distribution, list) or not isinstance(right.distribution, list):
+        return False
+    if len(left.distribution) != len(right.distribution):
+        return False
+    return all(
+        ((left.from_, left_name), (right.from_, right_name)) in equated
+        for left_name, right_name in zip(left.distribution, right.distribution)
+    )
+
+
+def join_finding(join):
+    """Describe why a Join needs a Redistribute or Broadcast Motion
+
+    Note:
+        A join is co-located when its condition equates the distribution columns of a table on the left with those
+        of a table on the right (in the order of the distribution keys), or when a side is replicated. Tables
+        without greenplum_distributed_by are taken as distributed by their primary key (or first column), as
+        Greenplum creates them. Joins involving a subquery are not judged.
+
+    Returns:
+        A message, or None when the join is co-located or cannot be judged
+    """
+    lefts, rights = _base_froms(join.left), _base_froms(join.right)
+    if any(side is None for side in lefts + rights):
+        return None
+    if all(side.distribution == 'REPLICATED' for side in lefts) or \
+            all(side.distribution == 'REPLICATED' for side in rights):
+        return None
+    equated = _equated_columns(join.onclause)
+    if any(colocated(left, right, equated) for left in lefts for right in rights):
+        return None
+    return 'Join of %s with %s is not co-located, it needs a Redistribute or Broadcast Motion' % (
+        ', '.join(side.describe() for side in lefts), ', '.join(side.describe() for side in rights))
+
+
+def report(check, finding):
+    """Report a finding the way the ``colocation_check`` dialect argument asks for"""
+    if callable(check):
+        check(finding)
+    elif check == 'log':
+        logger.warning(finding)
+    elif check == 'warn':
+        warnings.warn(finding, ColocationWarning, stacklevel=2)
+    else:
+        raise exc.CompileError(finding)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import decimal
+import functools
+import logging
+import queue
+import struct
+import threading
+import uuid
+
+from sqlalchemy import exc
+
+try:
+    # the client encoding names of psycopg2, only needed with its dialect
+    from psycopg2.extensions import encodings
+except ImportError:
+    encodings = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+BINARY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# days and microseconds between the PostgreSQL epoch (2000-01-01) and the Unix epoch
+_PG_EPOCH_DAYS = 10957
+_PG_EPOCH_MICROSECONDS = _PG_EPOCH_DAYS * 86400 * 1000000
+
+_unpack_int16 = struct.Struct('>h').unpack_from
+_unpack_int32 = struct.Struct('>i').unpack_from
+_unpack_numeric_header = struct.Struct('>hhhh').unpack_from
+
+
+def _decode_text(buf, pos, length, encoding='utf-8'):
+    return bytes(buf[pos:pos + length]).decode(encoding)
+
+
+def _decode_bytes(buf, pos, length):
+    return bytes(buf[pos:pos + length])
+
+
+def _decode_jsonb(buf, pos, length, encoding='utf-8'):
+    # the first byte is the jsonb format version
+    return bytes(buf[pos + 1:pos + length]).decode(encoding)
+
+
+def _decode_uuid(buf, pos, length):
+    return uuid.UUID(bytes=bytes(buf[pos:pos + length]))
+
+
+_NUMERIC_SPECIAL = {
+    -0x4000: decimal.Decimal('NaN'),         # 0xC000
+    -0x3000: decimal.Decimal('Infinity'),    # 0xD000
+    -0x1000: decimal.Decimal('-Infinity'),   # 0xF000
+}
+
+
+def _decode_numeric(buf, pos, length):
+    ndigits, weight, sign, dscale = _unpack_numeric_header(buf, pos)
+    if sign < 0:
+        return _NUMERIC_SPECIAL[sign]
+    value = 0
+    for digit in struct.unpack_from('>%dh' % ndigits, buf, pos + 8):
+        value = value * 10000 + digit
+    # scale the base 10000 digits to an integer with exactly dscale decimal places
+    shift = (weight + 1 - ndigits) * 4 + dscale
+    value = value * 10 ** shift if shift >= 0 else value // 10 ** -shift
+    return decimal.Decimal('%s%de-%d' % ('-' if sign else '', value, dscale))
+
+
+class _Column(object):
+    """How one result column is decoded from COPY binary format and stored in a batch
+
+    Note:
+        Fixed width columns have a numpy ``wire`` dtype so runs of rows without NULLs can be decoded with a
+        single ``numpy.frombuffer``; ``convert`` turns the wire values into their ``dtype``.
+        Variable width columns are decoded field by field into Python objects.
+    """
+    def __init__(self, name, oid, wire=None, dtype=None, offset=0, decode=None, arrow_type=None):
+        self.name = name
+        self.oid = oid
+        self.wire = wire
+        self.dtype = dtype
+        self.offset = offset
+        self.decode = decode
+        self.arrow_type = arrow_type
+
+    @property
+    def width(self):
+        return numpy.dtype(self.wire).itemsize if self.wire else None
+
+    def convert(self, values):
+        values = numpy.asarray(values, dtype=self.wire)
+        if self.dtype[0] in 'Mm':
+            values = values.astype('i8')
+            if self.offset:
+                values = values + self.offset
+            return values.view(self.dtype)
+        return values.astype(self.dtype)
+
+
+_STRUCT_FORMATS = {'?': '>?', '>i2': '>h', '>i4': '>i', '>i8': '>q', '>u4': '>I', '>f4': '>f', '>f8': '>d'}
+
+
+def _fixed_decoder(wire):
+    unpack_from = struct.Struct(_STRUCT_FORMATS[wire]).unpack_from
+    return lambda buf, pos, length: unpack_from(buf, pos)[0]
+
+
+def _fixed(wire, dtype, offset=0, arrow_type=None):
+    return lambda name, oid, encoding='utf-8': _Column(
+        name, oid, wire=wire, dtype=dtype, offset=offset, arrow_type=arrow_type)
+
+
+def _variable(decode, arrow_type=None):
+    return lambda name, oid, encoding='utf-8': _Column(name, oid, decode=decode, arrow_type=arrow_type)
+
+
+def _text(decode):
+    # the server sends text in the client_encoding of the connection, also in binary format
+    return lambda name, oid, encoding='utf-8': _Column(name, oid, decode=functools.partial(decode, encoding=encoding))
+
+
+_COLUMN_TYPES = {
+    16: _fixed('?', '?'),                                               # bool
+    20: _fixed('>i8', 'i8'),                                            # int8
+    21: _fixed('>i2', 'i2'),                                            # int2
+    23: _fixed('>i4', 'i4'),                                            # int4
+    26: _fixed('>u4', 'u4'),                                            # oid
+    700: _fixed('>f4', 'f4'),                                           # float4
+    701: _fixed('>f8', 'f8'),                                           # float8
+    1082: _fixed('>i4', 'M8[D]', _PG_EPOCH_DAYS),                       # date
+    1083: _fixed('>i8', 'm8[us]', arrow_type='time'),                   # time
+    1114: _fixed('>i8', 'M8[us]', _PG_EPOCH_MICROSECONDS),              # timestamp
+    1184: _fixed('>i8', 'M8[us]', _PG_EPOCH_MICROSECONDS, 'timestamptz'),  # timestamptz
+    17: _variable(_decode_bytes),                                       # bytea
+    18: _text(_decode_text),                                            # char
+    19: _text(_decode_text),                                            # name
+    25: _text(_decode_text),                                            # text
+    114: _text(_decode_text),                                           # json
+    1042: _text(_decode_text),                                          # bpchar
+    1043: _text(_decode_text),                                          # varchar
+    1700: _variable(_decode_numeric),                                   # numeric
+    2950: _variable(_decode_uuid),                                      # uuid
+    3802: _text(_decode_jsonb),                                         # jsonb
+}
+
+
+class CopyBinaryDecoder(object):
+    """Incremental decoder of a ``COPY ... TO STDOUT WITH BINARY`` stream into column fragments
+
+    Note:
+        Feed the raw stream with ``feed`` and take decoded rows with ``decode(limit)``, which returns one list of
+        fragments per column. A fragment is a numpy array of NULL free values for fixed width columns, or a list
+        of Python values (None for NULL) otherwise.
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        self.done = False
+        self._buffer = b''
+        self._pos = 0
+        self._header_read = False
+        self._fixed = all(column.wire for column in columns)
+        self._decoders = [column.decode or _fixed_decoder(column.wire) for column in columns]
+        if self._fixed:
+            fields = [('count', '>i2')]
+            for i, column in enumerate(columns):
+                fields += [('length%d' % i, '>i4'), ('value%d' % i, column.wire)]
+            self._row_dtype = numpy.dtype(fields)
+            self._row_size = self._row_dtype.itemsize
+
+    def feed(self, data):
+        if self._pos:
+            self._buffer = self._buffer[self._pos:] + data
+            self._pos = 0
+        else:
+            self._buffer += data
+
+    def _read_header(self):
+        buf = self._buffer
+        if len(buf) < 19:
+            return False
+        if buf[:11] != BINARY_SIGNATURE:
+            raise exc.InvalidRequestError('Not a COPY binary stream')
+        extension_length = _unpack_int32(buf, 15)[0]
+        if len(buf) < 19 + extension_length:
+            return False
+        self._pos = 19 + extension_length
+        self._header_read = True
+        return True
+
+    def _decode_fixed_run(self, limit):
+        rows = min((len(self._buffer) - self._pos) // self._row_size, limit)
+        if rows <= 0:
+            return None
+        records = numpy.frombuffer(self._buffer, dtype=self._row_dtype, count=rows, offset=self._pos)
+        valid = records['count'] == len(self.columns)
+        for i, column in enumerate(self.columns):
+            valid &= records['length%d' % i] == column.width
+        if not valid.all():
+            # stop at the first row holding a NULL (or the trailer) and decode it field by field
+            rows = int(valid.argmin())
+            if not rows:
+                return None
+            records = records[:rows]
+        self._pos += rows * self._row_size
+        return [records['value%d' % i] for i in range(len(self.columns))]
+
+    def _decode_row(self, buf, pos):
+        """Decode the row starting at ``pos``
+
+        Returns:
+            A tuple of (position after the row, list of values), (position, None) for the trailer or
+            (None, None) when the row is not complete yet
+        """
+        end = len(buf)
+        if pos + 2 > end:
+            return None, None
+        (count,) = _unpack_int16(buf, pos)
+        if count == -1:
+            self.done = True
+            return pos + 2, None
+        if count != len(self.columns):
+            raise exc.InvalidRequestError('COPY row has %d fields, expected %d' % (count, len(self.columns)))
+        pos += 2
+        values = []
+        append = values.append
+        for decode in self._decoders:
+            if pos + 4 > end:
+                return None, None
+            (length,) = _unpack_int32(buf, pos)
+            pos += 4
+            if length == -1:
+                append(None)
+            elif pos + length > end:
+                return None, None
+            else:
+                append(decode(buf, pos, length))
+                pos += length
+        return pos, values
+
+    def decode(self, limit):
+        """Decode up to ``limit`` rows from the data fed so far
+
+        Returns:
+            A tuple of (number of rows decoded, list of fragments per column)
+        """
+        fragments = [[] for _ in self.columns]
+        decoded = 0
+        if not self._header_read and not self._read_header():
+            return decoded, fragments
+        rows = []
+        while decoded < limit and not self.done:
+            if self._fixed:
+                run = self._decode_fixed_run(limit - decoded)
+                if run is not None:
+                    for fragment, values in zip(fragments, run):
+                        fragment.append(values)
+                    decoded += len(run[0])
+                    continue
+            pos, values = self._decode_row(self._buffer, self._pos)
+            if pos is None:
+                break
+            self._pos = pos
+            if values is None:
+                break
+            decoded += 1
+            if self._fixed:
+                # a row holding NULLs, try the vectorised path again from the next row
+                for fragment, value in zip(fragments, values):
+                    fragment.append([value])
+            else:
+                rows.append(values)
+        if rows:
+            for fragment, values in zip(fragments, zip(*rows)):
+                fragment.append(list(values))
+        return decoded, fragments
+
+
+class _CopyOutStream(object):
+    """File like object ``copy_expert`` writes to, handing chunks of about ``chunk_size`` bytes to a queue"""
+    def __init__(self, chunks, chunk_size, cancelled):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._cancelled = cancelled
+        self._parts = []
+        self._size = 0
+
+    def write(self, data):
+        if self._cancelled.is_set():
+            return
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            self._chunks.put(b''.join(self._parts))
+            self._parts = []
+            self._size = 0
+
+
+def _columns_for(connection, sql, encoding):
+    # also begins the transaction of the Connection the COPY then runs in
+    result = connection.exec_driver_sql('SELECT * FROM (%s) AS copy_query LIMIT 0' % sql.replace('%', '%%'))
+    description = result.cursor.description
+    result.close()
+    columns = []
+    for description in description:
+        column_type = _COLUMN_TYPES.get(description[1])
+        if column_type is None:
+            raise exc.ArgumentError(
+                'Column %r has a type (oid %d) that cannot be fetched as columns' % (description[0], description[1]))
+        columns.append(column_type(description[0], description[1], encoding))
+    return columns
+
+
+def _to_numpy(column, fragments):
+    if column.wire is None:
+        values = numpy.empty(sum(len(fragment) for fragment in fragments), dtype=object)
+        values[:] = [value for fragment in fragments for value in fragment]
+        return values
+    parts, masks = [], []
+    for fragment in fragments:
+        if isinstance(fragment, list):
+            mask = numpy.array([value is None for value in fragment], dtype=bool)
+            fragment = [0 if value is None else value for value in fragment]
+        else:
+            mask = numpy.zeros(len(fragment), dtype=bool)
+        parts.append(column.convert(fragment))
+        masks.append(mask)
+    values = numpy.concatenate(parts) if parts else column.convert([])
+    mask = numpy.concatenate(masks) if masks else numpy.zeros(0, dtype=bool)
+    if mask.any():
+        return numpy.ma.masked_array(values, mask=mask)
+    return values
+
+
+def _to_arrow(column, values):
+    if isinstance(values, numpy.ma.MaskedArray):
+        array = pyarrow.array(values.data, mask=values.mask)
+    elif values.dtype == object:
+        array = pyarrow.array(values.tolist())
+    else:
+        array = pyarrow.array(values)
+    if column.arrow_type == 'timestamptz':
+        array = array.cast(pyarrow.timestamp('us', tz='UTC'))
+    elif column.arrow_type == 'time':
+        array = pyarrow.array(
+            values.astype('i8').filled(0) if isinstance(values, numpy.ma.MaskedArray) else values.astype('i8'),
+            mask=numpy.ma.getmaskarray(values), type=pyarrow.time64('us'))
+    return array
+
+
+def fetch_column_batches(connection, statement, batch_size=65536, output='numpy', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Run a SELECT through ``COPY (...) TO STDOUT WITH BINARY`` and return its rows as column batches
+
+    Note:
+        The stream is decoded in chunks of about ``chunk_size`` bytes while the server is still sending, so memory
+        use depends on ``batch_size`` and not on the size of the result. Runs of rows without NULLs in tables of
+        fixed width columns (integers, floats, booleans, dates and timestamps) are decoded with numpy in one go.
+        Closing the iterator before the end cancels the COPY, which aborts the current transaction.
+
+    Args:
+        connection: the Connection to run the query on, of the psycopg2 based greenplum dialect
+        statement: a Select (or any SELECT statement)
+        batch_size: the maximum number of rows per batch
+        output: 'numpy' for dicts of column name to numpy array (masked arrays for fixed width columns holding
+            NULLs, object arrays for the others), or 'arrow' for pyarrow RecordBatches
+
+    Returns:
+        An iterator of batches
+    """
+    if numpy is None:
+        raise ImportError('numpy is required to fetch column batches')
+    if output == 'arrow' and pyarrow is None:
+        raise ImportError('pyarrow is required to fetch arrow record batches')
+    if output not in ('numpy', 'arrow'):
+        raise exc.ArgumentError('Unknown column batch output %r' % output)
+    if connection.dialect.driver != 'psycopg2' or encodings is None:
+        raise exc.InvalidRequestError('fetch_column_batches needs a Connection of the greenplum (psycopg2) dialect')
+
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect)
+    params = compiled.construct_params()
+    processors = compiled._bind_processors
+    params = dict(
+        (key, processors[key](value) if key in processors else value)
+        for key, value in params.items()
+    )
+    dbapi_connection = connection.connection
+    cursor = dbapi_connection.cursor()
+    encoding = encodings[dbapi_connection.encoding]
+    sql = cursor.mogrify(compiled.string, params).decode(encoding)
+    columns = _columns_for(connection, sql, encoding)
+    return _iterate_batches(dbapi_connection, cursor, sql, columns, batch_size, output, chunk_size)
+
+
+def _iterate_batches(dbapi_connection, cursor, sql, columns, batch_size, output, chunk_size):
+    chunks = queue.Queue(maxsize=4)
+    cancelled = threading.Event()
+    errors = []
+
+    def copy_out():
+        stream = _CopyOutStream(chunks, chunk_size, cancelled)
+        try:
+            cursor.copy_expert('COPY (%s) TO STDOUT WITH BINARY' % sql, stream)
+            stream.flush()
+        except Exception as err:
+            if not cancelled.is_set():
+                errors.append(err)
+        finally:
+            chunks.put(None)
+
+    thread = threading.Thread(target=copy_out, name='copy-binary-out')
+    thread.daemon = True
+    thread.start()
+
+    decoder = CopyBinaryDecoder(columns)
+    finished = stream_ended = False
+    try:
+        while not decoder.done:
+            fragments = [[] for _ in columns]
+            rows = 0
+            while rows < batch_size and not decoder.done:
+                decoded, new_fragments = decoder.decode(batch_size - rows)
+                rows += decoded
+                for fragment, new in zip(fragments, new_fragments):
+                    fragment.extend(new)
+                if decoded == 0 and not decoder.done:
+                    chunk = chunks.get()
+                    if chunk is None:
+                        stream_ended = True
+                        if errors:
+                            raise errors[0]
+                        raise exc.InvalidRequestError('COPY stream ended without a trailer')
+                    decoder.feed(chunk)
+            if rows:
+                arrays = [_to_numpy(column, fragment) for column, fragment in zip(columns, fragments)]
+                if output == 'arrow':
+                    yield pyarrow.RecordBatch.from_arrays(
+                        [_to_arrow(column, values) for column, values in zip(columns, arrays)],
+                        names=[column.name for column in columns])
+                else:
+                    yield dict((column.name, values) for column, values in zip(columns, arrays))
+        finished = True
+    finally:
+        if not finished:
+            cancelled.set()
+            dbapi_connection.cancel()
+        # let the copy thread run to completion, discarding what is left
+        while not stream_ended:
+            stream_ended = chunks.get() is None
+        thread.join()
+        if finished and errors:
+            raise errors[0]
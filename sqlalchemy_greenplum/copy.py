@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import datetime
+import decimal
+import math
+import uuid
+
+from sqlalchemy import types as sqltypes
+from sqlalchemy.sql import expression
+
+# Type affinities whose bound values can be written in COPY text format
+COPY_TEXT_AFFINITIES = (
+    sqltypes.Integer,
+    sqltypes.Numeric,
+    sqltypes.String,
+    sqltypes.Boolean,
+    sqltypes.Date,
+    sqltypes.DateTime,
+    sqltypes.Time,
+    sqltypes.Interval,
+    sqltypes.LargeBinary,
+    sqltypes.JSON,
+)
+
+_COPY_TEXT_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+})
+
+COPY_NULL = '\\N'
+
+
+def _encode_str(value):
+    return value.translate(_COPY_TEXT_ESCAPES)
+
+
+def _encode_bool(value):
+    return 't' if value else 'f'
+
+
+def _encode_float(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return repr(value)
+
+
+def _encode_timedelta(value):
+    return '%d days %d seconds %d microseconds' % (value.days, value.seconds, value.microseconds)
+
+
+def _encode_bytes(value):
+    return '\\\\x' + bytes(value).hex()
+
+
+def _encode_isoformat(value):
+    return value.isoformat()
+
+
+_COPY_TEXT_ENCODERS = {
+    str: _encode_str,
+    bool: _encode_bool,
+    int: str,
+    float: _encode_float,
+    decimal.Decimal: str,
+    datetime.datetime: _encode_isoformat,
+    datetime.date: _encode_isoformat,
+    datetime.time: _encode_isoformat,
+    datetime.timedelta: _encode_timedelta,
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_bytes,
+    uuid.UUID: str,
+}
+
+
+def _lookup_encoder(value_type):
+    for base_type in value_type.__mro__:
+        encoder = _COPY_TEXT_ENCODERS.get(base_type)
+        if encoder is not None:
+            # cache subclasses (e.g. enum.Enum mixed with str) for the next row
+            _COPY_TEXT_ENCODERS[value_type] = encoder
+            return encoder
+    raise TypeError(
+        'Cannot encode value of type %s for COPY' % value_type.__name__)
+
+
+def encode_copy_value(value):
+    """Render a single bound value as a field in PostgreSQL COPY text format"""
+    if value is None:
+        return COPY_NULL
+    encoder = _COPY_TEXT_ENCODERS.get(type(value))
+    if encoder is None:
+        encoder = _lookup_encoder(type(value))
+    return encoder(value)
+
+
+def encode_copy_row(values):
+    """Render a sequence of bound values as one line of COPY text format"""
+    return '\t'.join([encode_copy_value(value) for value in values]) + '\n'
+
+
+def supports_copy_type(type_, dialect):
+    """Whether values bound for the given SQLAlchemy type can be sent through COPY text format"""
+    impl = type_.dialect_impl(dialect)
+    if isinstance(impl, sqltypes.ARRAY):
+        return False
+    affinity = impl._type_affinity
+    if affinity is None:
+        return False
+    if issubclass(affinity, COPY_TEXT_AFFINITIES):
+        return True
+    # UUID has no generic affinity under SQLAlchemy 1.4
+    return affinity.__name__.upper() == 'UUID'
+
+
+class CopyInStream(object):
+    """A read-only file like object feeding rows to ``cursor.copy_expert``
+
+    Note:
+        Rows are encoded lazily as psycopg2 asks for more data, so only roughly one
+        read buffer worth of encoded text is held in memory at any time.
+    """
+    def __init__(self, rows):
+        self._lines = (encode_copy_row(row) for row in rows)
+        self._buffer = ''
+        self.row_count = 0
+
+    def _fill(self, size):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            self.row_count += 1
+            if size >= 0 and length >= size:
+                break
+        self._buffer = ''.join(chunks)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or len(self._buffer) < size:
+            self._fill(-1 if size is None else size)
+        if size is None or size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        if not self._buffer:
+            self._fill(1)
+        index = self._buffer.find('\n')
+        end = len(self._buffer) if index < 0 else index + 1
+        if size is not None and 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+def copy_from_statement(preparer, table, columns):
+    """Render the ``COPY ... FROM STDIN`` statement loading the given columns of a table"""
+    return 'COPY %s (%s) FROM STDIN' % (
+        preparer.format_table(table),
+        ', '.join(preparer.format_column(column) for column in columns)
+    )
+
+
+def copy_columns_for_insert(compiled, parameters):
+    """Work out the table columns an executemany INSERT can load with COPY
+
+    Returns:
+        A list of ``(column, bind_name)`` tuples, or None when the statement has to run
+        through the regular executemany path (RETURNING, INSERT FROM SELECT, ON CONFLICT,
+        inline SQL values or a column type that COPY cannot represent)
+    """
+    stmt = compiled.statement
+    if not compiled.isinsert or not isinstance(stmt, expression.Insert):
+        return None
+    if stmt._returning or getattr(compiled, 'returning', None) or \
+            getattr(compiled, 'effective_returning', None):
+        return None
+    if stmt.select is not None or stmt._post_values_clause is not None:
+        return None
+    if stmt._values or stmt._multi_values or stmt._prefixes:
+        return None
+    if not parameters or not isinstance(parameters[0], dict):
+        return None
+
+    dialect = compiled.dialect
+    keys = parameters[0]
+    columns = []
+    for column in stmt.table.columns:
+        bind_name = compiled.escaped_bind_names.get(column.key, column.key)
+        if bind_name in keys:
+            if not supports_copy_type(column.type, dialect):
+                return None
+            columns.append((column, bind_name))
+        elif column.default is not None and \
+                (column.default.is_sequence or column.default.is_clause_element):
+            # the INSERT renders this default inline, COPY would not
+            return None
+    if len(columns) != len(keys):
+        return None
+    return columns
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from sqlalchemy.schema import DDLElement
+
+
+class CreateExternalTable(DDLElement):
+    """Represent a CREATE [WRITABLE] EXTERNAL TABLE statement
+
+    Note:
+        The columns and name are taken from the given Table, constraints and defaults are ignored as
+        Greenplum does not support them on external tables.
+        Options (by example):
+          location = ['gpfdist://etlhost:8081/*.txt'] one or more URIs the segments read from or write to
+          format = 'CSV' the external data format, TEXT or CSV (or CUSTOM)
+          format_options = {'delimiter': ',', 'header': True} rendered as (DELIMITER ',' HEADER)
+          encoding = 'UTF8'
+          writable = True to create a WRITABLE external table
+          web = True to create an EXTERNAL WEB table
+          temporary = True to create a TEMPORARY external table
+          log_errors = True to log rows rejected by the segment reject limit, which has to be given too
+          reject_limit = 100 the SEGMENT REJECT LIMIT for readable tables
+          reject_limit_type = 'ROWS' or 'PERCENT'
+          distributed_by = '"ID"' the distribution of a writable table, defaults to greenplum_distributed_by
+    """
+    __visit_name__ = 'create_external_table'
+
+    def __init__(self, element, location, format='TEXT', format_options=None, encoding=None, writable=False,
+                 web=False, temporary=False, log_errors=False, reject_limit=None, reject_limit_type='ROWS',
+                 distributed_by=None):
+        self.element = element
+        if isinstance(location, str):
+            location = [location]
+        self.location = list(location)
+        self.format = format
+        self.format_options = format_options or {}
+        self.encoding = encoding
+        self.writable = writable
+        self.web = web
+        self.temporary = temporary
+        self.log_errors = log_errors
+        self.reject_limit = reject_limit
+        self.reject_limit_type = reject_limit_type
+        self.distributed_by = distributed_by
+
+
+class DropExternalTable(DDLElement):
+    """Represent a DROP EXTERNAL TABLE statement"""
+    __visit_name__ = 'drop_external_table'
+
+    def __init__(self, element, if_exists=False, web=False):
+        self.element = element
+        self.if_exists = if_exists
+        self.web = web
+
+
+class AddPartition(DDLElement):
+    """Represent an ALTER TABLE ... ADD [DEFAULT] PARTITION statement
+
+    Note:
+        ``partition`` is a RangePartition, ListPartition or DefaultPartition, e.g. the next period of a rolling
+        window: AddPartition(sales, RangePartition('2024_01', start=date(2024, 1, 1), end=date(2024, 2, 1)))
+    """
+    __visit_name__ = 'add_partition'
+
+    def __init__(self, element, partition):
+        self.element = element
+        self.partition = partition
+
+
+class DropPartition(DDLElement):
+    """Represent an ALTER TABLE ... DROP [DEFAULT] PARTITION statement
+
+    Note:
+        ``partition`` is the partition name or a PartitionFor(value), ``default`` drops the default partition.
+    """
+    __visit_name__ = 'drop_partition'
+
+    def __init__(self, element, partition=None, default=False, if_exists=False):
+        self.element = element
+        self.partition = partition
+        self.default = default
+        self.if_exists = if_exists
+
+
+class SplitPartition(DDLElement):
+    """Represent an ALTER TABLE ... SPLIT [DEFAULT] PARTITION statement
+
+    Note:
+        A range partition is split ``at`` a value, a list partition ``at`` a list of values, into the two
+        partitions named by ``into``. The default partition is split with ``start`` and ``end`` instead, into the
+        new partition and the default partition (named by the second name of ``into``).
+    """
+    __visit_name__ = 'split_partition'
+
+    def __init__(self, element, into, partition=None, default=False, at=None, start=None, end=None):
+        self.element = element
+        self.into = list(into)
+        self.partition = partition
+        self.default = default
+        self.at = at
+        self.start = start
+        self.end = end
+
+
+class ExchangePartition(DDLElement):
+    """Represent an ALTER TABLE ... EXCHANGE [DEFAULT] PARTITION ... WITH TABLE statement
+
+    Note:
+        Swaps the data of a partition with the data of a table of the same structure. ``with_validation=False``
+        skips checking the rows of the table against the partition bounds.
+    """
+    __visit_name__ = 'exchange_partition'
+
+    def __init__(self, element, table, partition=None, default=False, with_validation=True):
+        self.element = element
+        self.table = table
+        self.partition = partition
+        self.default = default
+        self.with_validation = with_validation
+
+
+class SetDistributedBy(DDLElement):
+    """Represent an ALTER TABLE ... SET [WITH (REORGANIZE=...)] DISTRIBUTED ... statement
+
+    Note:
+        ``distributed_by`` takes the values of greenplum_distributed_by: 'RANDOM', 'REPLICATED' or the (quoted)
+        distribution columns. Changing the distribution key redistributes the rows; ``reorganize=False`` only
+        changes the policy and leaves the rows where they are, ``reorganize=True`` redistributes them even when the
+        policy does not change.
+    """
+    __visit_name__ = 'set_distributed_by'
+
+    def __init__(self, element, distributed_by, reorganize=None):
+        self.element = element
+        self.distributed_by = distributed_by
+        self.reorganize = reorganize
+
+
+class ReorganizeTable(DDLElement):
+    """Represent an ALTER TABLE ... SET WITH (REORGANIZE=true) statement
+
+    Note:
+        Rewrites the table, redistributing its rows with its current policy, which also compacts the table.
+    """
+    __visit_name__ = 'reorganize_table'
+
+    def __init__(self, element):
+        self.element = element
+
+
+class ExpandTable(DDLElement):
+    """Represent an ALTER TABLE ... EXPAND TABLE statement (Greenplum 6 and later)
+
+    Note:
+        Redistributes the rows of a table onto the segments added to the cluster since it was created.
+    """
+    __visit_name__ = 'expand_table'
+
+    def __init__(self, element):
+        self.element = element
+
+
+class SetStorageParams(DDLElement):
+    """Represent an ALTER TABLE ... SET WITH (storage parameters) statement
+
+    Note:
+        ``storage_params`` is a string like greenplum_storage_params, or a dict of the typed storage options
+        (appendoptimized, orientation, compresstype, compresslevel, blocksize). Changing the storage of a table
+        rewrites it and needs Greenplum 7.
+    """
+    __visit_name__ = 'set_storage_params'
+
+    def __init__(self, element, storage_params, reorganize=None):
+        self.element = element
+        self.storage_params = storage_params
+        self.reorganize = reorganize
+
+
+class RenameTable(DDLElement):
+    """Represent an ALTER TABLE ... RENAME TO statement, the table keeps its schema"""
+    __visit_name__ = 'rename_table'
+
+    def __init__(self, element, name):
+        self.element = element
+        self.name = name
+
+
+class Analyze(DDLElement):
+    """Represent an ANALYZE statement, collecting the planner statistics of a table
+
+    Note:
+        ``columns`` limits the statistics to the given columns (or column names). ``rootpartition=True`` collects
+        the statistics of the root of a partitioned table only, which GPORCA plans with (Greenplum 5 and later).
+    """
+    __visit_name__ = 'analyze'
+
+    def __init__(self, element, columns=None, rootpartition=False):
+        self.element = element
+        self.columns = columns
+        self.rootpartition = rootpartition
@@ -3,10 +3,33 @@
 
 import sqlalchemy
 import sqlalchemy.dialects.postgresql.base as base
-from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2, PGIdentifierPreparer_psycopg2
-from sqlalchemy.sql import compiler, expression, coercions, roles
-from sqlalchemy_greenplum import alembic_gp
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2, PGIdentifierPreparer_psycopg2, \
+    PGExecutionContext_psycopg2
+from sqlalchemy.sql import compiler, expression, coercions, roles, sqltypes
+from sqlalchemy_greenplum import alembic_hook
+from sqlalchemy_greenplum import colocation as gp_colocation
+from sqlalchemy_greenplum import copy as gp_copy
+from sqlalchemy_greenplum import ddl as gp_ddl
+from sqlalchemy_greenplum import explain as gp_explain
+from sqlalchemy_greenplum import health as gp_health
+from sqlalchemy_greenplum import partition as gp_partition
+from sqlalchemy_greenplum import reflection as gp_reflection
+from sqlalchemy_greenplum import settings as gp_settings
+from sqlalchemy_greenplum import staging as gp_staging
+from sqlalchemy.engine import reflection
+import concurrent.futures
+import datetime
 import logging
+import random
+import re
+import threading
+import weakref
+
+try:
+    from sqlalchemy.engine.interfaces import ExecuteStyle
+except ImportError:
+    # SQLAlchemy 1.4 always runs executemany through do_executemany
+    ExecuteStyle = None
 
 # from https://github.com/greenplum-db/gpdb/blob/aa5fe3d52a20e26fb6883cad3d44bbe3addcb734/src/include/parser/kwlist.h
 RESERVED_WORDS = {
@@ -31,8 +54,30 @@ RESERVED_WORDS = {
     "similar", "verbose"
 }
 
+EXTERNAL_FORMATS = re.compile(r'^(?:text|csv|custom)$', re.I)
+REJECT_LIMIT_TYPES = re.compile(r'^(?:rows|percent)$', re.I)
+ORIENTATIONS = re.compile(r'^(?:row|column)$', re.I)
+COMPRESS_TYPES = re.compile(r'^(?:none|zlib|zstd|quicklz|rle_type)$', re.I)
+STORAGE_OPTIONS = ('appendoptimized', 'orientation', 'compresstype', 'compresslevel', 'blocksize')
+ENCODING_OPTIONS = ('compresstype', 'compresslevel', 'blocksize')
+DDL_STATEMENT = re.compile(r'^\s*(?:create|alter|drop|comment)\b', re.I)
+
+AUTO_ANALYZE_MODES = ('commit', 'background')
+
+GREENPLUM_VERSION = re.compile(r'Greenplum Database (\d+)\.(\d+)(?:\.(\d+))?')
+
 logger = logging.getLogger('sqlalchemy.dialects.postgresql')
 
+alembic_hook.install()
+
+
+def parse_greenplum_version(version):
+    """Parse the Greenplum release out of a version() string, None if it is not a Greenplum server"""
+    m = GREENPLUM_VERSION.search(version)
+    if not m:
+        return None
+    return tuple([int(x) for x in m.group(1, 2, 3) if x is not None])
+
 
 class GreenplumDDLCompiler(base.PGDDLCompiler):
     """ Specific DDL Compiler for Greenplum
@@ -49,6 +94,11 @@ class GreenplumDDLCompiler(base.PGDDLCompiler):
             specified in addition for Greenplum.
             Options for this dialect include (by example):
               greenplum_storage_params = 'OIDS=FALSE,APPENDONLY=TRUE' a string specifying the options (for now)
+              greenplum_appendoptimized = True
+              greenplum_orientation = 'column' (or 'row')
+              greenplum_compresstype = 'zstd' (or 'zlib', 'rle_type', 'quicklz', 'none')
+              greenplum_compresslevel = 5
+              greenplum_blocksize = 65536
               greenplum_distributed_by = '"Name"' a string specifying the distribution fields
               greenplum_inherits = 'some_supertable'
               greenplum_on_commit = 'PRESERVE ROWS'
@@ -66,9 +116,10 @@ class GreenplumDDLCompiler(base.PGDDLCompiler):
                 ', '.join(self.preparer.quote(name) for name in inherits) +
                 ' )')
 
-        if gp_opts['storage_params']:
+        storage_params = self._table_storage_params(table)
+        if storage_params:
             table_opts.append(
-                '\n WITH ({0})'.format(gp_opts['storage_params']).upper()
+                '\n WITH ({0})'.format(storage_params).upper()
             )
 
         if gp_opts['on_commit']:
@@ -82,36 +133,402 @@ class GreenplumDDLCompiler(base.PGDDLCompiler):
             )
 
         if gp_opts['distributed_by']:
-            if gp_opts['distributed_by'].upper() == 'RANDOM':
-                table_opts.append('\n DISTRIBUTED RANDOMLY')
-            elif gp_opts['distributed_by'].upper() == 'REPLICA':
-                table_opts.append('\n DISTRIBUTED REPLICATED')
-            else:
-                table_opts.append('\n DISTRIBUTED BY ({0})'.format(gp_opts['distributed_by']))
+            table_opts.append('\n ' + self._distributed_by_clause(gp_opts['distributed_by']))
 
-        if gp_opts['partition_by']:
-            table_opts.append('\n PARTITION BY %s' % gp_opts['partition_by'])
+        partition_by = gp_opts['partition_by']
+        if isinstance(partition_by, gp_partition.PartitionBy):
+            table_opts.append('\n ' + self._partition_by_clause(table, partition_by))
+        elif partition_by:
+            table_opts.append('\n PARTITION BY %s' % partition_by)
 
         return ''.join(table_opts)
 
+    def _storage_option(self, name, value):
+        if name == 'appendoptimized':
+            return '%s=%s' % (name, 'true' if value else 'false')
+        if name == 'orientation':
+            value = self.preparer.validate_sql_phrase(value, ORIENTATIONS)
+        elif name == 'compresstype':
+            value = self.preparer.validate_sql_phrase(value, COMPRESS_TYPES)
+        elif name == 'compresslevel':
+            value = int(value)
+            if not 0 <= value <= 19:
+                raise sqlalchemy.exc.CompileError('compresslevel must be between 0 and 19, not %d' % value)
+        elif name == 'blocksize':
+            value = int(value)
+            if not 8192 <= value <= 2097152 or value % 8192:
+                raise sqlalchemy.exc.CompileError(
+                    'blocksize must be a multiple of 8192 between 8192 and 2097152, not %d' % value)
+        else:
+            raise sqlalchemy.exc.CompileError('Unknown storage option %r' % name)
+        return '%s=%s' % (name, value)
+
+    def _table_storage_params(self, table):
+        gp_opts = table.dialect_options['greenplum']
+        options = [gp_opts['storage_params']] if gp_opts['storage_params'] else []
+        typed = [(name, gp_opts[name]) for name in STORAGE_OPTIONS if gp_opts[name] is not None]
+        if typed and not self._is_append_optimized(table):
+            raise sqlalchemy.exc.CompileError(
+                'Orientation and compression options need an append optimized table, set greenplum_appendoptimized')
+        options.extend(self._storage_option(name, value) for name, value in typed)
+        return ','.join(options)
+
+    def _is_append_optimized(self, table):
+        gp_opts = table.dialect_options['greenplum']
+        if gp_opts['appendoptimized'] is not None:
+            return bool(gp_opts['appendoptimized'])
+        storage_params = (gp_opts['storage_params'] or '').replace(' ', '').lower()
+        return 'appendonly=true' in storage_params or 'appendoptimized=true' in storage_params
+
+    def _is_column_oriented(self, table):
+        gp_opts = table.dialect_options['greenplum']
+        if gp_opts['orientation'] is not None:
+            return gp_opts['orientation'].lower() == 'column'
+        return 'orientation=column' in (gp_opts['storage_params'] or '').replace(' ', '').lower()
+
+    def get_column_specification(self, column, **kwargs):
+        colspec = super(GreenplumDDLCompiler, self).get_column_specification(column, **kwargs)
+        encoding = column.dialect_options['greenplum']['encoding']
+        if encoding:
+            if column.table is not None and not self._is_column_oriented(column.table):
+                raise sqlalchemy.exc.CompileError(
+                    'Column %r has an ENCODING, which needs a column oriented append optimized table' % column.name)
+            for name in encoding:
+                if name not in ENCODING_OPTIONS:
+                    raise sqlalchemy.exc.CompileError('Unknown column encoding option %r' % name)
+            colspec += ' ENCODING (%s)' % ', '.join(
+                self._storage_option(name, value) for name, value in encoding.items())
+        return colspec
+
+    def _distributed_by_clause(self, distributed_by):
+        if distributed_by.upper() == 'RANDOM':
+            return 'DISTRIBUTED RANDOMLY'
+        elif distributed_by.upper() in ('REPLICA', 'REPLICATED'):
+            return 'DISTRIBUTED REPLICATED'
+        else:
+            return 'DISTRIBUTED BY ({0})'.format(distributed_by)
+
+    def _partition_value(self, value):
+        if isinstance(value, expression.ClauseElement):
+            return self.sql_compiler.process(value, literal_binds=True)
+        if isinstance(value, datetime.datetime):
+            return "TIMESTAMP%s '%s'" % (' WITH TIME ZONE' if value.tzinfo else '', value.isoformat(' '))
+        if isinstance(value, datetime.date):
+            return "DATE '%s'" % value.isoformat()
+        return self.sql_compiler.process(expression.literal(value), literal_binds=True)
+
+    def _partition_every(self, every):
+        if isinstance(every, datetime.timedelta):
+            return "INTERVAL '%d days %d seconds %d microseconds'" % (every.days, every.seconds, every.microseconds)
+        if isinstance(every, str):
+            return 'INTERVAL %s' % self.sql_compiler.render_literal_value(every, sqltypes.String())
+        return self._partition_value(every)
+
+    def _partition_storage_params(self, storage_params):
+        if isinstance(storage_params, dict):
+            storage_params = ','.join('%s=%s' % item for item in storage_params.items())
+        return 'WITH ({0})'.format(storage_params).upper()
+
+    def _partition_name(self, partition, keyword):
+        if partition.name is None:
+            if isinstance(partition, gp_partition.ListPartition):
+                raise sqlalchemy.exc.CompileError('List partitions need a name')
+            return ''
+        return '%s %s ' % (keyword, self.preparer.quote(partition.name))
+
+    def _verify_partitions(self, table, partition_by):
+        if partition_by.column not in table.c:
+            raise sqlalchemy.exc.CompileError(
+                'Partition column %r is not a column of table %r' % (partition_by.column, table.name))
+        partition_type = {
+            'RANGE': gp_partition.RangePartition,
+            'LIST': gp_partition.ListPartition,
+        }[partition_by.strategy]
+        names = set()
+        defaults = 0
+        ranges = []
+        for partition in partition_by.partitions:
+            if isinstance(partition, gp_partition.DefaultPartition):
+                defaults += 1
+            elif not isinstance(partition, partition_type):
+                raise sqlalchemy.exc.CompileError(
+                    '%s partitioning cannot have a %s' % (partition_by.strategy, type(partition).__name__))
+            elif partition_type is gp_partition.RangePartition:
+                if partition.start is None and partition.end is None:
+                    raise sqlalchemy.exc.CompileError('Range partitions need a start or an end')
+                if partition.every is not None and (partition.start is None or partition.end is None):
+                    raise sqlalchemy.exc.CompileError('Range partitions with EVERY need a start and an end')
+                ranges.append(partition)
+            elif not partition.values:
+                raise sqlalchemy.exc.CompileError('List partition %r has no values' % partition.name)
+            if partition.name is not None:
+                if partition.name in names:
+                    raise sqlalchemy.exc.CompileError('Duplicate partition name %r' % partition.name)
+                names.add(partition.name)
+        if defaults > 1:
+            raise sqlalchemy.exc.CompileError('There can only be one default partition')
+        self._verify_ranges(ranges)
+
+    def _verify_ranges(self, ranges):
+        # bounds given as SQL expressions cannot be compared here, leave them to the server
+        bounded = [
+            partition for partition in ranges
+            if partition.start is not None and partition.end is not None and
+            not isinstance(partition.start, expression.ClauseElement) and
+            not isinstance(partition.end, expression.ClauseElement)
+        ]
+        try:
+            bounded.sort(key=lambda partition: partition.start)
+            for partition in bounded:
+                if partition.end < partition.start:
+                    raise sqlalchemy.exc.CompileError(
+                        'Range partition %r ends before it starts' % (partition.name or partition.start, ))
+            for previous, partition in zip(bounded, bounded[1:]):
+                if partition.start < previous.end or (
+                        partition.start == previous.end and previous.end_inclusive and partition.start_inclusive):
+                    raise sqlalchemy.exc.CompileError(
+                        'Range partitions %r and %r overlap' % (
+                            previous.name or previous.start, partition.name or partition.start))
+        except TypeError:
+            # bounds of different types
+            pass
+
+    def _partition_element(self, table, partition_by, partition, level):
+        keyword = 'SUBPARTITION' if level else 'PARTITION'
+        if isinstance(partition, gp_partition.DefaultPartition):
+            text = 'DEFAULT %s %s' % (keyword, self.preparer.quote(partition.name))
+        elif isinstance(partition, gp_partition.RangePartition):
+            text = self._partition_name(partition, keyword)
+            bounds = []
+            if partition.start is not None:
+                bounds.append('START (%s) %s' % (
+                    self._partition_value(partition.start), 'INCLUSIVE' if partition.start_inclusive else 'EXCLUSIVE'))
+            if partition.end is not None:
+                bounds.append('END (%s) %s' % (
+                    self._partition_value(partition.end), 'INCLUSIVE' if partition.end_inclusive else 'EXCLUSIVE'))
+            if partition.every is not None:
+                bounds.append('EVERY (%s)' % self._partition_every(partition.every))
+            text += ' '.join(bounds)
+        else:
+            text = self._partition_name(partition, keyword)
+            text += 'VALUES (%s)' % ', '.join(self._partition_value(value) for value in partition.values)
+        if partition.storage_params:
+            text += ' ' + self._partition_storage_params(partition.storage_params)
+        if partition.tablespace:
+            text += ' TABLESPACE %s' % self.preparer.quote(partition.tablespace)
+        if partition.subpartitions:
+            subpartition_by = partition_by.subpartition_by
+            if subpartition_by is None:
+                raise sqlalchemy.exc.CompileError('Subpartitions need a subpartition_by')
+            if subpartition_by.partitions:
+                raise sqlalchemy.exc.CompileError('Subpartitions cannot be given along with a subpartition template')
+            text += ' ' + self._partition_list(
+                table, type(subpartition_by)(subpartition_by.column, partition.subpartitions), level + 1)
+        return text
+
+    def _partition_list(self, table, partition_by, level):
+        self._verify_partitions(table, partition_by)
+        indent = '\n' + '  ' * (level + 1)
+        return '(%s%s\n%s)' % (
+            indent,
+            (',' + indent).join(
+                self._partition_element(table, partition_by, partition, level)
+                for partition in partition_by.partitions),
+            '  ' * level)
+
+    def _partition_by_clause(self, table, partition_by, level=0):
+        text = '%s BY %s (%s)' % (
+            'SUBPARTITION' if level else 'PARTITION',
+            partition_by.strategy,
+            self.preparer.quote(partition_by.column))
+        subpartition_by = partition_by.subpartition_by
+        if subpartition_by is not None:
+            text += '\n ' + self._partition_by_clause(table, subpartition_by, level + 1)
+        if level:
+            if partition_by.partitions:
+                text += '\n SUBPARTITION TEMPLATE ' + self._partition_list(table, partition_by, level)
+        elif partition_by.partitions:
+            text += '\n ' + self._partition_list(table, partition_by, level)
+        return text
+
+    def _partition_ref(self, alter):
+        if alter.default:
+            return 'DEFAULT PARTITION'
+        if isinstance(alter.partition, gp_partition.PartitionFor):
+            return 'PARTITION FOR (%s)' % self._partition_value(alter.partition.value)
+        if alter.partition is None:
+            raise sqlalchemy.exc.CompileError('A partition name, PartitionFor or default=True is needed')
+        return 'PARTITION %s' % self.preparer.quote(alter.partition)
+
+    def visit_add_partition(self, add):
+        partition = add.partition
+        text = 'ALTER TABLE %s ADD ' % self.preparer.format_table(add.element)
+        partition_by = add.element.dialect_options['greenplum']['partition_by']
+        if isinstance(partition_by, gp_partition.PartitionBy):
+            self._verify_partitions(add.element, type(partition_by)(partition_by.column, [partition]))
+        else:
+            partition_by = gp_partition.PartitionBy(None)
+        return text + self._partition_element(add.element, partition_by, partition, 0)
+
+    def visit_drop_partition(self, drop):
+        text = 'ALTER TABLE %s DROP ' % self.preparer.format_table(drop.element)
+        ref = self._partition_ref(drop)
+        if drop.if_exists:
+            ref = ref.replace('PARTITION', 'PARTITION IF EXISTS', 1)
+        return text + ref
+
+    def visit_split_partition(self, split):
+        text = 'ALTER TABLE %s SPLIT %s' % (self.preparer.format_table(split.element), self._partition_ref(split))
+        if len(split.into) != 2:
+            raise sqlalchemy.exc.CompileError('A partition is split into two partitions')
+        if split.default:
+            if split.start is None and split.end is None:
+                raise sqlalchemy.exc.CompileError('Splitting the default partition needs a start or an end')
+            if split.start is not None:
+                text += ' START (%s) INCLUSIVE' % self._partition_value(split.start)
+            if split.end is not None:
+                text += ' END (%s) EXCLUSIVE' % self._partition_value(split.end)
+            return text + ' INTO (PARTITION %s, DEFAULT PARTITION %s)' % tuple(
+                self.preparer.quote(name) for name in split.into)
+        if split.at is None:
+            raise sqlalchemy.exc.CompileError('Splitting a partition needs the value to split it at')
+        at = split.at if isinstance(split.at, (list, tuple)) else [split.at]
+        return text + ' AT (%s) INTO (PARTITION %s, PARTITION %s)' % (
+            (', '.join(self._partition_value(value) for value in at), ) +
+            tuple(self.preparer.quote(name) for name in split.into))
+
+    def visit_exchange_partition(self, exchange):
+        text = 'ALTER TABLE %s EXCHANGE %s WITH TABLE %s' % (
+            self.preparer.format_table(exchange.element),
+            self._partition_ref(exchange),
+            self.preparer.format_table(exchange.table))
+        if not exchange.with_validation:
+            text += ' WITHOUT VALIDATION'
+        return text
+
+    def _reorganize_clause(self, reorganize):
+        return 'WITH (REORGANIZE=%s)' % ('TRUE' if reorganize else 'FALSE')
+
+    def visit_set_distributed_by(self, alter):
+        if not alter.distributed_by:
+            raise sqlalchemy.exc.CompileError('SET DISTRIBUTED needs the distribution, RANDOM or REPLICATED')
+        text = 'ALTER TABLE %s SET ' % self.preparer.format_table(alter.element)
+        if alter.reorganize is not None:
+            text += self._reorganize_clause(alter.reorganize) + ' '
+        return text + self._distributed_by_clause(alter.distributed_by)
+
+    def visit_reorganize_table(self, alter):
+        return 'ALTER TABLE %s SET %s' % (self.preparer.format_table(alter.element), self._reorganize_clause(True))
+
+    def visit_expand_table(self, alter):
+        greenplum_version = self.dialect.greenplum_version_info
+        if greenplum_version is not None and greenplum_version < (6, ):
+            raise sqlalchemy.exc.CompileError('EXPAND TABLE needs Greenplum 6 or later')
+        return 'ALTER TABLE %s EXPAND TABLE' % self.preparer.format_table(alter.element)
+
+    def visit_rename_table(self, alter):
+        return 'ALTER TABLE %s RENAME TO %s' % (
+            self.preparer.format_table(alter.element), self.preparer.quote(alter.name))
+
+    def visit_analyze(self, analyze):
+        text = 'ANALYZE '
+        if analyze.rootpartition:
+            greenplum_version = self.dialect.greenplum_version_info
+            if greenplum_version is not None and greenplum_version < (5, ):
+                raise sqlalchemy.exc.CompileError('ANALYZE ROOTPARTITION needs Greenplum 5 or later')
+            text += 'ROOTPARTITION '
+        text += self.preparer.format_table(analyze.element)
+        if analyze.columns:
+            text += ' (%s)' % ', '.join(
+                self.preparer.quote(column if isinstance(column, str) else column.name) for column in analyze.columns)
+        return text
+
+    def visit_set_storage_params(self, alter):
+        storage_params = alter.storage_params
+        if isinstance(storage_params, dict):
+            storage_params = ','.join(self._storage_option(name, value) for name, value in storage_params.items())
+        if alter.reorganize is not None:
+            storage_params = 'REORGANIZE=%s,%s' % ('TRUE' if alter.reorganize else 'FALSE', storage_params)
+        if not storage_params:
+            raise sqlalchemy.exc.CompileError('SET WITH needs storage parameters')
+        return 'ALTER TABLE %s SET WITH (%s)' % (self.preparer.format_table(alter.element), storage_params.upper())
+
+    def _external_format_options(self, format_options):
+        options = []
+        for name, value in format_options.items():
+            keyword = name.replace('_', ' ').upper()
+            if value is True:
+                options.append(keyword)
+            elif isinstance(value, (list, tuple)):
+                options.append('%s %s' % (keyword, ', '.join(self.preparer.quote(col) for col in value)))
+            else:
+                options.append('%s %s' % (keyword, self.sql_compiler.render_literal_value(value, sqltypes.String())))
+        return ' '.join(options)
+
+    def visit_create_external_table(self, create):
+        table = create.element
+        text = 'CREATE '
+        if create.writable:
+            text += 'WRITABLE '
+        text += 'EXTERNAL '
+        if create.web:
+            text += 'WEB '
+        if create.temporary:
+            text += 'TEMPORARY '
+        text += 'TABLE %s (' % self.preparer.format_table(table)
+        text += ', '.join(
+            '\n\t%s %s' % (
+                self.preparer.format_column(column),
+                self.dialect.type_compiler.process(column.type, type_expression=column)
+            )
+            for column in table.columns
+        )
+        text += '\n)'
+
+        text += '\n LOCATION (%s)' % ', '.join(
+            self.sql_compiler.render_literal_value(uri, sqltypes.String()) for uri in create.location)
+
+        text += "\n FORMAT '%s'" % self.preparer.validate_sql_phrase(create.format, EXTERNAL_FORMATS).upper()
+        if create.format_options:
+            text += ' (%s)' % self._external_format_options(create.format_options)
+
+        if create.encoding:
+            text += '\n ENCODING %s' % self.sql_compiler.render_literal_value(create.encoding, sqltypes.String())
+
+        if create.writable:
+            distributed_by = create.distributed_by or table.dialect_options['greenplum']['distributed_by']
+            if distributed_by:
+                text += '\n ' + self._distributed_by_clause(distributed_by)
+        else:
+            if create.log_errors:
+                if create.reject_limit is None:
+                    raise sqlalchemy.exc.CompileError(
+                        'LOG ERRORS needs a reject_limit, it is part of single row error handling')
+                text += '\n LOG ERRORS'
+            if create.reject_limit is not None:
+                text += '\n SEGMENT REJECT LIMIT %d %s' % (
+                    int(create.reject_limit),
+                    self.preparer.validate_sql_phrase(create.reject_limit_type, REJECT_LIMIT_TYPES).upper()
+                )
+        return text
+
+    def visit_drop_external_table(self, drop):
+        text = 'DROP EXTERNAL '
+        if drop.web:
+            text += 'WEB '
+        text += 'TABLE '
+        if drop.if_exists:
+            text += 'IF EXISTS '
+        return text + self.preparer.format_table(drop.element)
+
     def visit_create_index(self, create):
         preparer = self.preparer
         index = create.element
         self._verify_index_table(index)
         text = "CREATE "
         if index.unique:
-            distributed_by = index.table.dialect_options['greenplum']['distributed_by']
-            # logger.info('table_cols={}'.format(str(index.table.columns)))
-            if distributed_by is None:
-                primary_key_cols = [c.name for c in index.table.primary_key]
-                logger.info('primary_key_cols={}'.format(str(primary_key_cols)))
-                distributed_by_cols = primary_key_cols
-                if len(distributed_by_cols) == 0:
-                    distributed_by_cols = [index.table.columns[0]]
-            elif distributed_by == 'RANDOM':
-                distributed_by_cols = []
-            else:
-                distributed_by_cols = distributed_by.split(',')
+            distribution = gp_staging.table_distribution(index.table)
+            distributed_by_cols = distribution if isinstance(distribution, list) else []
             logger.info('distributed_by_cols={}'.format(str(distributed_by_cols)))
             index_cols = [c.name for c in index.columns]
             logger.info('index_cols={}'.format(str(index_cols)))
@@ -127,9 +544,17 @@ class GreenplumDDLCompiler(base.PGDDLCompiler):
         if create.if_not_exists:
             text += "IF NOT EXISTS "
 
-        text += "%s ON %s " % (
+        only = index.dialect_options['greenplum']['only']
+        if only:
+            greenplum_version = self.dialect.greenplum_version_info
+            if greenplum_version is not None and greenplum_version < (7, ) or \
+                    greenplum_version is None and self.dialect.server_version_info < (11, ):
+                raise sqlalchemy.exc.CompileError('CREATE INDEX ON ONLY needs Greenplum 7 or PostgreSQL 11')
+
+        text += "%s ON %s%s " % (
             self._prepared_index_name(index,
                                       include_schema=False),
+            "ONLY " if only else "",
             preparer.format_table(index.table)
         )
 
@@ -219,25 +644,296 @@ class GreenplumDDLCompiler(base.PGDDLCompiler):
 
 
 class GreenplumCompiler(base.PGCompiler):
-    pass
+    def visit_join(self, join, asfrom=False, **kwargs):
+        check = self.dialect.colocation_check
+        if check:
+            finding = gp_colocation.join_finding(join)
+            if finding is not None:
+                gp_colocation.report(check, finding)
+        return super(GreenplumCompiler, self).visit_join(join, asfrom=asfrom, **kwargs)
+
+    def visit_declare_parallel_retrieve_cursor(self, declare, **kw):
+        return 'DECLARE %s PARALLEL RETRIEVE CURSOR FOR %s' % (
+            self.preparer.quote(declare.name),
+            self.process(declare.element, **kw)
+        )
+
+    def _verify_on_conflict(self):
+        if not self.dialect._supports_on_conflict:
+            raise sqlalchemy.exc.CompileError('ON CONFLICT is not supported by this server, it requires Greenplum 7')
+
+    def visit_on_conflict_do_nothing(self, on_conflict, **kw):
+        self._verify_on_conflict()
+        return super(GreenplumCompiler, self).visit_on_conflict_do_nothing(on_conflict, **kw)
+
+    def visit_on_conflict_do_update(self, on_conflict, **kw):
+        self._verify_on_conflict()
+        return super(GreenplumCompiler, self).visit_on_conflict_do_update(on_conflict, **kw)
+
     # def format_from_hint_text(self, sqltext, table, hint, iscrud):
     #     if hint.upper() != 'ONLY':
     #         raise exc.CompileError("Unrecognized hint: %r" % hint)
     #     return "ONLY " + sqltext
 
 
+class GreenplumInspector(base.PGInspector):
+    """Inspector for Greenplum
+
+    Note:
+        With the ``reflection_cache_ttl`` dialect argument set, the Inspector caches into the ReflectionCache
+        shared by all engines with the same URL instead of a cache of its own.
+    """
+    @property
+    def info_cache(self):
+        return self._info_cache
+
+    @info_cache.setter
+    def info_cache(self, info_cache):
+        # the Inspector constructors assign a new dict once the dialect and engine are known
+        dialect = self.dialect
+        if dialect.reflection_cache_ttl is not None and not isinstance(info_cache, gp_reflection.ReflectionCache):
+            info_cache = gp_reflection.reflection_cache(
+                self.engine.url, dialect.reflection_cache_ttl, dialect.reflection_cache_size,
+                dialect.include_partitions)
+        self._info_cache = info_cache
+
+    def get_partitions(self, table_name, schema=None):
+        """Return the partitions of a partitioned table, subpartitions included
+
+        Each partition is a dictionary with these fields:
+
+            * name - the name of the partition table
+            * schema - the schema of the partition table
+            * partition_name - the name given in the partition definition (Greenplum 6 only)
+            * parent - the table (or partition for a subpartition) it belongs to
+            * level - 0 for the partitions of the table, 1 for their subpartitions and so on
+            * bound - the partition boundary as SQL text
+            * is_default - whether it is the default partition
+        """
+        with self._operation_context() as conn:
+            return self.dialect.get_partitions(conn, table_name, schema, info_cache=self.info_cache)
+
+    def _health_rows(self, query, schema):
+        with self._operation_context() as conn:
+            result = conn.execute(query, dict(schema=schema if schema is not None else self.default_schema_name))
+            return [dict(row._mapping) for row in result]
+
+    def get_table_health(self, schema=None):
+        """Return the size and the catalog statistics of every table of a schema
+
+        Note:
+            The health of tables is never cached. Each table is a dictionary with these fields:
+
+            * table_name
+            * access_method - 'heap', 'ao_row' or 'ao_column', None on PostgreSQL
+            * size_bytes - the size of the table, without its indexes and TOAST table
+            * total_size_bytes - the size including indexes and TOAST table
+            * estimated_rows - the row count as of the last ANALYZE or VACUUM
+            * pages, all_visible_pages - the pages of the table and the ones the visibility map marks as all visible
+            * visible_ratio - all_visible_pages / pages for heap tables, a low ratio calls for a VACUUM
+        """
+        tables = self._health_rows(gp_health.table_health_query(self.dialect), schema)
+        for table in tables:
+            table['visible_ratio'] = None if table['access_method'] in ('ao_row', 'ao_column') else \
+                gp_health.ratio(table['all_visible_pages'], table['pages'])
+        return tables
+
+    def get_segment_sizes(self, schema=None):
+        """Return how the on disk size of every table of a schema spreads over the segments
+
+        Note:
+            Only the catalogs of the segments are read, which makes this the fast way to spot skewed tables.
+            Each table is a dictionary with table_name, segments, size_bytes, max_segment_bytes, avg_segment_bytes
+            and skew, the ratio of the largest segment size to the average (1.0 for an even spread).
+        """
+        tables = self._health_rows(gp_health.segment_sizes_query(), schema)
+        for table in tables:
+            table['skew'] = gp_health.ratio(table['max_segment_bytes'], table['avg_segment_bytes'])
+        return tables
+
+    def get_segment_row_counts(self, table_name, schema=None):
+        """Return the number of rows of a table on each primary segment, by counting them
+
+        Returns:
+            A dictionary of segment content id to row count, segments without rows included
+        """
+        with self._operation_context() as conn:
+            counts = dict((segment_id, 0) for segment_id in conn.execute(gp_health.segment_ids_query()).scalars())
+            counts.update(conn.execute(gp_health.segment_row_counts_query(
+                self.dialect.identifier_preparer, table_name,
+                schema if schema is not None else self.default_schema_name)).fetchall())
+            return counts
+
+    def get_skew_coefficients(self, schema=None):
+        """Return the gp_toolkit.gp_skew_coefficients of the tables of a schema, which count their rows
+
+        Note:
+            Each table is a dictionary with table_name and skew_coefficient, the standard deviation of the per
+            segment row counts relative to their mean, 0 for an even spread.
+        """
+        return self._health_rows(gp_health.skew_coefficients_query(), schema)
+
+    def get_ao_bloat(self, schema=None):
+        """Return the hidden tuples of the append optimized tables of a schema
+
+        Note:
+            Each table is a dictionary with table_name, total_tuples, hidden_tuples and hidden_ratio, the share of
+            the stored tuples that are deleted or updated and wait for a VACUUM to be compacted away.
+        """
+        tables = self._health_rows(gp_health.ao_bloat_query(self.dialect), schema)
+        for table in tables:
+            table['hidden_ratio'] = gp_health.ratio(table['hidden_tuples'], table['total_tuples'])
+        return tables
+
+    def get_heap_bloat(self, schema=None):
+        """Return the heap tables of a schema gp_toolkit.gp_bloat_diag diagnoses as bloated
+
+        Note:
+            Each table is a dictionary with table_name, pages, expected_pages and diagnosis.
+        """
+        return self._health_rows(gp_health.heap_bloat_query(), schema)
+
+    def get_missing_statistics(self, schema=None):
+        """Return the tables of a schema gp_toolkit.gp_stats_missing reports without (complete) statistics
+
+        Note:
+            Each table is a dictionary with table_name, has_statistics (whether it has a row count and size),
+            columns and columns_with_statistics.
+        """
+        return self._health_rows(gp_health.missing_statistics_query(), schema)
+
+
 class GreenplumIdentifierPreparer(PGIdentifierPreparer_psycopg2):
     reserved_words = RESERVED_WORDS
 
 
-class GreenplumDialect(PGDialect_psycopg2):
-    """Pivotal Greenplum Dialect
+def _settings_key(dbapi_connection):
+    # the connection adapters of asyncio drivers cannot be weakly referenced, the driver connections can
+    return getattr(dbapi_connection, 'driver_connection', dbapi_connection)
+
+
+class GreenplumExecutionContextMixin(object):
+    """Execution context behaviour shared by the Greenplum dialects of all drivers
 
     Note:
-       Inherits most of the functionality from PGDialect_psycopg2
+        Decides at construction time whether an executemany INSERT is loaded through
+        ``COPY ... FROM STDIN`` instead of batched INSERT statements, whether an executemany UPDATE or
+        DELETE runs as a single statement joined to a staging table and whether the plan of the statement is
+        captured. Applies the ``greenplum_settings`` given to the statement before running it and restores the
+        previous values after it.
+        Empties the reflection cache of the engine after DDL and counts the rows written by INSERT, UPDATE and
+        DELETE statements for the automatic ANALYZE.
+    """
+    _greenplum_copy_columns = None
+    _greenplum_staging_columns = None
+    _greenplum_explain = None
+    _greenplum_previous_settings = None
+
+    @classmethod
+    def _init_compiled(cls, dialect, connection, dbapi_connection, execution_options, compiled, parameters,
+                       *args, **kw):
+        self = super(GreenplumExecutionContextMixin, cls)._init_compiled(
+            dialect, connection, dbapi_connection, execution_options, compiled, parameters, *args, **kw)
+
+        if self.executemany and self.isinsert:
+            copy_executemany = self.execution_options.get('greenplum_copy_executemany', dialect.copy_executemany)
+            if copy_executemany and len(self.parameters) >= dialect.copy_executemany_threshold:
+                self._greenplum_copy_columns = gp_copy.copy_columns_for_insert(self.compiled, self.parameters)
+                if self._greenplum_copy_columns is not None and ExecuteStyle is not None:
+                    # SQLAlchemy 2.0 would otherwise route the statement through insertmanyvalues
+                    self.execute_style = ExecuteStyle.EXECUTEMANY
+        elif self.executemany and (self.isupdate or self.isdelete):
+            set_based_executemany = self.execution_options.get(
+                'greenplum_set_based_executemany', dialect.set_based_executemany)
+            if set_based_executemany and len(self.parameters) >= dialect.set_based_executemany_threshold:
+                self._greenplum_staging_columns = gp_staging.staging_columns_for_executemany(
+                    self.compiled, self.parameters)
+        elif not self.executemany:
+            self._greenplum_explain = self._explain_mode(dialect)
+        return self
+
+    def _explain_mode(self, dialect):
+        explain = self.execution_options.get('greenplum_explain')
+        if explain is None:
+            explain = bool(dialect.explain_sample_rate) and random.random() < dialect.explain_sample_rate
+        if not explain:
+            return None
+        if getattr(self.compiled.statement, 'is_select', False):
+            # analyzing runs the statement a second time, only when asked for
+            return 'analyze' if explain == 'analyze' else 'plan'
+        if self.isinsert or self.isupdate or self.isdelete:
+            return 'plan'
+        return None
+
+    def pre_exec(self):
+        super(GreenplumExecutionContextMixin, self).pre_exec()
+        settings = self.execution_options.get('greenplum_settings')
+        # the settings of the engine or connection are session settings already
+        if settings is not None and settings is not self.root_connection._execution_options.get('greenplum_settings'):
+            # SET LOCAL has no effect outside of a transaction, the session settings are changed then
+            local = not getattr(self._dbapi_connection, 'autocommit', False)
+            previous = self.dialect._swap_settings(
+                self._dbapi_connection, gp_settings.resolve_settings(settings, self.dialect.settings_presets), local)
+            self._greenplum_previous_settings = previous, local
+
+    def _restore_settings(self):
+        previous, local = self._greenplum_previous_settings
+        self._greenplum_previous_settings = None
+        self.dialect._apply_settings(self._dbapi_connection, previous, local=local, commit=False)
+
+    def handle_dbapi_exception(self, e):
+        super(GreenplumExecutionContextMixin, self).handle_dbapi_exception(e)
+        # in a transaction its rollback undoes the SET LOCAL
+        if self._greenplum_previous_settings is not None and not self._greenplum_previous_settings[1]:
+            try:
+                self._restore_settings()
+            except Exception:
+                logger.exception('restoring the settings of the session failed')
+
+    def post_exec(self):
+        super(GreenplumExecutionContextMixin, self).post_exec()
+        if self._greenplum_previous_settings is not None:
+            self._restore_settings()
+        if self.dialect.reflection_cache_ttl is not None and (
+                self.isddl or DDL_STATEMENT.match(self.statement or '')):
+            gp_reflection.invalidate_reflection_cache(self.root_connection.engine.url)
+            # other connections may cache the old catalog until the transaction ends, invalidate again then
+            self.root_connection.info['greenplum_ddl_url'] = self.root_connection.engine.url
+        if self.dialect.auto_analyze and self.compiled is not None and (
+                self.isinsert or self.isupdate or self.isdelete) and \
+                self.execution_options.get('greenplum_auto_analyze', True):
+            self._count_rows_written()
+
+    def _count_rows_written(self):
+        """Add the rows written by the statement to the ones written by the transaction of the connection"""
+        if self.executemany and self.isinsert:
+            count = len(self.parameters)
+        else:
+            count = max(self.rowcount, 0)
+        if not count:
+            return
+        table = self.compiled.statement.table
+        if not isinstance(table, expression.TableClause):
+            return
+        dialect_options = getattr(table, 'dialect_options', None)
+        columns = dialect_options['greenplum']['analyze_columns'] if dialect_options is not None else None
+        written = self.root_connection.info.setdefault('greenplum_rows_written', {})
+        key = (table.schema, table.name)
+        written[key] = [written.get(key, [0])[0] + count, columns]
+
+
+class GreenplumExecutionContext(GreenplumExecutionContextMixin, PGExecutionContext_psycopg2):
+    """Execution context for Greenplum over psycopg2"""
+
+
+class GreenplumDialectMixin(object):
+    """Greenplum behaviour shared by the dialects of all drivers
+
+    Note:
+        Mixed in ahead of a PostgreSQL dialect of SQLAlchemy, which provides the driver specific parts. The dialect
+        has to implement ``_copy_from_stream`` for the COPY paths of executemany.
     """
     name = 'greenplum'
-    supports_statement_cache = True
     #supports_alter = True
     #max_identifier_length = 63
     #supports_sane_rowcount = True
@@ -258,12 +954,15 @@ class GreenplumDialect(PGDialect_psycopg2):
     #ischema_names = ischema_names
     #colspecs = colspecs
 
+    connection_characteristics = base.PGDialect.connection_characteristics.union({
+        'greenplum_settings': gp_settings.SettingsCharacteristic()
+    })
+
     statement_compiler = GreenplumCompiler
     ddl_compiler = GreenplumDDLCompiler
     #type_compiler = PGTypeCompiler
     preparer = GreenplumIdentifierPreparer
-    #execution_ctx_cls = PGExecutionContext
-    #inspector = PGInspector
+    inspector = GreenplumInspector
     #isolation_level = None
 
     construct_arguments = [
@@ -273,6 +972,7 @@ class GreenplumDialect(PGDialect_psycopg2):
             "where": None,
             "ops": {},
             "concurrently": False,
+            "only": False,
             "with": {},
             "tablespace": None
         }),
@@ -283,7 +983,16 @@ class GreenplumDialect(PGDialect_psycopg2):
             "on_commit": None,
             "inherits": None,
             "distributed_by": None,
-            "partition_by": None
+            "partition_by": None,
+            "appendoptimized": None,
+            "orientation": None,
+            "compresstype": None,
+            "compresslevel": None,
+            "blocksize": None,
+            "analyze_columns": None
+        }),
+        (sqlalchemy.schema.Column, {
+            "encoding": None
         }),
     ]
 
@@ -292,24 +1001,516 @@ class GreenplumDialect(PGDialect_psycopg2):
     #_backslash_escapes = True
     _supports_create_index_concurrently = False
     _supports_drop_index_concurrently = True
+    _supports_parallel_retrieve_cursor = None
+    _supports_on_conflict = True
+    greenplum_version_info = None
+
+    def __init__(self, copy_executemany=False, copy_executemany_threshold=1000, set_based_executemany=False,
+                 set_based_executemany_threshold=1000, include_partitions=False, reflection_cache_ttl=None,
+                 reflection_cache_size=10000, colocation_check=None, explain_sample_rate=0.0, explain_sink=None,
+                 auto_analyze=None, auto_analyze_threshold=100000, auto_analyze_fraction=0.1, session_settings=None,
+                 settings_presets=None, **kw):
+        """Construct the dialect
 
-    def __init__(self, *args, **kw):
-        super(GreenplumDialect, self).__init__(*args, **kw)
+        Args:
+            copy_executemany: load executemany INSERTs of at least ``copy_executemany_threshold`` rows
+                through ``COPY ... FROM STDIN``. Can be overridden per engine, connection or statement with the
+                ``greenplum_copy_executemany`` execution option.
+            copy_executemany_threshold: the minimum number of parameter sets for the COPY path to be used
+            set_based_executemany: run executemany UPDATEs and DELETEs that match rows by key, such as the bulk
+                updates and deletes of the ORM, as one UPDATE ... FROM or DELETE ... USING a temporary table
+                loaded through COPY, which needs the TEMP privilege. Off by default, can be overridden with the
+                ``greenplum_set_based_executemany`` execution option.
+            set_based_executemany_threshold: the minimum number of parameter sets for the set based path to be used
+            include_partitions: list (and so reflect) the child partitions of partitioned tables as tables of their
+                own, they are left out by default
+            reflection_cache_ttl: share reflected catalog information between Inspectors of engines with the same
+                URL for this many seconds, emptied whenever DDL is executed through the dialect or Alembic
+            reflection_cache_size: the number of reflection results kept, least recently used ones are evicted
+            colocation_check: check the JOINs of compiled statements against the distribution of the joined
+                tables, and report the ones needing a Redistribute or Broadcast Motion: 'log' logs a warning,
+                'warn' emits a ColocationWarning, 'raise' raises a CompileError and a callable is given the message
+            explain_sample_rate: the share of the statements whose plan is captured as if they had the
+                ``greenplum_explain=True`` execution option, 0.0 by default. Sampled statements are never analyzed.
+            explain_sink: a callable given the plan metrics of each captured statement, by default they are logged
+            auto_analyze: count the rows written to each table by INSERT, UPDATE and DELETE statements (not the
+                ones of text SQL) and ANALYZE the tables written to enough once the writes are committed: 'commit'
+                runs ANALYZE on the committing connection right after the commit, 'background' on a pooled
+                connection in a thread of its own (not for asyncio engines). Counting is skipped for statements
+                with the ``greenplum_auto_analyze=False`` execution option. ANALYZE is limited to the columns of
+                the ``greenplum_analyze_columns`` table option when given. Writing to leaf partitions instead of
+                the partitioned table analyzes only those partitions.
+            auto_analyze_threshold: ANALYZE a table once this many rows were written to it, None for no absolute
+                threshold
+            auto_analyze_fraction: ANALYZE a table once the rows written to it reach this fraction of its row
+                estimate, a table never analyzed on its first write, None to only use the threshold
+            session_settings: a dict of server settings (statement_mem, optimizer, gp_* ...) to their values, or the
+                name of a preset, set on each new connection
+            settings_presets: a dict of preset names to dicts of settings, for the ``greenplum_settings``
+                execution option. Given to an engine or a connection, the settings are changed for the session and
+                the ones changed are reset when the connection goes back to the pool. Given to a statement, they
+                are changed with SET LOCAL before it runs and set back once it ran (changed and set back for the
+                session in AUTOCOMMIT). With ``stream_results`` rows fetched later are fetched with the previous
+                settings.
+        """
+        super(GreenplumDialectMixin, self).__init__(**kw)
+        self.copy_executemany = copy_executemany
+        self.copy_executemany_threshold = copy_executemany_threshold
+        self.set_based_executemany = set_based_executemany
+        self.set_based_executemany_threshold = set_based_executemany_threshold
+        self.include_partitions = include_partitions
+        self.reflection_cache_ttl = reflection_cache_ttl
+        self.reflection_cache_size = reflection_cache_size
+        if colocation_check and not callable(colocation_check) and \
+                colocation_check not in gp_colocation.COLOCATION_CHECKS:
+            raise sqlalchemy.exc.ArgumentError('Unknown colocation_check %r, expected a callable or one of %s' % (
+                colocation_check, ', '.join(gp_colocation.COLOCATION_CHECKS)))
+        self.colocation_check = colocation_check
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_sink = explain_sink or gp_explain.logging_sink
+        if auto_analyze and auto_analyze not in AUTO_ANALYZE_MODES:
+            raise sqlalchemy.exc.ArgumentError('Unknown auto_analyze %r, expected one of %s' % (
+                auto_analyze, ', '.join(AUTO_ANALYZE_MODES)))
+        if auto_analyze == 'background' and self.is_async:
+            raise sqlalchemy.exc.ArgumentError("auto_analyze='background' is not supported by asyncio dialects")
+        self.auto_analyze = auto_analyze
+        self.auto_analyze_threshold = auto_analyze_threshold
+        self.auto_analyze_fraction = auto_analyze_fraction
+        # rows written per (schema, table name) by committed transactions since the table was last analyzed
+        self._rows_written = {}
+        self._rows_written_lock = threading.Lock()
+        self._auto_analyze_engine = None
+        self._auto_analyze_executor = None
+        self._auto_analyze_scheduled = False
+        self.settings_presets = settings_presets or {}
+        for preset in self.settings_presets.values():
+            gp_settings.resolve_settings(preset)
+        self.session_settings = gp_settings.resolve_settings(
+            session_settings, self.settings_presets) if session_settings else {}
+        # the settings changed per DBAPI connection by the greenplum_settings option, reset on pool return
+        self._changed_settings = weakref.WeakKeyDictionary()
 
     def initialize(self, connection):
-        super(GreenplumDialect, self).initialize(connection)
-        self.implicit_returning = False
-            # self.server_version_info > (8, 2) and self.__dict__.get('implicit_returning', True)
-
-    # def _get_server_version_info(self, connection):
-    #     v = connection.execute("select version()").scalar()
-    #     m = re.match(
-    #         r'.*(?:PostgreSQL|EnterpriseDB) '
-    #         r'(\d+)\.?(\d+)?(?:\.(\d+))?(?:\.\d+)?(?:devel|beta)?'
-    #         r'?.*(Greenplum Database) '
-    #         r'(\d+)\.?(\d+)?(?:\.(\d+))?(?:\.\d+)',
-    #         v)
-    #     if not m:
-    #         raise AssertionError(
-    #             "Could not determine version from string '%s'" % v)
-    #     return tuple([int(x) for x in m.group(1, 2, 3) if x is not None])
+        implicit_returning = self.__dict__.get('implicit_returning', True)
+        super(GreenplumDialectMixin, self).initialize(connection)
+        self.greenplum_version_info = self._get_greenplum_version_info(connection)
+        logger.debug('Greenplum version %s', self.greenplum_version_info)
+        self._set_greenplum_features(implicit_returning)
+        if self.auto_analyze == 'background':
+            self._auto_analyze_engine = weakref.ref(connection.engine)
+
+    def on_connect(self):
+        driver_on_connect = super(GreenplumDialectMixin, self).on_connect()
+        if not self.session_settings:
+            return driver_on_connect
+
+        def on_connect(dbapi_connection):
+            if driver_on_connect is not None:
+                driver_on_connect(dbapi_connection)
+            self._apply_settings(dbapi_connection, self.session_settings)
+        return on_connect
+
+    def _set_config_statement(self, settings, local):
+        return gp_settings.set_config_statement(settings, local, sqltypes.String().literal_processor(dialect=self))
+
+    def _apply_settings(self, dbapi_connection, settings, local=False, commit=True):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(self._set_config_statement(settings, local))
+        finally:
+            cursor.close()
+        if commit:
+            # a session setting changed in a transaction rolled back afterwards would be undone with it
+            dbapi_connection.commit()
+
+    def _swap_settings(self, dbapi_connection, settings, local):
+        """Change settings, returning their previous values"""
+        # a cursor of its own, a server side cursor runs a single statement
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(gp_settings.swap_settings_statement(
+                settings, local, sqltypes.String().literal_processor(dialect=self)))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return dict(zip(sorted(settings), row[0::2]))
+
+    def set_greenplum_settings(self, dbapi_connection, settings):
+        settings = gp_settings.resolve_settings(settings, self.settings_presets)
+        self._apply_settings(dbapi_connection, settings)
+        self._changed_settings.setdefault(_settings_key(dbapi_connection), {}).update(settings)
+
+    def get_greenplum_settings(self, dbapi_connection):
+        return dict(self._changed_settings.get(_settings_key(dbapi_connection), {}))
+
+    def reset_greenplum_settings(self, dbapi_connection):
+        """Set the settings changed on the connection back to the ones of the engine or their defaults"""
+        changed = self._changed_settings.pop(_settings_key(dbapi_connection), None)
+        if not changed:
+            return
+        restored = dict((name, value) for name, value in self.session_settings.items() if name in changed)
+        cursor = dbapi_connection.cursor()
+        try:
+            if restored:
+                cursor.execute(self._set_config_statement(restored, False))
+            for name in sorted(set(changed) - set(restored)):
+                cursor.execute('RESET %s' % name)
+        finally:
+            cursor.close()
+        dbapi_connection.commit()
+
+    def do_commit(self, dbapi_connection):
+        super(GreenplumDialectMixin, self).do_commit(dbapi_connection)
+        self._invalidate_after_ddl(dbapi_connection)
+        written = self._pop_connection_info(dbapi_connection, 'greenplum_rows_written')
+        if written:
+            self._add_rows_written(written)
+            if self.auto_analyze == 'commit':
+                self._run_auto_analyze(dbapi_connection)
+            else:
+                self._schedule_auto_analyze()
+
+    def do_rollback(self, dbapi_connection):
+        super(GreenplumDialectMixin, self).do_rollback(dbapi_connection)
+        self._invalidate_after_ddl(dbapi_connection)
+        self._pop_connection_info(dbapi_connection, 'greenplum_rows_written')
+
+    def _invalidate_after_ddl(self, dbapi_connection):
+        url = self._pop_connection_info(dbapi_connection, 'greenplum_ddl_url')
+        if url is not None:
+            gp_reflection.invalidate_reflection_cache(url)
+
+    def _pop_connection_info(self, dbapi_connection, key):
+        try:
+            info = dbapi_connection.info
+        except (AttributeError, NotImplementedError):
+            # the ad hoc connection of the first connect has no info
+            return None
+        # the info dict of a pooled connection, plain DBAPI connections of some drivers have an info of their own
+        if isinstance(info, dict):
+            return info.pop(key, None)
+        return None
+
+    def _add_rows_written(self, written):
+        with self._rows_written_lock:
+            for key, (count, columns) in written.items():
+                total = self._rows_written.setdefault(key, [0, columns])
+                total[0] += count
+                total[1] = columns
+
+    def _schedule_auto_analyze(self):
+        with self._rows_written_lock:
+            if self._auto_analyze_scheduled or self._auto_analyze_engine is None:
+                return
+            self._auto_analyze_scheduled = True
+            if self._auto_analyze_executor is None:
+                self._auto_analyze_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='greenplum-analyze')
+        self._auto_analyze_executor.submit(self._background_auto_analyze)
+
+    def _background_auto_analyze(self):
+        with self._rows_written_lock:
+            self._auto_analyze_scheduled = False
+        engine = self._auto_analyze_engine()
+        if engine is None:
+            return
+        try:
+            dbapi_connection = engine.raw_connection()
+        except Exception:
+            logger.exception('no connection for the automatic ANALYZE')
+            return
+        try:
+            self._run_auto_analyze(dbapi_connection)
+        finally:
+            dbapi_connection.close()
+
+    def _literal_sql(self, clause):
+        return str(clause.compile(dialect=self, compile_kwargs={'literal_binds': True}))
+
+    def _needs_analyze(self, cursor, schema, name, count):
+        """Whether the rows written cross a threshold, None when the table is gone (or temporary)"""
+        if self.auto_analyze_threshold is not None and count >= self.auto_analyze_threshold:
+            return True
+        cursor.execute(self._literal_sql(gp_health.estimated_rows_query().bindparams(name=name, schema=schema)))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return self.auto_analyze_fraction is not None and count >= self.auto_analyze_fraction * max(row[0], 0)
+
+    def _run_auto_analyze(self, dbapi_connection):
+        """ANALYZE the tables written to beyond auto_analyze_threshold or auto_analyze_fraction, in a transaction"""
+        with self._rows_written_lock:
+            written = [(key, total[0], total[1]) for key, total in self._rows_written.items()]
+        cursor = dbapi_connection.cursor()
+        try:
+            for key, count, columns in written:
+                schema, name = key
+                needs_analyze = self._needs_analyze(cursor, schema, name, count)
+                if needs_analyze is False:
+                    continue
+                with self._rows_written_lock:
+                    # rows written meanwhile are covered by this ANALYZE too
+                    self._rows_written.pop(key, None)
+                if needs_analyze:
+                    logger.debug('ANALYZE %s after %d rows written', name, count)
+                    cursor.execute(str(gp_ddl.Analyze(
+                        sqlalchemy.Table(name, sqlalchemy.MetaData(), schema=schema), columns=columns
+                    ).compile(dialect=self)))
+            dbapi_connection.commit()
+        except Exception:
+            logger.exception('automatic ANALYZE failed')
+            dbapi_connection.rollback()
+        finally:
+            cursor.close()
+
+    def do_execute(self, cursor, statement, parameters, context=None):
+        explain = context._greenplum_explain if context is not None else None
+        if explain == 'plan':
+            self._explain(statement, parameters, context, False)
+        super(GreenplumDialectMixin, self).do_execute(cursor, statement, parameters, context=context)
+        if explain == 'analyze':
+            self._explain(statement, parameters, context, True)
+
+    def _explain(self, statement, parameters, context, analyze):
+        dbapi_connection = context._dbapi_connection
+        # a failed EXPLAIN would abort the transaction of the statement, unless rolled back to a savepoint
+        savepoint = not getattr(dbapi_connection, 'autocommit', False)
+        # a cursor of its own leaves the result of the statement alone
+        explain_cursor = dbapi_connection.cursor()
+        try:
+            if savepoint:
+                explain_cursor.execute('SAVEPOINT greenplum_explain')
+            try:
+                explain_cursor.execute(gp_explain.explain_prefix(analyze) + statement, parameters)
+                plan = explain_cursor.fetchone()[0]
+            except Exception:
+                logger.exception('EXPLAIN failed')
+                if savepoint:
+                    explain_cursor.execute('ROLLBACK TO SAVEPOINT greenplum_explain')
+                return
+            finally:
+                if savepoint:
+                    explain_cursor.execute('RELEASE SAVEPOINT greenplum_explain')
+        finally:
+            explain_cursor.close()
+        try:
+            self.explain_sink(gp_explain.plan_metrics(plan, statement, analyze))
+        except Exception:
+            logger.exception('explain sink failed')
+
+    def do_executemany(self, cursor, statement, parameters, context=None):
+        if context is not None and context._greenplum_copy_columns is not None:
+            self._do_copy_executemany(cursor, parameters, context)
+        elif context is not None and context._greenplum_staging_columns is not None:
+            self._do_set_based_executemany(cursor, parameters, context)
+        else:
+            super(GreenplumDialectMixin, self).do_executemany(cursor, statement, parameters, context=context)
+
+    def _do_copy_executemany(self, cursor, parameters, context):
+        columns = context._greenplum_copy_columns
+        table = context.compiled.statement.table
+        bind_names = [bind_name for _, bind_name in columns]
+        stream = gp_copy.CopyInStream(
+            [params[bind_name] for bind_name in bind_names]
+            for params in parameters
+        )
+        logger.debug('executemany through COPY into %s', table.name)
+        self._copy_from_stream(cursor, context, table, [column for column, _ in columns], stream)
+
+    def _staging_distribution(self, table, keys):
+        if self.greenplum_version_info is None:
+            return None
+        # distributed like the target the join needs no motion, otherwise only the staging rows move
+        distribution = gp_staging.table_distribution(table)
+        key_names = dict((column.name, bind_name) for column, bind_name in keys)
+        if isinstance(distribution, list) and all(name in key_names for name in distribution):
+            names = [key_names[name] for name in distribution]
+        else:
+            names = [bind_name for _, bind_name in keys]
+        return ','.join(self.identifier_preparer.quote(name) for name in names)
+
+    def _do_set_based_executemany(self, cursor, parameters, context):
+        set_columns, keys = context._greenplum_staging_columns
+        table = context.compiled.statement.table
+        autocommit = getattr(context._dbapi_connection, 'autocommit', False)
+        staging = gp_staging.staging_table(
+            keys + set_columns, self._staging_distribution(table, keys), on_commit=None if autocommit else 'drop')
+        bind_names = [column.name for column in staging.columns]
+
+        cursor.execute(str(sqlalchemy.schema.CreateTable(staging).compile(dialect=self)))
+        try:
+            self._copy_from_stream(
+                cursor, context, staging, list(staging.columns),
+                gp_copy.CopyInStream([params[bind_name] for bind_name in bind_names] for params in parameters))
+            statement = str(gp_staging.set_based_statement(table, staging, set_columns, keys).compile(dialect=self))
+            logger.debug('executemany through %s', statement)
+            cursor.execute(statement)
+        except BaseException:
+            # a DROP in the aborted transaction would fail and hide the error, its rollback drops the table
+            if autocommit:
+                self._drop_staging(context, staging)
+            raise
+        self._drop_staging(context, staging)
+
+    def _drop_staging(self, context, staging):
+        # a cursor of its own keeps the rowcount of the statement
+        drop_cursor = context._dbapi_connection.cursor()
+        try:
+            drop_cursor.execute(str(sqlalchemy.schema.DropTable(staging).compile(dialect=self)))
+        finally:
+            drop_cursor.close()
+
+    @reflection.cache
+    def get_table_names(self, connection, schema=None, **kw):
+        include_partitions = kw.get('include_partitions', self.include_partitions)
+        result = connection.execute(
+            gp_reflection.table_names_query(self, include_partitions),
+            dict(schema=schema if schema is not None else self.default_schema_name))
+        return [name for name, in result]
+
+    @reflection.cache
+    def get_partitions(self, connection, table_name, schema=None, **kw):
+        result = connection.execute(
+            gp_reflection.partitions_query(self),
+            dict(schema=schema if schema is not None else self.default_schema_name, table_name=table_name))
+        return [dict(row._mapping) for row in result]
+
+    def get_columns(self, connection, table_name, schema=None, **kw):
+        columns = super(GreenplumDialectMixin, self).get_columns(connection, table_name, schema, **kw)
+        if ExecuteStyle is None:
+            # SQLAlchemy 2.0 reflects single tables through get_multi_columns
+            self._add_column_encodings(
+                connection, schema, [table_name], {(schema, table_name): columns}, kw.get('info_cache'))
+        return columns
+
+    def get_multi_columns(self, connection, schema=None, filter_names=None, scope=None, kind=None, **kw):
+        columns = dict(super(GreenplumDialectMixin, self).get_multi_columns(
+            connection, schema=schema, filter_names=filter_names, scope=scope, kind=kind, **kw))
+        self._add_column_encodings(connection, schema, filter_names, columns)
+        return columns.items()
+
+    def _add_column_encodings(self, connection, schema, filter_names, columns, info_cache=None):
+        """Add greenplum_encoding to the reflected columns of append optimized column tables
+
+        Note:
+            With an info_cache, as SQLAlchemy 1.4 Inspectors reflecting one table at a time give, the encodings of
+            all columns of the schema are loaded once and kept in it.
+        """
+        if self.greenplum_version_info is None:
+            return
+        if info_cache is not None:
+            by_name = self._schema_column_encodings(connection, schema, info_cache=info_cache)
+        else:
+            by_name = self._load_column_encodings(connection, schema, filter_names)
+        if not by_name:
+            return
+        for (_, table_name), table_columns in columns.items():
+            for column in table_columns:
+                encoding = by_name.get((table_name, column['name']))
+                if encoding is not None:
+                    column.setdefault('dialect_options', {})['greenplum_encoding'] = encoding
+
+    @reflection.cache
+    def _schema_column_encodings(self, connection, schema=None, **kw):
+        return self._load_column_encodings(connection, schema, None)
+
+    def _load_column_encodings(self, connection, schema, filter_names):
+        query = gp_reflection.column_encodings_query(schema, bool(filter_names))
+        params = {'filter_names': list(filter_names)} if filter_names else {}
+        by_name = {}
+        for row in connection.execute(query, params):
+            encoding = gp_reflection.encoding_option(row.attoptions)
+            if encoding is not None:
+                by_name[(row.relname, row.attname)] = encoding
+        return by_name
+
+    def _load_table_options(self, connection, schema, filter_names, temporary=None):
+        query = gp_reflection.table_options_query(self, schema, bool(filter_names), temporary)
+        params = {'filter_names': list(filter_names)} if filter_names else {}
+        for row in connection.execute(query, params):
+            options = gp_reflection.table_options(self.identifier_preparer, row)
+            if options:
+                yield row.relname, options
+
+    @reflection.cache
+    def _schema_table_options(self, connection, schema=None, **kw):
+        return dict(self._load_table_options(connection, schema, None))
+
+    @reflection.cache
+    def get_table_options(self, connection, table_name, schema=None, **kw):
+        """Reflect greenplum_distributed_by, greenplum_storage_params and greenplum_partition_by of a table
+
+        Note:
+            With an info_cache, as SQLAlchemy 1.4 Inspectors reflecting one table at a time give, the options of
+            all tables of the schema are loaded by the first call and kept in it.
+        """
+        info_cache = kw.get('info_cache')
+        if info_cache is not None:
+            return dict(self._schema_table_options(connection, schema, info_cache=info_cache).get(table_name, {}))
+        for _, options in self._load_table_options(connection, schema, [table_name]):
+            return options
+        return {}
+
+    def get_multi_table_options(self, connection, schema=None, filter_names=None, scope=None, kind=None, **kw):
+        """Reflect the greenplum_* options of many tables with a single catalog query
+
+        Note:
+            Used by the SQLAlchemy 2.0 Inspector (and so MetaData.reflect) next to the get_multi_* methods of the
+            PostgreSQL dialect, which already reflect columns, constraints and indexes in batches.
+        """
+        temporary = None
+        if scope is not None and scope.name == 'DEFAULT':
+            temporary = False
+        elif scope is not None and scope.name == 'TEMPORARY':
+            temporary = True
+        if kind is not None and not kind & kind.TABLE:
+            return []
+        return [
+            ((schema, table_name), options)
+            for table_name, options in self._load_table_options(connection, schema, filter_names, temporary)
+        ]
+
+    def _get_greenplum_version_info(self, connection):
+        """Return the Greenplum release as a tuple of ints, or None when the server is a plain PostgreSQL"""
+        return parse_greenplum_version(connection.exec_driver_sql('select pg_catalog.version()').scalar())
+
+    def _set_greenplum_features(self, implicit_returning=True):
+        """Enable the code paths the connected Greenplum release supports
+
+        Note:
+            Greenplum 7 is based on PostgreSQL 12 and supports RETURNING, ON CONFLICT and CREATE INDEX
+            CONCURRENTLY, which are all disabled on older releases. Servers not reporting a Greenplum version
+            (a plain PostgreSQL) keep what the PostgreSQL dialect detected for their version.
+        """
+        version = self.greenplum_version_info
+        if version is None:
+            returning = implicit_returning
+            self._supports_on_conflict = self.server_version_info >= (9, 5)
+        else:
+            returning = implicit_returning and version >= (7, )
+            self._supports_on_conflict = version >= (7, )
+            self._supports_create_index_concurrently = version >= (7, )
+            if version >= (7, ):
+                self._supports_parallel_retrieve_cursor = True
+            elif version < (6, ):
+                self._supports_parallel_retrieve_cursor = False
+        self.implicit_returning = returning
+        if ExecuteStyle is None:
+            self.full_returning = returning
+        else:
+            # SQLAlchemy 2.0 decides per statement kind and derives full_returning from these
+            self.insert_returning = self.update_returning = self.delete_returning = returning
+
+
+class GreenplumDialect(GreenplumDialectMixin, PGDialect_psycopg2):
+    """Pivotal Greenplum Dialect
+
+    Note:
+       Inherits most of the functionality from PGDialect_psycopg2
+    """
+    supports_statement_cache = True
+    execution_ctx_cls = GreenplumExecutionContext
+
+    def _copy_from_stream(self, cursor, context, table, columns, stream):
+        """Load the rows of a CopyInStream into the columns of a table with ``COPY ... FROM STDIN``"""
+        cursor.copy_expert(gp_copy.copy_from_statement(self.identifier_preparer, table, columns), stream)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import contextlib
+import logging
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy.dialects.postgresql.dml import Insert as PGInsert
+
+from sqlalchemy_greenplum.staging import temporary_table_like
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+UPSERT_METHODS = ('on_conflict', 'staging')
+
+
+class Insert(PGInsert):
+    """Greenplum INSERT, with ``on_conflict_do_nothing`` and ``on_conflict_do_update`` for Greenplum 7
+
+    Note:
+        Compiling ON CONFLICT for an older Greenplum raises a CompileError.
+    """
+    stringify_dialect = 'greenplum'
+    inherit_cache = True
+
+
+def insert(table):
+    """Construct a Greenplum Insert"""
+    return Insert(table)
+
+
+@contextlib.contextmanager
+def _transaction(connection):
+    if connection.in_transaction():
+        yield
+    else:
+        with connection.begin():
+            yield
+
+
+def _staging_table(connection, table, columns, keys, on_commit='drop'):
+    """A temporary table for the given columns of a table, distributed like the table when it can be"""
+    try:
+        return temporary_table_like(table, columns, connection=connection, on_commit=on_commit)
+    except exc.ArgumentError:
+        # the rows do not hold the distribution key, at least keep the rows of a key together
+        return temporary_table_like(
+            table, columns, connection=connection, on_commit=on_commit, greenplum_distributed_by=','.join(
+                connection.dialect.identifier_preparer.quote(column.name) for column in keys))
+
+
+def _upsert_on_conflict(connection, table, rows, keys, update_columns):
+    stmt = insert(table)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys, set_=dict((column.name, stmt.excluded[column.key]) for column in update_columns))
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    return connection.execute(stmt, rows).rowcount
+
+
+def _upsert_staging(connection, table, rows, columns, keys, update_columns):
+    # without a transaction ON COMMIT DROP would drop the table as soon as it is created
+    autocommit = getattr(connection.connection.dbapi_connection, 'autocommit', False)
+    staging = _staging_table(connection, table, columns, keys, on_commit=None if autocommit else 'drop')
+    staging.create(connection)
+    try:
+        connection.execution_options(greenplum_copy_executemany=True).execute(
+            staging.insert(), [dict((column.name, row[column.key]) for column in columns) for row in rows])
+
+        matches = sqlalchemy.and_(*[key == staging.c[key.name] for key in keys])
+        count = 0
+        if update_columns:
+            count += connection.execute(
+                table.update().where(matches).values(
+                    dict((column.key, staging.c[column.name]) for column in update_columns))
+            ).rowcount
+        count += connection.execute(
+            table.insert().from_select(
+                columns,
+                sqlalchemy.select(*[staging.c[column.name] for column in columns]).where(
+                    ~sqlalchemy.exists().where(matches))
+            )
+        ).rowcount
+    except BaseException:
+        # a DROP in the aborted transaction would fail and hide the error, its rollback drops the table
+        if autocommit:
+            staging.drop(connection)
+        raise
+    staging.drop(connection)
+    return count
+
+
+def upsert(connection, table, rows, index_elements=None, update_columns=None, method=None):
+    """Insert rows, updating the rows of the table that already have their key
+
+    Note:
+        With ``method='on_conflict'`` this runs INSERT ... ON CONFLICT (index_elements) DO UPDATE, which needs
+        Greenplum 7 and a unique index on the key. With ``method='staging'`` the rows are loaded through COPY into a
+        temporary table distributed like the target, then one UPDATE ... FROM updates the existing rows and one
+        INSERT ... SELECT ... WHERE NOT EXISTS adds the new ones; the join needs no redistribution motion and no
+        unique index. By default ON CONFLICT is used where the server supports it.
+        The keys must be unique within ``rows``. Everything runs in one transaction: the current one of the
+        connection, or one begun (and committed) here.
+
+    Args:
+        connection: the Connection to run the upsert on
+        table: the target Table
+        rows: a list of dicts of column key to value, all with the same keys
+        index_elements: the key columns (or their names) rows are matched on, defaults to the primary key
+        update_columns: the columns (or their names) updated on a match, defaults to all non key columns in the
+            rows; an empty list only inserts the missing rows
+        method: 'on_conflict', 'staging' or None
+
+    Returns:
+        The number of rows inserted or updated
+    """
+    if not rows:
+        return 0
+    if method is None:
+        method = 'on_conflict' if connection.dialect._supports_on_conflict else 'staging'
+    if method not in UPSERT_METHODS:
+        raise exc.ArgumentError('Unknown upsert method %r, expected one of %s' % (method, ', '.join(UPSERT_METHODS)))
+
+    def resolve(cols):
+        return [table.c[col] if isinstance(col, str) else col for col in cols]
+
+    keys = resolve(index_elements) if index_elements is not None else list(table.primary_key)
+    if not keys:
+        raise exc.ArgumentError('Table %r has no primary key, index_elements are needed to upsert' % table.name)
+    columns = [column for column in table.columns if column.key in rows[0]]
+    missing = [key.key for key in keys if key.key not in rows[0]]
+    if missing:
+        raise exc.ArgumentError('The rows have no value for the key columns %s' % ', '.join(missing))
+    if update_columns is None:
+        key_names = set(key.key for key in keys)
+        update_columns = [column for column in columns if column.key not in key_names]
+    else:
+        update_columns = resolve(update_columns)
+
+    logger.debug('upsert of %d rows into %s through %s', len(rows), table.name, method)
+    with _transaction(connection):
+        if method == 'on_conflict':
+            return _upsert_on_conflict(connection, table, rows, keys, update_columns)
+        return _upsert_staging(connection, table, rows, columns, keys, update_columns)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import json
+import logging
+import re
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+EXPLAIN_MODES = ('analyze', 'plan')
+MOTIONS = ('Gather Motion', 'Redistribute Motion', 'Broadcast Motion', 'Explicit Redistribute Motion')
+
+# Greenplum reports the rows of a node per segment as "Rows out:  Avg 500.0 rows x 2 workers.  Max 510 rows (seg1)"
+ROWS_OUT = re.compile(r'Avg ([\d.]+) rows x (\d+) workers.*?Max ([\d.]+) rows \(seg(\d+)\)', re.S)
+
+_NODE_PROPERTIES = (
+    ('Relation Name', 'relation'),
+    ('Slice', 'slice'),
+    ('Segments', 'segments'),
+    ('Senders', 'senders'),
+    ('Receivers', 'receivers'),
+    ('Plan Rows', 'plan_rows'),
+    ('Actual Rows', 'actual_rows'),
+    ('Actual Loops', 'actual_loops'),
+    ('Actual Total Time', 'total_time_ms'),
+    ('Workfile Spilling', 'spilling'),
+)
+
+
+def explain_prefix(analyze):
+    """The EXPLAIN put in front of a statement to capture its plan as JSON"""
+    return 'EXPLAIN (ANALYZE, FORMAT JSON) ' if analyze else 'EXPLAIN (FORMAT JSON) '
+
+
+def _memory_kb(value):
+    if isinstance(value, dict):
+        value = value.get('Maximum Memory Used', value.get('Average'))
+    return value if isinstance(value, (int, float)) else None
+
+
+def _rows_out(node):
+    for value in node.values():
+        if isinstance(value, str):
+            m = ROWS_OUT.search(value)
+            if m:
+                return float(m.group(1)), int(m.group(2)), float(m.group(3)), int(m.group(4))
+    return None
+
+
+def node_metrics(node):
+    """The metrics of one plan node, without its children"""
+    metrics = {'node_type': node.get('Node Type')}
+    for key, name in _NODE_PROPERTIES:
+        metrics[name] = node.get(key)
+    metrics['memory_kb'] = _memory_kb(node.get('Executor Memory'))
+    metrics['avg_rows'] = metrics['max_rows'] = metrics['max_segment'] = metrics['skew'] = None
+    rows_out = _rows_out(node)
+    if rows_out is not None:
+        avg_rows, workers, max_rows, max_segment = rows_out
+        metrics.update(avg_rows=avg_rows, max_rows=max_rows, max_segment=max_segment)
+        if avg_rows and workers > 1:
+            metrics['skew'] = max_rows / avg_rows
+    return metrics
+
+
+def _walk(plan):
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        yield node
+        # reversed so the first child is visited next, each node followed by its subtree
+        pending.extend(reversed(node.get('Plans', ())))
+
+
+def plan_metrics(plan, statement, analyzed):
+    """Summarize the JSON output of EXPLAIN for a Greenplum metrics sink
+
+    Note:
+        Motion nodes split a plan into slices, each run by a gang of processes on every segment (or on the
+        coordinator), so the number of slices is the number of motions plus one. Skew is the ratio of the largest
+        per segment row count of a node to the average, for the nodes the server reports per segment rows for.
+
+    Args:
+        plan: the parsed result of EXPLAIN (FORMAT JSON), a list with one document
+        statement: the SQL statement explained
+        analyzed: whether the plan comes from EXPLAIN ANALYZE
+
+    Returns:
+        A dict with statement, analyzed, planning_time_ms, execution_time_ms, slices, motions (the number of
+        each kind of motion), spilling_nodes, max_skew and nodes, the metrics of each node in depth first order
+    """
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    document = plan[0] if isinstance(plan, list) else plan
+    nodes = [node_metrics(node) for node in _walk(document['Plan'])]
+    motions = dict((motion, 0) for motion in MOTIONS)
+    for node in nodes:
+        if node['node_type'] in motions:
+            motions[node['node_type']] += 1
+    skews = [node['skew'] for node in nodes if node['skew'] is not None]
+    return {
+        'statement': statement,
+        'analyzed': analyzed,
+        'planning_time_ms': document.get('Planning Time'),
+        'execution_time_ms': document.get('Execution Time', document.get('Total Runtime')),
+        'slices': sum(motions.values()) + 1,
+        'motions': motions,
+        'spilling_nodes': len([node for node in nodes if node['spilling']]),
+        'max_skew': max(skews) if skews else None,
+        'nodes': nodes,
+    }
+
+
+def logging_sink(metrics):
+    """The default metrics sink, logging a one line summary"""
+    logger.info(
+        'plan of %r: %d slices, motions %s, max skew %s, %d spilling nodes, %s ms',
+        metrics['statement'], metrics['slices'],
+        dict((motion, count) for motion, count in metrics['motions'].items() if count),
+        metrics['max_skew'], metrics['spilling_nodes'], metrics['execution_time_ms'])
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import http.server
+import logging
+import socket
+import struct
+import threading
+import uuid
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy_greenplum import copy as gp_copy
+from sqlalchemy_greenplum.ddl import CreateExternalTable, DropExternalTable
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+GPFDIST_VERSION = '6.0.0 sqlalchemy-greenplum'
+DEFAULT_BLOCK_SIZE = 256 * 1024
+
+
+class _Source(object):
+    """Hands out blocks of complete lines of one served path to the segments of a single query
+
+    Note:
+        Every segment taking part in the query issues its own GET request. The requests share the source so
+        each line is delivered to exactly one segment, in blocks that never split a line.
+    """
+    def __init__(self, chunks, block_size):
+        self._chunks = iter(chunks)
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._remainder = b''
+        self._exhausted = False
+        self.offset = 0
+        self.line_number = 1
+
+    def next_block(self):
+        """Return (offset, line number, data) of the next block, or None when all data has been handed out"""
+        with self._lock:
+            chunks = [self._remainder]
+            length = len(self._remainder)
+            has_newline = b'\n' in self._remainder
+            while not self._exhausted and (length < self._block_size or not has_newline):
+                try:
+                    chunk = next(self._chunks)
+                except StopIteration:
+                    self._exhausted = True
+                else:
+                    chunks.append(chunk)
+                    length += len(chunk)
+                    has_newline = has_newline or b'\n' in chunk
+            data = b''.join(chunks)
+            if not data:
+                return None
+            end = len(data)
+            if not self._exhausted:
+                end = data.rfind(b'\n', 0, self._block_size) + 1 or data.find(b'\n') + 1
+            block, self._remainder = data[:end], data[end:]
+            result = (self.offset, self.line_number, block)
+            self.offset += len(block)
+            self.line_number += block.count(b'\n')
+            return result
+
+
+class _GpfdistRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+    server_version = 'gpfdist/' + GPFDIST_VERSION
+
+    def log_message(self, format, *args):
+        logger.debug('gpfdist: ' + format, *args)
+
+    def _send_headers(self, status, proto):
+        self.send_response(status)
+        self.send_header('Content-type', 'text/plain')
+        self.send_header('Expires', '0')
+        self.send_header('X-GPFDIST-VERSION', GPFDIST_VERSION)
+        self.send_header('X-GP-PROTO', str(proto))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0].lstrip('/')
+        session = (self.headers.get('X-GP-XID'), self.headers.get('X-GP-CID'), self.headers.get('X-GP-SN'))
+        proto = 1 if self.headers.get('X-GP-PROTO') == '1' else 0
+        source = self.server.gpfdist.get_source(path, session)
+        if source is None:
+            self.send_error(404, 'file not found')
+            return
+
+        self._send_headers(200, proto)
+        filename = path.encode('utf-8')
+        while True:
+            block = source.next_block()
+            if block is None:
+                break
+            offset, line_number, data = block
+            if proto == 1:
+                self.wfile.write(
+                    b'F' + struct.pack('>i', len(filename)) + filename +
+                    b'O' + struct.pack('>iq', 8, offset) +
+                    b'L' + struct.pack('>iq', 8, line_number) +
+                    b'D' + struct.pack('>i', len(data)))
+            self.wfile.write(data)
+        if proto == 1:
+            # an empty data block tells the segment there is no more data
+            self.wfile.write(b'D' + struct.pack('>i', 0))
+        self.wfile.flush()
+
+
+class GpfdistServer(object):
+    """An embedded HTTP file server speaking the gpfdist protocol
+
+    Note:
+        Serves data registered with ``add_rows`` or ``add_file`` to the segments of readable external tables
+        with LOCATION ('gpfdist://<host>:<port>/<name>'). Each query (identified by the X-GP-XID, X-GP-CID and
+        X-GP-SN headers sent by the segments) reads a path once, spread over all of its segments.
+        Rows are served in TEXT format, files are served as they are and must not contain newlines inside
+        quoted CSV fields.
+    """
+    def __init__(self, host='', port=0, block_size=DEFAULT_BLOCK_SIZE, advertised_host=None):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._sessions = {}
+        self._httpd = http.server.ThreadingHTTPServer((host, port), _GpfdistRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.gpfdist = self
+        self._thread = None
+        self.advertised_host = advertised_host or host or socket.getfqdn()
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def url(self, name):
+        return 'gpfdist://%s:%d/%s' % (self.advertised_host, self.port, name)
+
+    def add_rows(self, name, rows, encoding='utf-8'):
+        """Serve an iterable of row sequences at the given path, encoded in TEXT format
+
+        Note:
+            The values are sent as they are, they have to be bound already (see ``load_table``).
+        """
+        def chunks():
+            for row in rows:
+                yield gp_copy.encode_copy_row(row).encode(encoding)
+        self._register(name, chunks)
+        return self.url(name)
+
+    def add_file(self, name, path, read_size=DEFAULT_BLOCK_SIZE):
+        """Serve a local file at the given path"""
+        def chunks():
+            with open(path, 'rb') as f:
+                while True:
+                    data = f.read(read_size)
+                    if not data:
+                        break
+                    yield data
+        self._register(name, chunks)
+        return self.url(name)
+
+    def remove(self, name):
+        with self._lock:
+            self._paths.pop(name, None)
+            for key in [key for key in self._sessions if key[0] == name]:
+                del self._sessions[key]
+
+    def _register(self, name, chunks):
+        with self._lock:
+            self._paths[name] = chunks
+
+    def get_source(self, name, session):
+        with self._lock:
+            chunks = self._paths.get(name)
+            if chunks is None:
+                return None
+            key = (name,) + session
+            source = self._sessions.get(key)
+            if source is None:
+                source = self._sessions[key] = _Source(chunks(), self.block_size)
+            return source
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='gpfdist-%d' % self.port)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _bound_rows(dialect, columns, rows):
+    """The rows with their values passed through the bind processors of the column types, as an INSERT would"""
+    unsupported = [column.name for column in columns if not gp_copy.supports_copy_type(column.type, dialect)]
+    if unsupported:
+        raise exc.ArgumentError(
+            'Cannot load columns %s through gpfdist, their type has no TEXT format encoding' % ', '.join(unsupported))
+    processors = [column.type._cached_bind_processor(dialect) for column in columns]
+    return (
+        [processor(value) if processor is not None else value for processor, value in zip(processors, row)]
+        for row in rows
+    )
+
+
+def load_table(connection, table, rows, columns=None, server=None, reject_limit=None, log_errors=False):
+    """Load rows into a table in parallel through a temporary external table
+
+    Note:
+        Starts (or reuses) an embedded gpfdist server, creates a temporary external table pointing at it and
+        runs INSERT INTO table SELECT FROM the external table, so every segment pulls its share of the rows
+        directly instead of everything passing through the coordinator. The values go through the bind
+        processors of the column types as they would for ``table.insert()``, columns of types that cannot be
+        sent in TEXT format (such as ARRAY) are rejected.
+
+    Args:
+        connection: the Connection to load with, the INSERT runs in its current transaction
+        table: the target Table
+        rows: an iterable of value sequences matching ``columns``
+        columns: the target columns (or their names) the rows hold values for, defaults to all columns
+        server: a started GpfdistServer reachable from the segments, by default one is started on a free port
+            of this host for the duration of the load
+        reject_limit: an optional SEGMENT REJECT LIMIT in rows for malformed lines
+        log_errors: log rejected lines with LOG ERRORS, only together with a ``reject_limit``
+
+    Returns:
+        The number of rows inserted
+    """
+    if log_errors and reject_limit is None:
+        raise exc.ArgumentError('log_errors needs a reject_limit, LOG ERRORS is part of single row error handling')
+    if columns is None:
+        columns = list(table.columns)
+    else:
+        columns = [table.c[col] if isinstance(col, str) else col for col in columns]
+    rows = _bound_rows(connection.dialect, columns, rows)
+
+    name = 'gpfdist_%s' % uuid.uuid4().hex
+    external = sqlalchemy.Table(
+        name, sqlalchemy.MetaData(),
+        *[sqlalchemy.Column(column.name, column.type) for column in columns]
+    )
+
+    own_server = server is None
+    if own_server:
+        server = GpfdistServer().start()
+    try:
+        location = server.add_rows(name, rows)
+        connection.execute(CreateExternalTable(
+            external, location, temporary=True, reject_limit=reject_limit, log_errors=log_errors))
+        try:
+            result = connection.execute(
+                table.insert().from_select(columns, sqlalchemy.select(*external.columns)))
+        except BaseException:
+            # a DROP in the aborted transaction would fail and hide the error, its rollback drops the table
+            if getattr(connection.connection.dbapi_connection, 'autocommit', False):
+                connection.execute(DropExternalTable(external, if_exists=True))
+            raise
+        connection.execute(DropExternalTable(external, if_exists=True))
+        return result.rowcount
+    finally:
+        server.remove(name)
+        if own_server:
+            server.stop()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import sqlalchemy
+
+
+def _access_method(greenplum_version):
+    if greenplum_version is None:
+        return "NULL::text"
+    if greenplum_version >= (7, ):
+        return "(SELECT am.amname FROM pg_catalog.pg_am am WHERE am.oid = c.relam)::text"
+    return (
+        "CASE WHEN EXISTS (SELECT 1 FROM pg_catalog.pg_appendonly ao WHERE ao.relid = c.oid AND ao.columnstore) "
+        "THEN 'ao_column' WHEN EXISTS (SELECT 1 FROM pg_catalog.pg_appendonly ao WHERE ao.relid = c.oid) "
+        "THEN 'ao_row' ELSE 'heap' END"
+    )
+
+
+def _all_visible(server_version):
+    if server_version >= (9, 2):
+        return "c.relallvisible"
+    return "NULL::int"
+
+
+def table_health_query(dialect):
+    """Build the query returning the size, estimated rows and visibility map coverage of the tables in ``schema``
+
+    Note:
+        Only catalog statistics are read, the visibility ratio and the row estimate are as of the last
+        VACUUM or ANALYZE.
+    """
+    sql = (
+        "SELECT c.relname AS table_name, %s AS access_method, "
+        "pg_catalog.pg_relation_size(c.oid) AS size_bytes, "
+        "pg_catalog.pg_total_relation_size(c.oid) AS total_size_bytes, "
+        "c.reltuples::bigint AS estimated_rows, c.relpages AS pages, %s AS all_visible_pages "
+        "FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relkind IN ('r', 'p') ORDER BY c.relname"
+    ) % (_access_method(dialect.greenplum_version_info), _all_visible(dialect.server_version_info))
+    return sqlalchemy.text(sql)
+
+
+def segment_sizes_query():
+    """Build the query returning the on disk size of every table in ``schema`` on each segment
+
+    Note:
+        gp_dist_random runs the scan of pg_class on every segment, so each segment reports the size of its
+        own part of the tables without reading them.
+    """
+    return sqlalchemy.text(
+        "SELECT c.relname AS table_name, count(*) AS segments, "
+        "sum(pg_catalog.pg_relation_size(c.oid))::bigint AS size_bytes, "
+        "max(pg_catalog.pg_relation_size(c.oid))::bigint AS max_segment_bytes, "
+        "avg(pg_catalog.pg_relation_size(c.oid))::float8 AS avg_segment_bytes "
+        "FROM gp_dist_random('pg_class') c "
+        "WHERE c.relnamespace = (SELECT n.oid FROM pg_catalog.pg_namespace n WHERE n.nspname = :schema) "
+        "AND c.relkind IN ('r', 'p') GROUP BY c.relname ORDER BY c.relname"
+    )
+
+
+def skew_coefficients_query():
+    """Build the query returning the gp_toolkit skew coefficient of the tables in ``schema``
+
+    Note:
+        gp_toolkit.gp_skew_coefficients counts the rows of the tables on each segment, which reads them.
+    """
+    return sqlalchemy.text(
+        "SELECT skcrelname AS table_name, skccoeff::float8 AS skew_coefficient "
+        "FROM gp_toolkit.gp_skew_coefficients WHERE skcnamespace = :schema ORDER BY skcrelname"
+    )
+
+
+def segment_row_counts_query(preparer, table_name, schema):
+    """Build the query counting the rows of a table on each segment"""
+    return sqlalchemy.text(
+        "SELECT gp_segment_id AS segment_id, count(*) AS row_count FROM %s.%s GROUP BY gp_segment_id" % (
+            preparer.quote_schema(schema), preparer.quote(table_name))
+    )
+
+
+def segment_ids_query():
+    """Build the query listing the content ids of the primary segments"""
+    return sqlalchemy.text(
+        "SELECT content FROM pg_catalog.gp_segment_configuration WHERE role = 'p' AND content >= 0 ORDER BY content")
+
+
+def ao_bloat_query(dialect):
+    """Build the query returning the visible and hidden (deleted or updated) tuples of the append optimized tables
+
+    Note:
+        Append optimized tables never reuse the space of hidden tuples, only VACUUM compacts them away.
+    """
+    greenplum_version = dialect.greenplum_version_info
+    if greenplum_version is not None and greenplum_version >= (7, ):
+        append_optimized = (
+            "EXISTS (SELECT 1 FROM pg_catalog.pg_am am WHERE am.oid = c.relam AND am.amname IN ('ao_row', 'ao_column'))"
+        )
+    else:
+        append_optimized = "EXISTS (SELECT 1 FROM pg_catalog.pg_appendonly ao WHERE ao.relid = c.oid)"
+    return sqlalchemy.text(
+        "SELECT c.relname AS table_name, sum(h.total_tupcount)::bigint AS total_tuples, "
+        "sum(h.hidden_tupcount)::bigint AS hidden_tuples "
+        "FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace, "
+        "LATERAL gp_toolkit.__gp_aovisimap_hidden_info(c.oid) h "
+        "WHERE n.nspname = :schema AND c.relkind = 'r' AND %s "
+        "GROUP BY c.relname ORDER BY c.relname" % append_optimized
+    )
+
+
+def heap_bloat_query():
+    """Build the query returning the heap tables of ``schema`` gp_toolkit diagnoses as bloated"""
+    return sqlalchemy.text(
+        "SELECT bdirelname AS table_name, bdirelpages AS pages, bdiexppages AS expected_pages, "
+        "bdidiag AS diagnosis FROM gp_toolkit.gp_bloat_diag WHERE bdinspname = :schema ORDER BY bdirelname"
+    )
+
+
+def missing_statistics_query():
+    """Build the query returning the tables of ``schema`` without (complete) optimizer statistics"""
+    return sqlalchemy.text(
+        "SELECT smitable AS table_name, smisize AS has_statistics, smicols AS columns, "
+        "smirecs AS columns_with_statistics "
+        "FROM gp_toolkit.gp_stats_missing WHERE smischema = :schema ORDER BY smitable"
+    )
+
+
+def estimated_rows_query():
+    """Build the query returning the row estimate of the table ``name`` in ``schema``, the current schema when NULL"""
+    return sqlalchemy.text(
+        "SELECT c.reltuples FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = :name AND n.nspname = coalesce(:schema, current_schema())"
+    ).bindparams(sqlalchemy.bindparam('name', type_=sqlalchemy.String),
+                 sqlalchemy.bindparam('schema', type_=sqlalchemy.String))
+
+
+def ratio(part, whole):
+    """part / whole, None when it is undefined"""
+    if part is None or not whole:
+        return None
+    return float(part) / float(whole)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import logging
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy.sql import elements, functions, visitors
+from sqlalchemy.sql.base import Executable
+from sqlalchemy.sql.elements import ClauseElement
+
+from sqlalchemy_greenplum import staging as gp_staging
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+_DONE = object()
+
+# Aggregate functions of the server, which a SELECT split by segment would compute once per segment
+AGGREGATE_FUNCTIONS = frozenset((
+    'array_agg', 'avg', 'bit_and', 'bit_or', 'bool_and', 'bool_or', 'corr', 'count', 'covar_pop', 'covar_samp',
+    'cume_dist', 'dense_rank', 'every', 'json_agg', 'json_object_agg', 'jsonb_agg', 'jsonb_object_agg', 'max',
+    'median', 'min', 'mode', 'percent_rank', 'percentile_cont', 'percentile_disc', 'rank', 'regr_avgx',
+    'regr_avgy', 'regr_count', 'regr_intercept', 'regr_r2', 'regr_slope', 'regr_sxx', 'regr_sxy', 'regr_syy',
+    'stddev', 'stddev_pop', 'stddev_samp', 'string_agg', 'sum', 'var_pop', 'var_samp', 'variance', 'xmlagg',
+))
+
+
+class DeclareParallelRetrieveCursor(Executable, ClauseElement):
+    """Represent a DECLARE ... PARALLEL RETRIEVE CURSOR FOR <select> statement"""
+    __visit_name__ = 'declare_parallel_retrieve_cursor'
+    inherit_cache = False
+
+    def __init__(self, name, element):
+        self.name = name
+        self.element = element
+
+
+def supports_parallel_retrieve_cursor(connection):
+    """Whether the server connected to provides parallel retrieve cursors
+
+    Note:
+        Known from the version for Greenplum 7 and releases before 6, Greenplum 6 is probed for the
+        gp_parallel_retrieve_cursor extension once per engine.
+    """
+    dialect = connection.dialect
+    if dialect._supports_parallel_retrieve_cursor is None:
+        dialect._supports_parallel_retrieve_cursor = bool(connection.exec_driver_sql(
+            "SELECT count(*) FROM pg_catalog.pg_proc WHERE proname = 'gp_get_endpoints'"
+        ).scalar())
+    return dialect._supports_parallel_retrieve_cursor
+
+
+def segment_statements(statement, driving_table, segment_ids):
+    """Split a SELECT into one statement per segment by filtering the driving table on gp_segment_id
+
+    Note:
+        This is only valid for statements where each result row comes from a single row of the driving table,
+        so statements with GROUP BY, HAVING, DISTINCT, LIMIT, OFFSET or ORDER BY, statements selecting
+        aggregates or window functions, UNIONs and the like, and statements where the driving table is not on
+        the preserved side of an outer join (or takes part in a FULL join) are rejected.
+    """
+    _check_select(statement)
+    if statement._group_by_clauses or statement._having_criteria or statement._distinct or \
+            statement._limit_clause is not None or statement._offset_clause is not None or \
+            statement._order_by_clauses:
+        raise exc.ArgumentError(
+            'Cannot split a SELECT with GROUP BY, HAVING, DISTINCT, LIMIT, OFFSET or ORDER BY by gp_segment_id')
+    if any(_is_aggregate(element) for column in statement._raw_columns for element in visitors.iterate(column)):
+        raise exc.ArgumentError('Cannot split a SELECT of aggregates or window functions by gp_segment_id')
+    for from_clause in _froms(statement):
+        _check_preserved(from_clause, driving_table)
+    segment_column = sqlalchemy.sql.expression.ColumnClause(
+        'gp_segment_id', type_=sqlalchemy.Integer(), _selectable=driving_table)
+    return [statement.where(segment_column == segment_id) for segment_id in segment_ids]
+
+
+def _is_aggregate(element):
+    if isinstance(element, (elements.Over, elements.WithinGroup, elements.FunctionFilter)):
+        return True
+    return isinstance(element, functions.FunctionElement) and \
+        getattr(element, 'name', '').lower() in AGGREGATE_FUNCTIONS
+
+
+def _check_select(statement):
+    if not isinstance(statement, sqlalchemy.sql.expression.Select):
+        raise exc.ArgumentError('Cannot split a %s by gp_segment_id, only a SELECT' % type(statement).__name__)
+
+
+def _froms(statement):
+    return statement.get_final_froms() if hasattr(statement, 'get_final_froms') else statement.froms
+
+
+def _contains(from_clause, table):
+    if isinstance(from_clause, sqlalchemy.sql.expression.Join):
+        return _contains(from_clause.left, table) or _contains(from_clause.right, table)
+    return from_clause is table
+
+
+def _check_preserved(from_clause, driving_table):
+    """Reject joins filtering the driving table would drop rows of, the ones it is on the nullable side of"""
+    if not isinstance(from_clause, sqlalchemy.sql.expression.Join):
+        return
+    if from_clause.full:
+        raise exc.ArgumentError('Cannot split a SELECT with a FULL OUTER JOIN by gp_segment_id')
+    if from_clause.isouter and _contains(from_clause.right, driving_table):
+        raise exc.ArgumentError(
+            'Cannot split a SELECT by the gp_segment_id of %s, which is on the nullable side of an outer join'
+            % getattr(driving_table, 'name', driving_table))
+    _check_preserved(from_clause.left, driving_table)
+    _check_preserved(from_clause.right, driving_table)
+
+
+def _leftmost_table(from_clause):
+    while isinstance(from_clause, sqlalchemy.sql.expression.Join):
+        from_clause = from_clause.left
+    return from_clause
+
+
+def _is_replicated(connection, table):
+    dialect_options = getattr(table, 'dialect_options', None)
+    if dialect_options is None:
+        return False
+    distributed_by = dialect_options['greenplum']['distributed_by']
+    if distributed_by is None and connection.dialect.greenplum_version_info is not None:
+        distributed_by = gp_staging._reflected_distributed_by(connection, table)
+    return distributed_by is not None and gp_staging.parse_distributed_by(distributed_by) == 'REPLICATED'
+
+
+class SegmentRows(object):
+    """The rows of a parallel result coming from one segment
+
+    Note:
+        Nothing is fetched until iteration starts. Rows are fetched in batches over a connection of its own.
+    """
+    def __init__(self, segment_id, fetch_batches):
+        self.segment_id = segment_id
+        self._fetch_batches = fetch_batches
+        self._batches = None
+        self.exhausted = False
+
+    def batches(self):
+        if self._batches is None:
+            self._batches = self._fetch_batches()
+        for batch in self._batches:
+            yield batch
+        self.exhausted = True
+
+    def __iter__(self):
+        for batch in self.batches():
+            for row in batch:
+                yield row
+
+    def close(self):
+        if self._batches is not None:
+            self._batches.close()
+
+
+class ParallelResult(object):
+    """Rows of one query retrieved from the segments in parallel
+
+    Note:
+        Iterate over the object for all rows merged in arrival order, or over the SegmentRows returned by
+        ``segments()`` to consume each segment's rows separately. Rows are plain tuples.
+        Closing the result (or leaving it as a context manager) releases every connection used.
+    """
+    def __init__(self, keys, segments, max_workers, on_close):
+        self._keys = keys
+        self._segments = segments
+        self._max_workers = max_workers
+        self._on_close = on_close
+        self._closed = False
+
+    def keys(self):
+        return list(self._keys)
+
+    def segments(self):
+        return list(self._segments)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self._max_workers * 2)
+        stop = threading.Event()
+
+        def drain(segment):
+            try:
+                if stop.is_set():
+                    return
+                for batch in segment.batches():
+                    batches.put(batch)
+                    if stop.is_set():
+                        break
+            except BaseException as err:
+                batches.put(err)
+            finally:
+                batches.put(_DONE)
+
+        pending = len(self._segments)
+        try:
+            with ThreadPoolExecutor(self._max_workers) as pool:
+                for segment in self._segments:
+                    pool.submit(drain, segment)
+                try:
+                    while pending:
+                        item = batches.get()
+                        if item is _DONE:
+                            pending -= 1
+                        elif isinstance(item, BaseException):
+                            raise item
+                        else:
+                            for row in item:
+                                yield row
+                finally:
+                    stop.set()
+                    # keep taking batches so no worker stays blocked on the full queue
+                    while pending:
+                        if batches.get() is _DONE:
+                            pending -= 1
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            for segment in self._segments:
+                segment.close()
+            self._on_close(all(segment.exhausted for segment in self._segments))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _result_processors(compiled, dialect, description):
+    return [
+        entry[3]._cached_result_processor(dialect, column[1])
+        for entry, column in zip(compiled._result_columns, description)
+    ]
+
+
+def _retrieve_endpoint(engine, compiled, endpoint, batch_size):
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    cparams.update(
+        host=endpoint.hostname,
+        port=endpoint.port,
+        password=endpoint.auth_token,
+        options='-c gp_retrieve_conn=true',
+    )
+    statement = 'RETRIEVE %d FROM ENDPOINT %s' % (
+        batch_size, engine.dialect.identifier_preparer.quote(endpoint.endpointname))
+    dbapi_connection = engine.dialect.dbapi.connect(*cargs, **cparams)
+    try:
+        dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        processors = None
+        while True:
+            cursor.execute(statement)
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            if processors is None:
+                processors = _result_processors(compiled, engine.dialect, cursor.description)
+            if any(processors):
+                rows = [
+                    tuple(proc(value) if proc else value for proc, value in zip(processors, row))
+                    for row in rows
+                ]
+            yield rows
+    finally:
+        dbapi_connection.close()
+
+
+def _parallel_retrieve_cursor(engine, statement, batch_size, max_workers):
+    name = 'prc_%s' % uuid.uuid4().hex
+    compiled = statement.compile(dialect=engine.dialect)
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        connection.execute(DeclareParallelRetrieveCursor(name, statement))
+        endpoints = connection.execute(sqlalchemy.text(
+            'SELECT gp_segment_id, auth_token, hostname, port, endpointname '
+            'FROM gp_get_endpoints() WHERE cursorname = :name ORDER BY gp_segment_id'
+        ), {'name': name}).fetchall()
+    except BaseException:
+        transaction.rollback()
+        connection.close()
+        raise
+
+    def on_close(completed):
+        try:
+            if completed:
+                connection.execute(sqlalchemy.text(
+                    'SELECT gp_wait_parallel_retrieve_cursor(:name, -1)'), {'name': name})
+            connection.exec_driver_sql('CLOSE %s' % engine.dialect.identifier_preparer.quote(name))
+            transaction.commit()
+        finally:
+            connection.close()
+
+    segments = [
+        SegmentRows(
+            endpoint.gp_segment_id,
+            lambda endpoint=endpoint: _retrieve_endpoint(engine, compiled, endpoint, batch_size))
+        for endpoint in endpoints
+    ]
+    return ParallelResult(
+        [entry[0] for entry in compiled._result_columns], segments, max_workers or len(segments) or 1, on_close)
+
+
+def _fetch_segment(engine, statement, batch_size):
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+
+def _segment_id_fan_out(engine, statement, batch_size, max_workers, driving_table, segment_ids):
+    _check_select(statement)
+    if driving_table is None:
+        froms = _froms(statement)
+        if len(froms) != 1:
+            raise exc.ArgumentError('A driving_table is needed to split a SELECT with several FROM objects')
+        # the gp_segment_id of a join is ambiguous, the one of its leftmost table is used
+        driving_table = _leftmost_table(froms[0])
+    with engine.connect() as connection:
+        if _is_replicated(connection, driving_table):
+            raise exc.ArgumentError(
+                'Cannot split a SELECT by the gp_segment_id of the replicated table %s, every segment holds all '
+                'of its rows' % driving_table.name)
+        if segment_ids is None:
+            segment_ids = connection.exec_driver_sql(
+                "SELECT content FROM gp_segment_configuration WHERE role = 'p' AND content >= 0 ORDER BY content"
+            ).scalars().all()
+
+    statements = segment_statements(statement, driving_table, segment_ids)
+    segments = [
+        SegmentRows(segment_id, lambda stmt=stmt: _fetch_segment(engine, stmt, batch_size))
+        for segment_id, stmt in zip(segment_ids, statements)
+    ]
+    keys = [entry[0] for entry in statement.compile(dialect=engine.dialect)._result_columns]
+    return ParallelResult(keys, segments, max_workers or len(segments) or 1, lambda completed: None)
+
+
+def parallel_retrieve(engine, statement, batch_size=10000, max_workers=None, driving_table=None,
+                      segment_ids=None, use_parallel_retrieve_cursor=None):
+    """Run a SELECT and retrieve its rows from all segments in parallel
+
+    Note:
+        When the server supports it (Greenplum 7, or 6 with the gp_parallel_retrieve_cursor extension) the query
+        is declared as a PARALLEL RETRIEVE CURSOR and every segment endpoint is read over a direct retrieve
+        connection, so rows do not pass through the coordinator. Otherwise the query is split by the
+        gp_segment_id of its driving table and the parts run concurrently over pooled connections of the engine.
+
+    Args:
+        engine: the Engine to run the query with
+        statement: a Select
+        batch_size: the number of rows fetched per round trip from each segment
+        max_workers: the number of segments read concurrently when iterating the merged rows,
+            defaults to all of them
+        driving_table: the FROM object to filter on gp_segment_id in the fallback mode, defaults to the only
+            FROM object of the statement, or the leftmost table of its join. It cannot be replicated.
+        segment_ids: the segment content ids to query in the fallback mode, read from gp_segment_configuration
+            by default
+        use_parallel_retrieve_cursor: force (True) or disable (False) the parallel retrieve cursor mode,
+            detected from the server by default
+
+    Returns:
+        A ParallelResult
+    """
+    if use_parallel_retrieve_cursor is None:
+        with engine.connect() as connection:
+            use_parallel_retrieve_cursor = supports_parallel_retrieve_cursor(connection)
+    if use_parallel_retrieve_cursor:
+        logger.debug('parallel retrieve through PARALLEL RETRIEVE CURSOR')
+        return _parallel_retrieve_cursor(engine, statement, batch_size, max_workers)
+    logger.debug('parallel retrieve through gp_segment_id fan out')
+    return _segment_id_fan_out(engine, statement, batch_size, max_workers, driving_table, segment_ids)
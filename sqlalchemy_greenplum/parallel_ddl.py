@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import contextlib
+import hashlib
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import sqlalchemy
+from sqlalchemy import event, exc
+from sqlalchemy.sql.ddl import SchemaDropper, SchemaGenerator, sort_tables_and_constraints
+
+from sqlalchemy_greenplum.dialect import DDL_STATEMENT
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if 'greenplum_ddl_timing' in conn.info:
+        conn.info.setdefault('greenplum_ddl_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if 'greenplum_ddl_timing' not in conn.info:
+        return
+    seconds = time.perf_counter() - conn.info['greenplum_ddl_started'].pop()
+    if not DDL_STATEMENT.match(statement):
+        return
+    name, timings = conn.info['greenplum_ddl_timing']
+    statement = ' '.join(statement.split())
+    timings.append({'table': name, 'statement': statement, 'seconds': seconds})
+    logger.info('%s in %.3fs: %s', name, seconds, statement[:200])
+
+
+@contextlib.contextmanager
+def _time_statements(connection, name, timings):
+    """Record how long each DDL statement run on the connection inside the block takes, as dicts of table,
+    statement and seconds
+
+    Note:
+        The listeners are added to a Connection once, what they record for goes in its info, which is that of the
+        pooled DBAPI connection and so outlives the Connection: it is removed again at the end of the block.
+    """
+    if not event.contains(connection, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(connection, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(connection, 'after_cursor_execute', _after_cursor_execute)
+    connection.info['greenplum_ddl_timing'] = (name, timings)
+    try:
+        yield
+    finally:
+        del connection.info['greenplum_ddl_timing']
+        # left by a statement that failed
+        connection.info.pop('greenplum_ddl_started', None)
+
+
+def _run_graph(engine, tables, depends_on, run_table, max_workers, autocommit=False):
+    """Run ``run_table(connection, table)`` for every table, each once the tables it depends on are done
+
+    Note:
+        Each table runs in a transaction of its own on a pooled connection of the engine (or with every statement
+        committed on its own with ``autocommit``), up to ``max_workers`` at a time. After a failure no more tables
+        are started, the running ones finish and the first error is raised.
+    """
+    remaining = dict((table, set(depends_on[table])) for table in tables)
+    running = {}
+    errors = []
+
+    def run(table):
+        if autocommit:
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                run_table(connection, table)
+        else:
+            with engine.begin() as connection:
+                run_table(connection, table)
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        while remaining or running:
+            if not errors:
+                for table in [table for table, waiting in remaining.items() if not waiting]:
+                    if len(running) == max_workers:
+                        break
+                    del remaining[table]
+                    running[pool.submit(run, table)] = table
+            if not running:
+                if errors:
+                    break
+                raise exc.CircularDependencyError(
+                    'Tables waiting on each other', remaining, [], msg='Cannot order the DDL of %s' % ', '.join(
+                        sorted(str(table) for table in remaining)))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                table = running.pop(future)
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                for waiting in remaining.values():
+                    waiting.discard(table)
+    if errors:
+        raise errors[0]
+
+
+def create_all(engine, metadata, tables=None, checkfirst=True, max_workers=4):
+    """Create the tables of a MetaData concurrently over pooled connections, as far as foreign keys allow
+
+    Note:
+        Each CREATE TABLE is a distributed catalog transaction on Greenplum, so creating thousands of tables one by
+        one takes long. Here a table (with its indexes and comments) is created as soon as the tables its
+        foreign keys refer to exist, on one of ``max_workers`` connections of the engine; the pool has to allow
+        that many connections besides the one coordinating. Standalone sequences and the MetaData level
+        before_create events run first, foreign keys of dependency cycles and after_create events last, as
+        ``MetaData.create_all`` does. Unlike it, every table is created in a transaction of its own, so a failure
+        leaves the tables already created in place.
+
+    Args:
+        engine: the Engine to take the connections from
+        metadata: the MetaData to create
+        tables: the tables to create, all the tables of the MetaData by default
+        checkfirst: skip the tables that exist already
+        max_workers: the number of tables created concurrently
+
+    Returns:
+        The statements run for the tables, as dicts of table, statement and seconds, in the order they finished
+    """
+    tables = list(metadata.tables.values()) if tables is None else list(tables)
+    timings = []
+    with engine.begin() as connection:
+        generator = SchemaGenerator(connection.dialect, connection, checkfirst=checkfirst)
+        collection = sort_tables_and_constraints([table for table in tables if generator._can_create_table(table)])
+        sequences = [
+            sequence for sequence in metadata._sequences.values()
+            if sequence.column is None and generator._can_create_sequence(sequence)
+        ]
+        created = [table for table, _ in collection if table is not None]
+        metadata.dispatch.before_create(
+            metadata, connection, tables=created, checkfirst=checkfirst, _ddl_runner=generator)
+        for sequence in sequences:
+            generator.traverse_single(sequence, create_ok=True)
+
+    inline = dict((table, fkcs) for table, fkcs in collection if table is not None)
+    depends_on = dict(
+        (table, set(fkc.referred_table for fkc in fkcs if fkc.referred_table in inline) - {table})
+        for table, fkcs in inline.items()
+    )
+
+    def create_table(connection, table):
+        with _time_statements(connection, table.fullname, timings):
+            SchemaGenerator(connection.dialect, connection, checkfirst=checkfirst).traverse_single(
+                table, create_ok=True, include_foreign_key_constraints=inline[table], _is_metadata_operation=True)
+
+    _run_graph(engine, created, depends_on, create_table, max_workers)
+
+    with engine.begin() as connection:
+        generator = SchemaGenerator(connection.dialect, connection, checkfirst=checkfirst)
+        for table, fkcs in collection:
+            if table is None:
+                for fkc in fkcs:
+                    generator.traverse_single(fkc)
+        metadata.dispatch.after_create(
+            metadata, connection, tables=created, checkfirst=checkfirst, _ddl_runner=generator)
+    return timings
+
+
+def drop_all(engine, metadata, tables=None, checkfirst=True, max_workers=4):
+    """Drop the tables of a MetaData concurrently over pooled connections, as far as foreign keys allow
+
+    Note:
+        The counterpart of ``create_all``: a table is dropped once the tables whose foreign keys refer to it are
+        gone. Foreign keys of dependency cycles are dropped first and sequences last, as ``MetaData.drop_all``
+        does.
+
+    Returns:
+        The statements run for the tables, as dicts of table, statement and seconds, in the order they finished
+    """
+    tables = list(metadata.tables.values()) if tables is None else list(tables)
+    timings = []
+    with engine.begin() as connection:
+        dropper = SchemaDropper(connection.dialect, connection, checkfirst=checkfirst)
+        dropped = [table for table in tables if dropper._can_drop_table(table)]
+        collection = sort_tables_and_constraints(
+            dropped, filter_fn=lambda constraint: False
+            if not connection.dialect.supports_alter or constraint.name is None else None)
+        sequences = [sequence for sequence in metadata._sequences.values() if dropper._can_drop_sequence(sequence)]
+        dropped = [table for table, _ in collection if table is not None]
+        metadata.dispatch.before_drop(
+            metadata, connection, tables=dropped, checkfirst=checkfirst, _ddl_runner=dropper)
+        for table, fkcs in collection:
+            if table is None:
+                for fkc in fkcs:
+                    dropper.traverse_single(fkc)
+
+    inline = dict((table, fkcs) for table, fkcs in collection if table is not None)
+    depends_on = dict((table, set()) for table in inline)
+    for table, fkcs in inline.items():
+        for fkc in fkcs:
+            if fkc.referred_table in inline and fkc.referred_table is not table:
+                depends_on[fkc.referred_table].add(table)
+
+    def drop_table(connection, table):
+        with _time_statements(connection, table.fullname, timings):
+            SchemaDropper(connection.dialect, connection, checkfirst=checkfirst).traverse_single(
+                table, drop_ok=True, _is_metadata_operation=True, _ignore_sequences=sequences)
+
+    _run_graph(engine, dropped, depends_on, drop_table, max_workers)
+
+    with engine.begin() as connection:
+        dropper = SchemaDropper(connection.dialect, connection, checkfirst=checkfirst)
+        for sequence in sequences:
+            dropper.traverse_single(sequence, drop_ok=sequence.column is None)
+        metadata.dispatch.after_drop(
+            metadata, connection, tables=dropped, checkfirst=checkfirst, _ddl_runner=dropper)
+    return timings
+
+
+def partition_index_name(index_name, partition_name, max_length=63):
+    """The name of the index built on a partition for an index of the partitioned table, at most max_length long"""
+    name = '%s_%s' % (index_name, partition_name)
+    if len(name) <= max_length:
+        return name
+    digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+    return '%s_%s' % (name[:max_length - 9], digest)
+
+
+def _index_on(index, table_name, schema, name, **options):
+    """A copy of an Index of a partitioned table on one of its partitions (or the table itself)"""
+    table = index.table.to_metadata(sqlalchemy.MetaData(), schema=schema, name=table_name)
+    copy = [candidate for candidate in table.indexes if candidate.name == index.name][0]
+    copy.name = name
+    for option, value in options.items():
+        copy.dialect_options['greenplum'][option] = value
+    return copy
+
+
+def _qualified_name(connection, name, schema):
+    preparer = connection.dialect.identifier_preparer
+    return '%s.%s' % (preparer.quote_schema(schema), preparer.quote(name))
+
+
+def _index_state(connection, qualified_name):
+    """None for a missing index, else whether it is valid (a failed CREATE INDEX CONCURRENTLY leaves it invalid)"""
+    return connection.execute(
+        sqlalchemy.text('SELECT i.indisvalid FROM pg_catalog.pg_index i WHERE i.indexrelid = to_regclass(:name)'),
+        dict(name=qualified_name)
+    ).scalar()
+
+
+def _is_attached(connection, qualified_name, qualified_parent):
+    return connection.execute(
+        sqlalchemy.text(
+            'SELECT count(*) FROM pg_catalog.pg_inherits '
+            'WHERE inhrelid = to_regclass(:name) AND inhparent = to_regclass(:parent)'),
+        dict(name=qualified_name, parent=qualified_parent)
+    ).scalar() > 0
+
+
+def create_partitioned_index(engine, index, max_workers=4, concurrently=None, progress=None):
+    """Create an index of a partitioned table by building it on the leaf partitions concurrently
+
+    Note:
+        CREATE INDEX on a partitioned table builds the index of every partition one after the other in a single
+        transaction holding its locks throughout. Here the index of each leaf partition is built on its own
+        pooled connection, up to ``max_workers`` at a time, and committed on its own. On Greenplum 7 (and
+        PostgreSQL 11 or later) the index of the table is first created with CREATE INDEX ... ON ONLY, which is
+        invalid until the index of every leaf partition is attached to it with ALTER INDEX ... ATTACH PARTITION.
+        Older Greenplum releases cannot attach indexes: there the index is created with a plain CREATE INDEX on
+        the table, which builds it on every partition in one transaction, and ``max_workers`` and ``progress``
+        are not used.
+        Running it again after a failure resumes: the partitions indexed and attached already are skipped, the
+        invalid indexes a failed concurrent build leaves behind are dropped and built again.
+
+    Args:
+        engine: the Engine to take the connections from
+        index: the Index of a partitioned Table to create
+        max_workers: the number of partitions indexed concurrently
+        concurrently: build the indexes of the partitions with CREATE INDEX CONCURRENTLY (where the server
+            supports it), which does not block writes. Defaults to the greenplum_concurrently option of the index.
+        progress: a callable receiving the number of partitions done, their total and the name of the partition
+            just done
+
+    Returns:
+        The statements run for the partitions, as dicts of table, statement and seconds, in the order they finished
+    """
+    table = index.table
+    if concurrently is None:
+        concurrently = index.dialect_options['greenplum']['concurrently']
+    with engine.connect() as connection:
+        dialect = connection.dialect
+        schema = table.schema or dialect.default_schema_name
+        partitions = dialect.get_partitions(connection, table.name, schema)
+    if not partitions:
+        raise exc.ArgumentError('Table %s has no partitions' % table.fullname)
+    greenplum_version = dialect.greenplum_version_info
+    attach = greenplum_version is None and dialect.server_version_info >= (11, ) or \
+        greenplum_version is not None and greenplum_version >= (7, )
+    timings = []
+    if not attach:
+        logger.info('The server cannot attach indexes, %s is indexed with a single CREATE INDEX', table.fullname)
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection, \
+                _time_statements(connection, table.fullname, timings):
+            if _index_state(connection, _qualified_name(connection, index.name, schema)) is None:
+                connection.execute(sqlalchemy.schema.CreateIndex(
+                    _index_on(index, table.name, schema, index.name, concurrently=False)))
+        return timings
+
+    parents = set(partition['parent'] for partition in partitions)
+    leaves = [partition for partition in partitions if partition['name'] not in parents]
+    parent_indexes = {table.name: (index.name, schema)}
+    for partition in partitions:
+        if partition['name'] in parents:
+            parent_indexes[partition['name']] = (
+                partition_index_name(index.name, partition['name']), partition['schema'])
+
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        # the index of the table and of the intermediate partitions, each attached to the one above it
+        for partition in [{'name': table.name, 'schema': schema, 'parent': None}] + partitions:
+            if partition['name'] not in parents:
+                continue
+            name, index_schema = parent_indexes[partition['name']]
+            qualified = _qualified_name(connection, name, index_schema)
+            if _index_state(connection, qualified) is None:
+                connection.execute(sqlalchemy.schema.CreateIndex(
+                    _index_on(index, partition['name'], partition['schema'], name, only=True, concurrently=False)))
+            if partition['parent'] is not None:
+                parent = _qualified_name(connection, *parent_indexes[partition['parent']])
+                if not _is_attached(connection, qualified, parent):
+                    connection.execute(sqlalchemy.text('ALTER INDEX %s ATTACH PARTITION %s' % (parent, qualified)))
+
+    done = []
+    by_name = dict((partition['name'], partition) for partition in leaves)
+
+    def index_partition(connection, name):
+        partition = by_name[name]
+        leaf_index = partition_index_name(index.name, name)
+        qualified = _qualified_name(connection, leaf_index, partition['schema'])
+        with _time_statements(connection, name, timings):
+            state = _index_state(connection, qualified)
+            if state is False:
+                connection.execute(sqlalchemy.text('DROP INDEX %s' % qualified))
+            if not state:
+                connection.execute(sqlalchemy.schema.CreateIndex(
+                    _index_on(index, name, partition['schema'], leaf_index, concurrently=concurrently)))
+        done.append(name)
+        logger.info('indexed partition %s (%d of %d)', name, len(done), len(leaves))
+        if progress is not None:
+            progress(len(done), len(leaves), name)
+
+    _run_graph(engine, list(by_name), dict((name, ()) for name in by_name), index_partition, max_workers,
+               autocommit=True)
+
+    # attached one at a time: an ATTACH only validates the parent index when it sees all the other partitions
+    # attached, which concurrent transactions would not
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection, \
+            _time_statements(connection, table.fullname, timings):
+        for partition in leaves:
+            qualified = _qualified_name(connection, partition_index_name(index.name, partition['name']),
+                                        partition['schema'])
+            parent = _qualified_name(connection, *parent_indexes[partition['parent']])
+            if not _is_attached(connection, qualified, parent):
+                connection.execute(sqlalchemy.text('ALTER INDEX %s ATTACH PARTITION %s' % (parent, qualified)))
+    return timings
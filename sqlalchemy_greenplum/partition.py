@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+
+class PartitionBy(object):
+    """Base of the partitioning schemes given as greenplum_partition_by (or as a subpartition level)
+
+    Note:
+        ``partitions`` are the partitions of the table. For a subpartition level they form the SUBPARTITION
+        TEMPLATE applied to every partition, without them each partition lists its own ``subpartitions``.
+    """
+    strategy = None
+
+    def __init__(self, column, partitions=(), subpartition_by=None):
+        self.column = column
+        self.partitions = list(partitions)
+        self.subpartition_by = subpartition_by
+
+
+class RangePartitionBy(PartitionBy):
+    """PARTITION BY RANGE (column) with RangePartition and DefaultPartition partitions
+
+    Example::
+
+        RangePartitionBy('created', [
+            RangePartition(start=datetime.date(2020, 1, 1), end=datetime.date(2021, 1, 1), every='1 month'),
+            DefaultPartition('outlying'),
+        ])
+    """
+    strategy = 'RANGE'
+
+
+class ListPartitionBy(PartitionBy):
+    """PARTITION BY LIST (column) with ListPartition and DefaultPartition partitions
+
+    Example::
+
+        ListPartitionBy('region', [ListPartition('usa', ['usa']), DefaultPartition('other_regions')])
+    """
+    strategy = 'LIST'
+
+
+class Partition(object):
+    """Base of the partitions of a PartitionBy
+
+    Args:
+        name: the partition name, tables of partitions are named <table>_1_prt_<name>
+        storage_params: storage options of the partition as a string ('appendonly=true,compresstype=zlib')
+            or a dict
+        tablespace: the tablespace of the partition
+        subpartitions: the partitions of this partition, when the subpartition level has no template
+    """
+    def __init__(self, name=None, storage_params=None, tablespace=None, subpartitions=None):
+        self.name = name
+        self.storage_params = storage_params
+        self.tablespace = tablespace
+        self.subpartitions = subpartitions
+
+
+class RangePartition(Partition):
+    """A range partition, START inclusive and END exclusive by default
+
+    Args:
+        start: the lower bound, a Python value or a SQL expression
+        end: the upper bound
+        every: split the range into partitions of this width, a number, a timedelta, an interval string such as
+            '1 month' or a SQL expression
+        start_inclusive: render START as INCLUSIVE (default) or EXCLUSIVE
+        end_inclusive: render END as INCLUSIVE or EXCLUSIVE (default)
+    """
+    def __init__(self, name=None, start=None, end=None, every=None, start_inclusive=True, end_inclusive=False,
+                 **kw):
+        super(RangePartition, self).__init__(name, **kw)
+        self.start = start
+        self.end = end
+        self.every = every
+        self.start_inclusive = start_inclusive
+        self.end_inclusive = end_inclusive
+
+
+class ListPartition(Partition):
+    """A list partition holding the rows with one of the given values"""
+    def __init__(self, name=None, values=(), **kw):
+        super(ListPartition, self).__init__(name, **kw)
+        self.values = list(values)
+
+
+class DefaultPartition(Partition):
+    """The DEFAULT PARTITION receiving the rows no other partition holds"""
+    def __init__(self, name, **kw):
+        super(DefaultPartition, self).__init__(name, **kw)
+
+
+class PartitionFor(object):
+    """Refer to the partition holding a value, rendered as FOR (value)"""
+    def __init__(self, value):
+        self.value = value
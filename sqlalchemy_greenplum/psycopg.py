@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy.dialects.postgresql.psycopg import PGDialect_psycopg, PGDialectAsync_psycopg, \
+    PGExecutionContext_psycopg
+from sqlalchemy.util import await_only
+from sqlalchemy_greenplum import async_copy as gp_async_copy
+from sqlalchemy_greenplum import copy as gp_copy
+from sqlalchemy_greenplum import reflection as gp_reflection
+from sqlalchemy_greenplum.dialect import DDL_STATEMENT, GreenplumDialectMixin, GreenplumExecutionContextMixin
+
+COPY_FORMAT_OPTIONS = {'text': '', 'csv': ' WITH CSV', 'binary': ' WITH BINARY'}
+
+
+class GreenplumExecutionContext_psycopg(GreenplumExecutionContextMixin, PGExecutionContext_psycopg):
+    """Execution context for Greenplum over psycopg 3
+
+    Note:
+        Fetches the results of the statement in binary format when the dialect or the ``greenplum_binary_results``
+        execution option asks for it.
+    """
+    def create_default_cursor(self):
+        if self.execution_options.get('greenplum_binary_results', self.dialect.binary_results):
+            return self._dbapi_connection.cursor(binary=True)
+        return self._dbapi_connection.cursor()
+
+
+class GreenplumDialect_psycopg(GreenplumDialectMixin, PGDialect_psycopg):
+    """Greenplum dialect over psycopg 3, for ``create_engine('greenplum+psycopg://...')``
+
+    Note:
+        Inherits the driver specific parts from PGDialect_psycopg, which needs SQLAlchemy 2.0. psycopg sends the
+        parameter sets of an executemany through pipeline mode, without waiting for the server between them, and
+        ``execute_pipelined`` does the same for a batch of statements. ``create_async_engine`` gets the
+        greenplum+psycopg_async dialect for the URL.
+    """
+    supports_statement_cache = True
+    execution_ctx_cls = GreenplumExecutionContext_psycopg
+
+    def __init__(self, binary_results=False, **kw):
+        """Construct the dialect
+
+        Args:
+            binary_results: fetch results in binary format, which saves the server and the client formatting and
+                parsing numbers, timestamps and the like as text. Types psycopg has no binary loader for come back
+                as bytes. Can be overridden per engine, connection or statement with the
+                ``greenplum_binary_results`` execution option.
+            **kw: the arguments of GreenplumDialect and PGDialect_psycopg
+        """
+        super(GreenplumDialect_psycopg, self).__init__(**kw)
+        self.binary_results = binary_results
+
+    @classmethod
+    def get_async_dialect_cls(cls, url):
+        return GreenplumDialectAsync_psycopg
+
+    def _copy_from_stream(self, cursor, context, table, columns, stream):
+        """Load the rows of a CopyInStream into the columns of a table with ``COPY ... FROM STDIN``"""
+        with cursor.copy(gp_copy.copy_from_statement(self.identifier_preparer, table, columns)) as copy:
+            while True:
+                data = stream.read(gp_async_copy.COPY_CHUNK_SIZE)
+                if not data:
+                    break
+                copy.write(data)
+
+
+class GreenplumDialectAsync_psycopg(GreenplumDialect_psycopg, PGDialectAsync_psycopg):
+    """Greenplum dialect over the asyncio connections of psycopg 3, for
+    ``create_async_engine('greenplum+psycopg_async://...')``
+
+    Note:
+        Inherits the driver specific parts from PGDialectAsync_psycopg, which needs SQLAlchemy 2.0.
+    """
+    supports_statement_cache = True
+
+    async def _copy_in(self, adapted_connection, table, columns, chunks):
+        statement = gp_copy.copy_from_statement(self.identifier_preparer, table, columns)
+        async with adapted_connection.driver_connection.cursor() as cursor:
+            async with cursor.copy(statement) as copy:
+                async for chunk in chunks:
+                    await copy.write(chunk)
+
+    async def _copy_out(self, adapted_connection, compiled, params, format):
+        statement = 'COPY (%s) TO STDOUT%s' % (compiled.string, COPY_FORMAT_OPTIONS[format])
+        async with adapted_connection.driver_connection.cursor() as cursor:
+            async with cursor.copy(statement, params) as copy:
+                async for data in copy:
+                    yield bytes(data)
+
+    def _copy_from_stream(self, cursor, context, table, columns, stream):
+        await_only(self._copy_in(
+            context._dbapi_connection.dbapi_connection, table, columns, gp_async_copy.stream_chunks(stream)))
+
+
+def _compile_pipelined(dialect, statement):
+    if isinstance(statement, tuple):
+        statement, params = statement
+    else:
+        params = None
+    if isinstance(statement, str):
+        statement = sqlalchemy.text(statement)
+    compiled = statement.compile(dialect=dialect)
+    processors = compiled._bind_processors
+    params = dict(
+        (key, processors[key](value) if key in processors else value)
+        for key, value in compiled.construct_params(params).items()
+    )
+    return compiled.string, params
+
+
+def execute_pipelined(connection, statements):
+    """Run statements returning no rows in one psycopg pipeline, waiting for the server once for all of them
+
+    Note:
+        Meant for batches of small INSERT, UPDATE, DELETE and DDL statements, which otherwise take a round trip to
+        the server each. They run in the transaction of the connection. An error is raised once the pipeline is
+        synced, for the first statement that failed: the statements before it ran, the ones after it were skipped
+        and the transaction is aborted. The statements go to the driver connection directly, bypassing the
+        execution context: the greenplum_settings execution option, the rows counted for auto_analyze and
+        explain sampling do not apply to them.
+
+    Args:
+        connection: a Connection of the greenplum+psycopg dialect
+        statements: Executables, SQL strings or ``(statement, parameters)`` tuples
+
+    Returns:
+        The rowcount of each statement
+    """
+    dialect = connection.dialect
+    if not isinstance(dialect, GreenplumDialect_psycopg) or dialect.is_async:
+        raise exc.InvalidRequestError('execute_pipelined needs a Connection of the greenplum+psycopg dialect')
+    compiled = [_compile_pipelined(dialect, statement) for statement in statements]
+    if not connection.in_transaction():
+        connection.begin()
+    driver_connection = connection.connection.driver_connection
+    cursors = []
+    try:
+        with driver_connection.pipeline():
+            for statement, params in compiled:
+                cursor = driver_connection.cursor()
+                cursors.append(cursor)
+                cursor.execute(statement, params)
+        return [cursor.rowcount for cursor in cursors]
+    except dialect.dbapi.Error as err:
+        failed = next((i for i, cursor in enumerate(cursors) if cursor.pgresult is None), len(cursors) - 1)
+        statement, params = compiled[failed]
+        raise exc.DBAPIError.instance(statement, params, err, dialect.dbapi.Error)
+    finally:
+        for cursor in cursors:
+            cursor.close()
+        if dialect.reflection_cache_ttl is not None and \
+                any(DDL_STATEMENT.match(statement) for statement, _ in compiled):
+            gp_reflection.invalidate_reflection_cache(connection.engine.url)
+            # and again when the transaction ends, as the execution context does
+            connection.info['greenplum_ddl_url'] = connection.engine.url
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import collections
+import copy
+import threading
+import time
+
+import sqlalchemy
+
+_reflection_caches = {}
+_reflection_caches_lock = threading.Lock()
+
+
+def _distribution_columns(greenplum_version):
+    if greenplum_version is None:
+        return "NULL::\"char\" AS policytype, NULL::text[] AS distkey"
+    if greenplum_version >= (6, ):
+        policytype, keys = 'p.policytype', 'p.distkey::int2[]'
+    else:
+        policytype, keys = "CASE WHEN p.localoid IS NOT NULL THEN 'p'::\"char\" END", 'p.attrnums'
+    return (
+        "%s AS policytype, "
+        "CASE WHEN p.localoid IS NOT NULL THEN ARRAY("
+        "SELECT a.attname::text FROM generate_series(array_lower(%s, 1), array_upper(%s, 1)) AS i "
+        "JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid AND a.attnum = (%s)[i] ORDER BY i"
+        ") END AS distkey" % (policytype, keys, keys, keys)
+    )
+
+
+def _storage_columns(greenplum_version):
+    if greenplum_version is None:
+        return "c.reloptions, NULL::text AS access_method"
+    if greenplum_version >= (7, ):
+        return (
+            "c.reloptions, (SELECT am.amname FROM pg_catalog.pg_am am WHERE am.oid = c.relam)::text AS access_method"
+        )
+    return (
+        "c.reloptions, CASE WHEN ao.columnstore THEN 'ao_column' WHEN ao.relid IS NOT NULL THEN 'ao_row' "
+        "END AS access_method"
+    )
+
+
+def _partition_column(greenplum_version, server_version):
+    if greenplum_version is not None and greenplum_version < (7, ):
+        return (
+            "CASE WHEN EXISTS (SELECT 1 FROM pg_catalog.pg_partition pp "
+            "WHERE pp.parrelid = c.oid AND pp.parlevel = 0 AND NOT pp.paristemplate) "
+            "THEN pg_catalog.pg_get_partition_def(c.oid) END AS partition_by"
+        )
+    if server_version >= (10, ):
+        return "CASE WHEN c.relkind = 'p' THEN pg_catalog.pg_get_partkeydef(c.oid) END AS partition_by"
+    return "NULL::text AS partition_by"
+
+
+def table_options_query(dialect, schema, has_filter_names, temporary=None):
+    """Build the query returning the distribution, storage and partitioning of many tables at once
+
+    Args:
+        dialect: the GreenplumDialect of the connection, the catalog differs between Greenplum releases
+        schema: the schema of the tables, None for the tables visible in the search path
+        has_filter_names: restrict the query to the names bound to the ``filter_names`` parameter
+        temporary: True for temporary tables only, False for permanent tables only, None for both
+    """
+    greenplum_version = dialect.greenplum_version_info
+    joins = ["JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace"]
+    if greenplum_version is not None:
+        joins.append("LEFT JOIN pg_catalog.gp_distribution_policy p ON p.localoid = c.oid")
+        if greenplum_version < (7, ):
+            joins.append("LEFT JOIN pg_catalog.pg_appendonly ao ON ao.relid = c.oid")
+
+    where = ["c.relkind IN ('r', 'p')"]
+    params = []
+    if schema is None:
+        where.append("pg_catalog.pg_table_is_visible(c.oid) AND n.nspname != 'pg_catalog'")
+    else:
+        where.append("n.nspname = :schema")
+        params.append(sqlalchemy.bindparam('schema', schema))
+    if temporary is True:
+        where.append("c.relpersistence = 't'")
+    elif temporary is False:
+        where.append("c.relpersistence != 't'")
+    if has_filter_names:
+        where.append("c.relname IN :filter_names")
+        params.append(sqlalchemy.bindparam('filter_names', expanding=True))
+
+    sql = "SELECT c.relname, %s, %s, %s FROM pg_catalog.pg_class c %s WHERE %s" % (
+        _distribution_columns(greenplum_version),
+        _storage_columns(greenplum_version),
+        _partition_column(greenplum_version, dialect.server_version_info),
+        ' '.join(joins),
+        ' AND '.join(where),
+    )
+    return sqlalchemy.text(sql).bindparams(*params)
+
+
+def distributed_by_option(preparer, policytype, distkey):
+    """The greenplum_distributed_by value of a gp_distribution_policy row, None for no policy"""
+    if policytype is None:
+        return None
+    if policytype == 'r':
+        return 'REPLICATED'
+    if not distkey:
+        return 'RANDOM'
+    return ','.join(preparer.quote(name) for name in distkey)
+
+
+def storage_params_option(reloptions, access_method):
+    """The greenplum_storage_params value of a table from its reloptions and (append optimized) access method"""
+    options = list(reloptions or [])
+    names = set(option.split('=', 1)[0].lower() for option in options)
+    derived = []
+    if access_method in ('ao_row', 'ao_column'):
+        if 'appendonly' not in names and 'appendoptimized' not in names:
+            derived.append('appendonly=true')
+        if access_method == 'ao_column' and 'orientation' not in names:
+            derived.append('orientation=column')
+    options = derived + options
+    return ','.join(options) if options else None
+
+
+def partition_by_option(partition_by):
+    """The greenplum_partition_by value of a table from its partition definition"""
+    if not partition_by:
+        return None
+    if partition_by.upper().startswith('PARTITION BY '):
+        partition_by = partition_by[len('PARTITION BY '):]
+    return partition_by.strip()
+
+
+def table_options(preparer, row):
+    """The greenplum_* table options of one row of the table options query"""
+    options = {}
+    distributed_by = distributed_by_option(preparer, row.policytype, row.distkey)
+    if distributed_by is not None:
+        options['greenplum_distributed_by'] = distributed_by
+    storage_params = storage_params_option(row.reloptions, row.access_method)
+    if storage_params is not None:
+        options['greenplum_storage_params'] = storage_params
+    partition_by = partition_by_option(row.partition_by)
+    if partition_by is not None:
+        options['greenplum_partition_by'] = partition_by
+    return options
+
+
+def table_names_query(dialect, include_partitions):
+    """Build the query listing the tables of the ``schema`` parameter, leaving out child partitions by default"""
+    sql = (
+        "SELECT c.relname FROM pg_catalog.pg_class c "
+        "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relkind IN ('r', 'p')"
+    )
+    if not include_partitions:
+        greenplum_version = dialect.greenplum_version_info
+        if greenplum_version is not None and greenplum_version < (7, ):
+            sql += " AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_partition_rule pr WHERE pr.parchildrelid = c.oid)"
+        elif dialect.server_version_info >= (10, ):
+            sql += " AND NOT c.relispartition"
+    return sqlalchemy.text(sql).columns(relname=sqlalchemy.Unicode)
+
+
+def partitions_query(dialect):
+    """Build the query listing all partitions below the ``table_name`` in ``schema``, by level and position"""
+    greenplum_version = dialect.greenplum_version_info
+    if greenplum_version is not None and greenplum_version < (7, ):
+        sql = (
+            "SELECT partitionschemaname AS schema, partitiontablename AS name, partitionname AS partition_name, "
+            "COALESCE(parentpartitiontablename, tablename) AS parent, partitionlevel AS level, "
+            "partitionboundary AS bound, partitionisdefault AS is_default "
+            "FROM pg_catalog.pg_partitions "
+            "WHERE schemaname = :schema AND tablename = :table_name "
+            "ORDER BY partitionlevel, partitionposition"
+        )
+    else:
+        sql = (
+            "WITH RECURSIVE parts (oid, parent, level) AS ("
+            "SELECT i.inhrelid, i.inhparent, 0 FROM pg_catalog.pg_inherits i "
+            "JOIN pg_catalog.pg_class pc ON pc.oid = i.inhparent "
+            "JOIN pg_catalog.pg_namespace pn ON pn.oid = pc.relnamespace "
+            "WHERE pn.nspname = :schema AND pc.relname = :table_name AND pc.relkind = 'p' "
+            "UNION ALL "
+            "SELECT i.inhrelid, i.inhparent, parts.level + 1 FROM pg_catalog.pg_inherits i "
+            "JOIN parts ON i.inhparent = parts.oid) "
+            "SELECT n.nspname AS schema, c.relname AS name, NULL::text AS partition_name, "
+            "pc.relname AS parent, parts.level, pg_catalog.pg_get_expr(c.relpartbound, c.oid) AS bound, "
+            "pg_catalog.pg_get_expr(c.relpartbound, c.oid) = 'DEFAULT' AS is_default "
+            "FROM parts JOIN pg_catalog.pg_class c ON c.oid = parts.oid "
+            "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+            "JOIN pg_catalog.pg_class pc ON pc.oid = parts.parent "
+            "ORDER BY parts.level, c.relname"
+        )
+    return sqlalchemy.text(sql)
+
+
+class ReflectionCache(object):
+    """A size bounded and expiring replacement for the info_cache dict of an Inspector, shared between Inspectors
+
+    Note:
+        Entries expire ``ttl`` seconds after they were stored and the least recently used ones are evicted beyond
+        ``maxsize`` entries. Values are copied on the way out, so callers changing what they got back cannot change
+        what other Inspectors get. ``hits``, ``misses`` and ``evictions`` count lookups since creation.
+    """
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _cache_key(url):
+    return url.render_as_string(hide_password=True)
+
+
+def reflection_cache(url, ttl, maxsize, include_partitions=False):
+    """Return the ReflectionCache shared by all Inspectors of engines connecting to the given URL
+
+    Note:
+        Engines with other reflection settings (the include_partitions, ttl and size of their dialect) get
+        caches of their own, as they reflect the same tables differently.
+    """
+    key = (_cache_key(url), bool(include_partitions), ttl, maxsize)
+    with _reflection_caches_lock:
+        cache = _reflection_caches.get(key)
+        if cache is None:
+            cache = _reflection_caches[key] = ReflectionCache(ttl, maxsize)
+        return cache
+
+
+def invalidate_reflection_cache(url=None):
+    """Empty the reflection cache of the given URL, or all reflection caches"""
+    with _reflection_caches_lock:
+        if url is None:
+            caches = list(_reflection_caches.values())
+        else:
+            url_key = _cache_key(url)
+            caches = [cache for key, cache in _reflection_caches.items() if key[0] == url_key]
+    for cache in caches:
+        cache.clear()
+
+
+ENCODING_DEFAULTS = {'compresstype': 'none', 'compresslevel': 0, 'blocksize': 32768}
+
+
+def column_encodings_query(schema, has_filter_names):
+    """Build the query returning the ENCODING storage directives of the columns of append optimized column tables"""
+    sql = (
+        "SELECT c.relname, a.attname, e.attoptions FROM pg_catalog.pg_attribute_encoding e "
+        "JOIN pg_catalog.pg_class c ON c.oid = e.attrelid "
+        "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+        "JOIN pg_catalog.pg_attribute a ON a.attrelid = e.attrelid AND a.attnum = e.attnum "
+        "WHERE NOT a.attisdropped AND "
+    )
+    params = []
+    if schema is None:
+        sql += "pg_catalog.pg_table_is_visible(c.oid) AND n.nspname != 'pg_catalog'"
+    else:
+        sql += "n.nspname = :schema"
+        params.append(sqlalchemy.bindparam('schema', schema))
+    if has_filter_names:
+        sql += " AND c.relname IN :filter_names"
+        params.append(sqlalchemy.bindparam('filter_names', expanding=True))
+    return sqlalchemy.text(sql).bindparams(*params)
+
+
+def encoding_option(attoptions):
+    """The greenplum_encoding value of a column from its attoptions, None when all directives are the defaults"""
+    encoding = {}
+    for option in attoptions or []:
+        name, _, value = option.partition('=')
+        name = name.lower()
+        if name in ('compresslevel', 'blocksize'):
+            value = int(value)
+        if ENCODING_DEFAULTS.get(name) != value:
+            encoding[name] = value
+    return encoding or None
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import logging
+import uuid
+
+import sqlalchemy
+from sqlalchemy.schema import CreateIndex, CreateTable, DropTable
+
+from sqlalchemy_greenplum.ddl import Analyze, ExchangePartition, RenameTable
+from sqlalchemy_greenplum.dialect import STORAGE_OPTIONS
+from sqlalchemy_greenplum.dml import _transaction
+
+logger = logging.getLogger('sqlalchemy.dialects.postgresql')
+
+# The longest identifier the server keeps
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def _suffixed(name, suffix):
+    return '%s_%s' % (name[:MAX_IDENTIFIER_LENGTH - len(suffix) - 1], suffix)
+
+
+def _index_backed_constraints(table):
+    return [
+        constraint for constraint in table.constraints
+        if isinstance(constraint, (sqlalchemy.PrimaryKeyConstraint, sqlalchemy.UniqueConstraint)) and
+        isinstance(constraint.name, str)
+    ]
+
+
+def _declares_storage(table):
+    gp_options = table.dialect_options['greenplum']
+    return gp_options['storage_params'] is not None or any(gp_options[name] is not None for name in STORAGE_OPTIONS)
+
+
+def _reflect_storage(connection, table, shadow):
+    """Give the shadow table the distribution, storage options and column encodings the Table does not declare"""
+    inspector = sqlalchemy.inspect(connection)
+    reflected = inspector.get_table_options(table.name, schema=table.schema)
+    gp_options = shadow.dialect_options['greenplum']
+    if gp_options['distributed_by'] is None:
+        gp_options['distributed_by'] = reflected.get('greenplum_distributed_by')
+    if _declares_storage(table):
+        return
+    gp_options['storage_params'] = reflected.get('greenplum_storage_params')
+    if gp_options['storage_params'] is None or \
+            any(column.dialect_options['greenplum']['encoding'] for column in table.columns):
+        return
+    encodings = dict(
+        (column['name'], column.get('dialect_options', {}).get('greenplum_encoding'))
+        for column in inspector.get_columns(table.name, schema=table.schema))
+    for column in shadow.columns:
+        if encodings.get(column.name):
+            column.dialect_options['greenplum']['encoding'] = encodings[column.name]
+
+
+def shadow_table_like(table, suffix=None, connection=None, metadata=None, **kw):
+    """Define a table to load the new contents of a table into, with the same structure, distribution and storage
+
+    Note:
+        The shadow table is a permanent table in the schema of the table, with its columns, constraints, indexes
+        and the greenplum_* options post_create_table renders. A distribution the Table does not give is reflected
+        through ``connection``, and so are the storage options and column encodings when the Table declares no
+        storage options, so an append optimized table gets an append optimized shadow table. Index and named
+        constraint names get the suffix too, as
+        they are unique in a schema. No column is autoincrement, so no sequence is created with the table, and
+        foreign keys are meant to be left out when creating it (Greenplum does not enforce them).
+        The Table is only defined, create it with ``CreateTable(shadow, include_foreign_key_constraints=[])``.
+
+    Args:
+        table: the Table to mirror
+        suffix: appended to the names of the table, its indexes and named constraints, random by default
+        connection: a Connection used to reflect the distribution and storage of the table
+        metadata: the MetaData of the new Table, a MetaData of its own by default
+        **kw: greenplum_* table options overriding the copied ones, such as greenplum_partition_by=None
+
+    Returns:
+        A Table
+    """
+    suffix = suffix or uuid.uuid4().hex[:8]
+    shadow = table.to_metadata(metadata or sqlalchemy.MetaData(), name=_suffixed(table.name, suffix))
+    if connection is not None and connection.dialect.greenplum_version_info is not None:
+        _reflect_storage(connection, table, shadow)
+    for key, value in kw.items():
+        shadow.dialect_kwargs[key] = value
+    for column in shadow.columns:
+        column.autoincrement = False
+    for index in shadow.indexes:
+        index.name = _suffixed(index.name, suffix)
+    for constraint in _index_backed_constraints(shadow):
+        constraint.name = _suffixed(constraint.name, suffix)
+    return shadow
+
+
+def _load(connection, shadow, source):
+    if callable(source):
+        return source(connection, shadow)
+    if isinstance(source, sqlalchemy.sql.Select):
+        return connection.execute(shadow.insert().from_select(list(source.selected_columns.keys()), source)).rowcount
+    rows = list(source)
+    if rows:
+        connection.execution_options(greenplum_copy_executemany=True).execute(shadow.insert(), rows)
+    return len(rows)
+
+
+def _fill_shadow(connection, shadow, source, analyze):
+    """Load the shadow table, then build its indexes and collect its statistics"""
+    count = _load(connection, shadow, source)
+    for index in shadow.indexes:
+        connection.execute(CreateIndex(index))
+    if analyze:
+        connection.execute(Analyze(shadow))
+    return count
+
+
+def _qualified_name(connection, name, schema):
+    preparer = connection.dialect.identifier_preparer
+    if schema is None:
+        return preparer.quote(name)
+    return '%s.%s' % (preparer.quote_schema(schema), preparer.quote(name))
+
+
+def _serial_sequences(connection, qualified_name):
+    """The ``(column name, sequence name)`` pairs of the columns of a table owning a sequence"""
+    result = connection.execute(
+        sqlalchemy.text(
+            'SELECT a.attname, pg_catalog.pg_get_serial_sequence(:name, a.attname) FROM pg_catalog.pg_attribute a '
+            'WHERE a.attrelid = CAST(:name AS regclass) AND a.attnum > 0 AND NOT a.attisdropped'),
+        dict(name=qualified_name))
+    return [(column, sequence) for column, sequence in result if sequence is not None]
+
+
+def _index_names(connection, qualified_name):
+    return connection.execute(
+        sqlalchemy.text(
+            'SELECT c.relname FROM pg_catalog.pg_index i JOIN pg_catalog.pg_class c ON c.oid = i.indexrelid '
+            'WHERE i.indrelid = CAST(:name AS regclass)'),
+        dict(name=qualified_name)
+    ).scalars().all()
+
+
+def reload_table(connection, table, source, analyze=True):
+    """Replace the contents of a table, loading them into a shadow table swapped in by renaming it
+
+    Note:
+        Readers keep the current contents of the table while the new ones are loaded into a table defined by
+        shadow_table_like, which gets the indexes of the table once loaded and is analyzed. The table is then
+        renamed away, the shadow table renamed to its name and the old table dropped, in the transaction of the
+        load: the current one of the connection, or one begun (and committed) here. Only the swap blocks readers.
+        Sequences owned by columns of the table move over to the new table. Indexes and constraints are renamed
+        back to the names of the table. Grants, views, triggers and foreign keys referring to the table are not
+        carried over, a view on it makes the drop of the old table fail.
+
+    Args:
+        connection: the Connection to run the reload on
+        table: the Table to reload
+        source: a Select with the column names of the table, a list of dicts of column key to value loaded through
+            COPY, or a callable taking the connection and the shadow Table that loads it (e.g. with
+            gpfdist.load_table) and returns the number of rows
+        analyze: ANALYZE the shadow table before swapping it in
+
+    Returns:
+        The number of rows loaded
+    """
+    suffix = uuid.uuid4().hex[:8]
+    qualified_name = _qualified_name(connection, table.name, table.schema)
+    logger.debug('reload of %s through a rename swap', table.name)
+    with _transaction(connection):
+        shadow = shadow_table_like(table, suffix=suffix, connection=connection)
+        qualified_shadow = _qualified_name(connection, shadow.name, shadow.schema)
+        sequences = _serial_sequences(connection, qualified_name)
+        connection.execute(CreateTable(shadow, include_foreign_key_constraints=[]))
+        for column, sequence in sequences:
+            connection.execute(sqlalchemy.text(
+                'ALTER TABLE %s ALTER COLUMN %s SET DEFAULT nextval(\'%s\'::regclass)' % (
+                    qualified_shadow, connection.dialect.identifier_preparer.quote(column),
+                    sequence.replace("'", "''"))))
+        count = _fill_shadow(connection, shadow, source, analyze)
+
+        old_name = _suffixed(table.name, 'old_%s' % suffix)
+        connection.execute(RenameTable(table, old_name))
+        connection.execute(RenameTable(shadow, table.name))
+        for column, sequence in sequences:
+            connection.execute(sqlalchemy.text('ALTER SEQUENCE %s OWNED BY %s.%s' % (
+                sequence, qualified_name, connection.dialect.identifier_preparer.quote(column))))
+        connection.execute(DropTable(sqlalchemy.Table(old_name, sqlalchemy.MetaData(), schema=table.schema)))
+
+        renames = dict(
+            (_suffixed(element.name, suffix), element.name)
+            for element in list(table.indexes) + _index_backed_constraints(table))
+        for index_name in _index_names(connection, qualified_name):
+            if index_name in renames:
+                new_name = renames[index_name]
+            elif index_name.startswith(shadow.name):
+                # named by the server after the shadow table
+                new_name = table.name + index_name[len(shadow.name):]
+            else:
+                continue
+            connection.execute(sqlalchemy.text('ALTER INDEX %s RENAME TO %s' % (
+                _qualified_name(connection, index_name, table.schema),
+                connection.dialect.identifier_preparer.quote(new_name))))
+    return count
+
+
+def reload_partition(connection, table, source, partition=None, default=False, analyze=True, with_validation=True,
+                     **kw):
+    """Replace the contents of one partition of a partitioned table, swapped in with EXCHANGE PARTITION
+
+    Note:
+        The new contents are loaded into a table defined by shadow_table_like, without partitioning, which gets the
+        indexes of the table once loaded and is analyzed, then exchanged with the partition. The shadow table,
+        which then holds the former contents of the partition, is dropped. Everything runs in the transaction of
+        the load: the current one of the connection, or one begun (and committed) here. Only the exchange blocks
+        readers. GPORCA plans with the statistics of the root partition, refresh them afterwards with
+        ``Analyze(table, rootpartition=True)``.
+
+    Args:
+        connection: the Connection to run the reload on
+        table: the partitioned Table
+        source: a Select with the column names of the table, a list of dicts of column key to value loaded through
+            COPY, or a callable taking the connection and the shadow Table that loads it and returns the number of
+            rows
+        partition: the partition name or a PartitionFor(value)
+        default: reload the default partition
+        analyze: ANALYZE the shadow table before exchanging it
+        with_validation: check the loaded rows against the partition bounds
+        **kw: greenplum_* storage options of the partition where they differ from the ones of the table
+
+    Returns:
+        The number of rows loaded
+    """
+    logger.debug('reload of a partition of %s through EXCHANGE PARTITION', table.name)
+    with _transaction(connection):
+        shadow = shadow_table_like(table, connection=connection, greenplum_partition_by=None, **kw)
+        connection.execute(CreateTable(shadow, include_foreign_key_constraints=[]))
+        count = _fill_shadow(connection, shadow, source, analyze)
+        connection.execute(ExchangePartition(
+            table, shadow, partition=partition, default=default, with_validation=with_validation))
+        connection.execute(DropTable(shadow))
+    return count
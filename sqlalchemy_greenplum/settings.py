@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import re
+
+from sqlalchemy import exc
+from sqlalchemy.engine import characteristics
+
+# A server setting name, custom ones have a prefix such as "gpcc."
+SETTING_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+
+def setting_value(value):
+    """The text of a setting value given as a Python value, True and False being on and off"""
+    if value is True:
+        return 'on'
+    if value is False:
+        return 'off'
+    return str(value)
+
+
+def resolve_settings(settings, presets=None):
+    """Check a dict of setting names to values, or look up the name of a preset
+
+    Args:
+        settings: a dict of setting names to values, or a key of ``presets``
+        presets: a dict of preset names to dicts of setting names to values
+
+    Returns:
+        A dict of setting names to the text of their values
+    """
+    if isinstance(settings, str):
+        if not presets or settings not in presets:
+            raise exc.ArgumentError('Unknown settings preset %r' % (settings, ))
+        settings = presets[settings]
+    resolved = {}
+    for name, value in settings.items():
+        if not SETTING_NAME.match(name):
+            raise exc.ArgumentError('Invalid setting name %r' % (name, ))
+        if value is None:
+            raise exc.ArgumentError('No value for setting %r, RESET is not supported here' % (name, ))
+        resolved[name.lower()] = setting_value(value)
+    return resolved
+
+
+def set_config_statement(settings, local, literal):
+    """A single SELECT of set_config calls changing the settings in one round trip
+
+    Args:
+        settings: a dict of setting names to the text of their values
+        local: only change them until the end of the current transaction, like SET LOCAL
+        literal: renders a string as a SQL literal
+    """
+    return 'SELECT %s' % ', '.join(
+        'set_config(%s, %s, %s)' % (literal(name), literal(value), 'true' if local else 'false')
+        for name, value in sorted(settings.items()))
+
+
+def swap_settings_statement(settings, local, literal):
+    """A single SELECT returning the current value of each setting before changing it, in the order of their names
+
+    Note:
+        The server evaluates the columns of the SELECT from left to right, so each current_setting comes before
+        the set_config of the same setting.
+    """
+    return 'SELECT %s' % ', '.join(
+        'current_setting(%s), set_config(%s, %s, %s)' % (
+            literal(name), literal(name), literal(value), 'true' if local else 'false')
+        for name, value in sorted(settings.items()))
+
+
+class SettingsCharacteristic(characteristics.ConnectionCharacteristic):
+    """The ``greenplum_settings`` execution option of engines and connections, as session settings changed until
+    the connection goes back to the pool
+    """
+    transactional = True
+
+    def reset_characteristic(self, dialect, dbapi_conn):
+        dialect.reset_greenplum_settings(dbapi_conn)
+
+    def set_characteristic(self, dialect, dbapi_conn, value):
+        dialect.set_greenplum_settings(dbapi_conn, value)
+
+    def get_characteristic(self, dialect, dbapi_conn):
+        return dialect.get_greenplum_settings(dbapi_conn)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import uuid
+
+import sqlalchemy
+from sqlalchemy import exc
+from sqlalchemy.sql import expression, operators
+
+from sqlalchemy_greenplum import copy as gp_copy
+
+# The greenplum_* table options a temporary table copies from the table it mirrors
+LIKE_OPTIONS = ('storage_params', 'appendoptimized', 'orientation', 'compresstype', 'compresslevel', 'blocksize')
+
+
+def parse_distributed_by(distributed_by):
+    """Parse a greenplum_distributed_by value into 'RANDOM', 'REPLICATED' or the list of the distribution columns"""
+    if distributed_by.strip().upper() in ('RANDOM', 'RANDOMLY'):
+        return 'RANDOM'
+    if distributed_by.strip().upper() in ('REPLICA', 'REPLICATED'):
+        return 'REPLICATED'
+    return [name.strip().strip('"') for name in distributed_by.split(',')]
+
+
+def table_distribution(table):
+    """Work out how Greenplum distributes a Table from its greenplum_distributed_by option
+
+    Note:
+        Without the option Greenplum distributes by the primary key, or else by the first column.
+
+    Returns:
+        'RANDOM', 'REPLICATED' or the list of the names of the distribution columns
+    """
+    distributed_by = table.dialect_options['greenplum']['distributed_by']
+    if distributed_by is None:
+        names = [c.name for c in table.primary_key]
+        if not names and len(table.columns):
+            names = [table.columns[0].name]
+        return names
+    return parse_distributed_by(distributed_by)
+
+
+def _quote(connection, name):
+    if connection is not None:
+        return connection.dialect.identifier_preparer.quote(name)
+    return '"%s"' % name.replace('"', '""')
+
+
+def _reflected_distributed_by(connection, table):
+    options = sqlalchemy.inspect(connection).get_table_options(table.name, schema=table.schema)
+    return options.get('greenplum_distributed_by')
+
+
+def _distributed_by_like(table, columns, connection):
+    distributed_by = table.dialect_options['greenplum']['distributed_by']
+    if distributed_by is None and connection is not None:
+        distributed_by = _reflected_distributed_by(connection, table)
+    if distributed_by is None:
+        distribution = table_distribution(table)
+    else:
+        distribution = parse_distributed_by(distributed_by)
+    if not isinstance(distribution, list):
+        return distribution
+    missing = set(distribution) - set(column.name for column in columns)
+    if missing:
+        raise exc.ArgumentError(
+            'The columns of the temporary table miss the distribution columns %s of %s, '
+            'give greenplum_distributed_by' % (', '.join(sorted(missing)), table.name))
+    return ','.join(_quote(connection, name) for name in distribution)
+
+
+def temporary_table_like(table, columns=None, name=None, connection=None, metadata=None, on_commit='drop', **kw):
+    """Define a temporary table with the columns of a table, distributed like it
+
+    Note:
+        Greenplum distributes a table created without DISTRIBUTED BY on its first column, so scratch tables joined
+        back to their source would move rows between segments. The distribution is taken from the
+        greenplum_distributed_by option of the table, else reflected from gp_distribution_policy through
+        ``connection``, else it is the default of the table (its primary key or first column). The storage options
+        of the table are copied as well, the keyword arguments override any of them.
+        The Table is only defined, create it with ``.create(connection)``. With the default ``on_commit='drop'``
+        that has to happen in a transaction.
+
+    Args:
+        table: the Table to mirror
+        columns: the columns (or their names) to copy, all columns of the table by default. They must hold the
+            distribution columns unless ``greenplum_distributed_by`` is given.
+        name: the name of the temporary table, a unique name derived from the table name by default
+        connection: a Connection used to reflect the distribution of the table. On a PostgreSQL server the
+            greenplum options are left out.
+        metadata: the MetaData of the new Table, a MetaData of its own by default
+        on_commit: 'drop', 'delete_rows', 'preserve_rows' or None
+        **kw: greenplum_* table options overriding the copied ones, such as greenplum_distributed_by or
+            greenplum_appendoptimized
+
+    Returns:
+        A Table with the TEMPORARY prefix
+    """
+    if columns is None:
+        columns = list(table.columns)
+    columns = [table.c[column] if isinstance(column, str) else column for column in columns]
+    options = {'greenplum_on_commit': on_commit}
+    if connection is None or connection.dialect.greenplum_version_info is not None:
+        options.update(
+            ('greenplum_%s' % option, table.dialect_options['greenplum'][option]) for option in LIKE_OPTIONS)
+        if 'greenplum_distributed_by' not in kw:
+            options['greenplum_distributed_by'] = _distributed_by_like(table, columns, connection)
+        options.update(kw)
+
+    return sqlalchemy.Table(
+        name or 'tmp_%s_%s' % (table.name[:30], uuid.uuid4().hex[:16]), metadata or sqlalchemy.MetaData(),
+        *[sqlalchemy.Column(column.name, column.type) for column in columns],
+        prefixes=['TEMPORARY'], **dict((key, value) for key, value in options.items() if value is not None)
+    )
+
+
+def _bind_name(compiled, bind):
+    name = compiled.bind_names.get(bind, bind.key)
+    return compiled.escaped_bind_names.get(name, name)
+
+
+def _target_column(table, column):
+    if isinstance(column, str):
+        return table.c.get(column)
+    if not isinstance(column, expression.ColumnClause):
+        return None
+    return table.corresponding_column(column)
+
+
+def _key_comparisons(compiled, table, criteria):
+    """The ``(column, bind_name)`` pairs of a WHERE clause made only of ANDed column = :bind comparisons"""
+    keys = []
+    pending = list(criteria)
+    while pending:
+        clause = pending.pop(0)
+        if isinstance(clause, expression.BooleanClauseList) and clause.operator is operators.and_:
+            pending[:0] = clause.clauses
+            continue
+        if not isinstance(clause, expression.BinaryExpression) or clause.operator is not operators.eq:
+            return None
+        left, right = clause.left, clause.right
+        if isinstance(left, expression.BindParameter):
+            left, right = right, left
+        if not isinstance(right, expression.BindParameter) or right.callable is not None:
+            return None
+        column = _target_column(table, left)
+        if column is None:
+            return None
+        keys.append((column, _bind_name(compiled, right)))
+    return keys
+
+
+def _set_columns(compiled, table, keys, bind_names):
+    """The ``(column, bind_name)`` pairs of the SET clause of an UPDATE executed with the given parameter names"""
+    stmt = compiled.statement
+    values = stmt._ordered_values or (stmt._values and list(stmt._values.items()))
+    key_names = set(bind_name for _, bind_name in keys)
+    if values:
+        columns = []
+        for column, value in values:
+            column = _target_column(table, column)
+            if column is None or not isinstance(value, expression.BindParameter) or value.callable is not None:
+                return None
+            columns.append((column, _bind_name(compiled, value)))
+        return columns
+    columns = []
+    for column in table.columns:
+        bind_name = compiled.escaped_bind_names.get(column.key, column.key)
+        if bind_name in bind_names and bind_name not in key_names:
+            columns.append((column, bind_name))
+    return columns
+
+
+def staging_columns_for_executemany(compiled, parameters):
+    """Work out whether an executemany UPDATE or DELETE can run as one statement joined to a staging table
+
+    Note:
+        This holds for statements whose WHERE clause only compares columns of the table with bound parameters
+        (as the ORM does for updates and deletes by primary key) and whose SET clause only assigns bound
+        parameters. Parameter sets repeating the same key values are left to the regular executemany path,
+        since a join would apply only one of them.
+
+    Returns:
+        A ``(set_columns, key_columns)`` tuple of lists of ``(column, bind_name)`` tuples, ``set_columns``
+        being empty for a DELETE, or None when the statement has to run through the regular executemany path
+    """
+    stmt = compiled.statement
+    if not (compiled.isupdate and isinstance(stmt, expression.Update) or
+            compiled.isdelete and isinstance(stmt, expression.Delete)):
+        return None
+    if stmt._returning or getattr(compiled, 'returning', None) or \
+            getattr(compiled, 'effective_returning', None):
+        return None
+    if stmt._hints or not stmt._where_criteria or compiled.positional:
+        return None
+    if not isinstance(stmt.table, sqlalchemy.Table):
+        return None
+    if not parameters or not isinstance(parameters[0], dict):
+        return None
+
+    dialect = compiled.dialect
+    table = stmt.table
+    bind_names = set(parameters[0])
+    keys = _key_comparisons(compiled, table, stmt._where_criteria)
+    if not keys:
+        return None
+    set_columns = _set_columns(compiled, table, keys, bind_names) if compiled.isupdate else []
+    if set_columns is None or compiled.isupdate and not set_columns:
+        return None
+    if set(bind_name for _, bind_name in keys + set_columns) != bind_names:
+        return None
+    if compiled.isupdate:
+        assigned = set(column for column, _ in set_columns)
+        for column in table.columns:
+            if column not in assigned and column.onupdate is not None and \
+                    (column.onupdate.is_sequence or column.onupdate.is_clause_element):
+                # the UPDATE renders this default inline
+                return None
+    if not all(supports_key_type(column.type, dialect) for column, _ in keys) or \
+            not all(gp_copy.supports_copy_type(column.type, dialect) for column, _ in set_columns):
+        return None
+
+    key_names = [bind_name for _, bind_name in keys]
+    try:
+        if len(set(tuple(params[name] for name in key_names) for params in parameters)) != len(parameters):
+            return None
+    except TypeError:
+        return None
+    return set_columns, keys
+
+
+def supports_key_type(type_, dialect):
+    """Whether values of the type can be loaded through COPY and compared for equality"""
+    return gp_copy.supports_copy_type(type_, dialect) and \
+        not issubclass(type_.dialect_impl(dialect)._type_affinity, sqlalchemy.JSON)
+
+
+def staging_table(columns, distributed_by=None, on_commit='drop'):
+    """A temporary table holding the parameter sets of a set based executemany
+
+    Args:
+        columns: ``(column, bind_name)`` tuples, each making a staging column named after the bind name
+        distributed_by: the DISTRIBUTED BY clause of the staging table, None to leave it to the server
+        on_commit: 'drop' by default, so the table goes with the transaction whatever happens. None for
+            connections in AUTOCOMMIT, where it would be dropped as soon as created.
+    """
+    kw = {}
+    if on_commit is not None:
+        kw['greenplum_on_commit'] = on_commit
+    if distributed_by is not None:
+        kw['greenplum_distributed_by'] = distributed_by
+    return sqlalchemy.Table(
+        'staging_%s' % uuid.uuid4().hex, sqlalchemy.MetaData(),
+        *[sqlalchemy.Column(bind_name, column.type) for column, bind_name in unique_columns(columns)],
+        prefixes=['TEMPORARY'], **kw
+    )
+
+
+def unique_columns(columns):
+    """The ``(column, bind_name)`` tuples without the repeated bind names"""
+    seen = set()
+    return [(column, bind_name) for column, bind_name in columns
+            if bind_name not in seen and not seen.add(bind_name)]
+
+
+def set_based_statement(table, staging, set_columns, keys):
+    """The UPDATE ... FROM or DELETE ... USING statement applying the staging table to the target"""
+    matches = sqlalchemy.and_(*[column == staging.c[bind_name] for column, bind_name in keys])
+    if set_columns:
+        return table.update().where(matches).values(
+            dict((column, staging.c[bind_name]) for column, bind_name in set_columns))
+    return table.delete().where(matches)
@@ -4,6 +4,9 @@ from sqlalchemy.dialects import registry
 
 registry.register("greenplum+psycopg2", "sqlalchemy_greenplum.dialect", "GreenplumDialect")
 registry.register("greenplum", "sqlalchemy_greenplum.dialect", "GreenplumDialect")
+registry.register("greenplum.asyncpg", "sqlalchemy_greenplum.asyncpg", "GreenplumDialect_asyncpg")
+registry.register("greenplum.psycopg", "sqlalchemy_greenplum.psycopg", "GreenplumDialect_psycopg")
+registry.register("greenplum.psycopg_async", "sqlalchemy_greenplum.psycopg", "GreenplumDialectAsync_psycopg")
 pytest.register_assert_rewrite("sqlalchemy.testing.assertions")
 
 from sqlalchemy.testing.plugin.pytestplugin import *
@@ -1,9 +1,13 @@
 # # coding: utf-8
 
 
+import datetime
+
 from sqlalchemy.testing.suite import *
 from sqlalchemy.testing.assertions import AssertsCompiledSQL
+import sqlalchemy
 from sqlalchemy import Table, Column, Integer, MetaData, select
+from sqlalchemy import String, Numeric, Date, DateTime, Float, event, func, exc, cast, case, inspect
 from sqlalchemy import schema
 
 
@@ -87,3 +91,2095 @@ class CompileTest(fixtures.TestBase, AssertsCompiledSQL):
         self.assert_compile(
             x,
             '''SELECT pg_table.col1, pg_table."log" FROM pg_table''')
+
+
+class CopyExecutemanyTest(fixtures.TablesTest):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    @classmethod
+    def define_tables(cls, metadata):
+        Table(
+            "copy_target", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=False),
+            Column("name", String(50)),
+            Column("amount", Numeric(10, 2)),
+            Column("created", DateTime),
+            Column("flag", Integer, default=7),
+        )
+
+    def _copy_contexts(self, connection):
+        contexts = []
+
+        @event.listens_for(connection, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if executemany:
+                contexts.append(context._greenplum_copy_columns is not None)
+
+        return contexts
+
+    def test_encode_copy_row(self):
+        from sqlalchemy_greenplum import copy as gp_copy
+        import datetime
+        import decimal
+
+        eq_(
+            gp_copy.encode_copy_row([
+                1, None, "a\tb\\c\nd", True, decimal.Decimal("1.50"),
+                datetime.date(2020, 1, 2), b"\x00\xff", float("-inf"),
+            ]),
+            "1\t\\N\ta\\tb\\\\c\\nd\tt\t1.50\t2020-01-02\t\\\\x00ff\t-Infinity\n")
+
+    def test_copy_stream_reads_in_chunks(self):
+        from sqlalchemy_greenplum import copy as gp_copy
+
+        stream = gp_copy.CopyInStream(([i, "x"] for i in range(1000)))
+        first = stream.read(64)
+        eq_(len(first), 64)
+        assert stream.row_count < 20
+        rest = stream.read()
+        eq_((first + rest).count("\n"), 1000)
+        eq_(stream.read(64), "")
+
+    def test_executemany_through_copy(self, connection):
+        import datetime
+        import decimal
+
+        copy_target = self.tables.copy_target
+        contexts = self._copy_contexts(connection)
+        rows = [
+            {"id": i, "name": "row\t%d" % i if i % 2 else None,
+             "amount": decimal.Decimal("%d.25" % i), "created": datetime.datetime(2020, 1, 1, 12, 0, i % 60)}
+            for i in range(1500)
+        ]
+        connection.execution_options(greenplum_copy_executemany=True).execute(copy_target.insert(), rows)
+        eq_(contexts, [True])
+
+        result = connection.execute(
+            select(copy_target.c.id, copy_target.c.name, copy_target.c.amount, copy_target.c.flag)
+            .where(copy_target.c.id.in_([0, 1, 1499]))
+            .order_by(copy_target.c.id)
+        ).fetchall()
+        eq_(result, [
+            (0, None, decimal.Decimal("0.25"), 7),
+            (1, "row\t1", decimal.Decimal("1.25"), 7),
+            (1499, "row\t1499", decimal.Decimal("1499.25"), 7),
+        ])
+
+    def test_executemany_below_threshold_uses_insert(self, connection):
+        copy_target = self.tables.copy_target
+        contexts = self._copy_contexts(connection)
+        connection.execution_options(greenplum_copy_executemany=True).execute(
+            copy_target.insert(), [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+        eq_(contexts, [False])
+
+    def test_executemany_inline_values_uses_insert(self, connection):
+        copy_target = self.tables.copy_target
+        contexts = self._copy_contexts(connection)
+        connection.execution_options(greenplum_copy_executemany=True).execute(
+            copy_target.insert().values(name=func.lower("A")), [{"id": i} for i in range(1500)])
+        eq_(contexts, [False])
+        eq_(connection.scalar(select(func.count()).where(copy_target.c.name == "a")), 1500)
+
+
+class ExternalTableCompileTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def _table(self):
+        return Table(
+            "ext_source", MetaData(),
+            Column("id", Integer, primary_key=True),
+            Column("name", String(20), default="x"),
+            schema="staging")
+
+    def test_create_readable_external_table(self):
+        from sqlalchemy_greenplum.ddl import CreateExternalTable
+        self.assert_compile(
+            CreateExternalTable(
+                self._table(), ["gpfdist://etl1:8081/*.csv", "gpfdist://etl2:8081/*.csv"],
+                format="csv", format_options={"delimiter": ",", "header": True, "force_not_null": ["name"]},
+                encoding="UTF8", log_errors=True, reject_limit=10),
+            "CREATE EXTERNAL TABLE staging.ext_source (id INTEGER, name VARCHAR(20)) "
+            "LOCATION ('gpfdist://etl1:8081/*.csv', 'gpfdist://etl2:8081/*.csv') "
+            "FORMAT 'CSV' (DELIMITER ',' HEADER FORCE NOT NULL name) "
+            "ENCODING 'UTF8' LOG ERRORS SEGMENT REJECT LIMIT 10 ROWS")
+
+    def test_create_writable_external_table(self):
+        from sqlalchemy_greenplum.ddl import CreateExternalTable
+        self.assert_compile(
+            CreateExternalTable(
+                self._table(), "gpfdist://etl1:8081/out.txt", writable=True, temporary=True,
+                distributed_by="RANDOM", reject_limit=10),
+            "CREATE WRITABLE EXTERNAL TEMPORARY TABLE staging.ext_source (id INTEGER, name VARCHAR(20)) "
+            "LOCATION ('gpfdist://etl1:8081/out.txt') FORMAT 'TEXT' DISTRIBUTED RANDOMLY")
+
+    def test_log_errors_needs_reject_limit(self):
+        from sqlalchemy_greenplum.ddl import CreateExternalTable
+        from sqlalchemy_greenplum.gpfdist import load_table
+        assert_raises(
+            exc.CompileError,
+            CreateExternalTable(self._table(), "gpfdist://etl1:8081/a", log_errors=True).compile,
+            dialect=testing.db.dialect)
+        assert_raises(exc.ArgumentError, load_table, None, self._table(), [], log_errors=True)
+
+    def test_create_external_table_invalid_format(self):
+        from sqlalchemy_greenplum.ddl import CreateExternalTable
+        assert_raises(
+            exc.CompileError,
+            CreateExternalTable(self._table(), "gpfdist://etl1:8081/a", format="parquet; drop").compile,
+            dialect=testing.db.dialect)
+
+    def test_drop_external_table(self):
+        from sqlalchemy_greenplum.ddl import DropExternalTable
+        self.assert_compile(
+            DropExternalTable(self._table(), if_exists=True),
+            "DROP EXTERNAL TABLE IF EXISTS staging.ext_source")
+
+
+class GpfdistServerTest(fixtures.TestBase):
+
+    def _get(self, server, name, segment_id, proto):
+        import http.client
+        import struct
+
+        conn = http.client.HTTPConnection("localhost", server.port)
+        headers = {"X-GP-XID": "1", "X-GP-CID": "0", "X-GP-SN": "0", "X-GP-SEGMENT-ID": str(segment_id)}
+        if proto:
+            headers["X-GP-PROTO"] = "1"
+        conn.request("GET", "/" + name, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        eq_(response.status, 200)
+        eq_(response.getheader("X-GP-PROTO"), "1" if proto else "0")
+        if not proto:
+            return body
+
+        data, pos = [], 0
+        while True:
+            kind, length = body[pos:pos + 1], struct.unpack(">i", body[pos + 1:pos + 5])[0]
+            pos += 5
+            if kind == b"D":
+                if not length:
+                    break
+                data.append(body[pos:pos + length])
+            pos += length
+        eq_(pos, len(body))
+        return b"".join(data)
+
+    def test_rows_split_across_segments(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from sqlalchemy_greenplum.gpfdist import GpfdistServer
+
+        with GpfdistServer(host="localhost", block_size=1024) as server:
+            server.add_rows("rows", ([i, "name %d" % i] for i in range(5000)))
+            with ThreadPoolExecutor(4) as pool:
+                parts = list(pool.map(lambda segment: self._get(server, "rows", segment, True), range(4)))
+
+        lines = []
+        for part in parts:
+            assert part == b"" or part.endswith(b"\n")
+            lines.extend(part.decode().splitlines())
+        eq_(sorted(lines, key=lambda line: int(line.split("\t")[0])),
+            ["%d\tname %d" % (i, i) for i in range(5000)])
+
+    def test_file_protocol_0(self, tmp_path):
+        from sqlalchemy_greenplum.gpfdist import GpfdistServer
+
+        path = tmp_path / "data.txt"
+        path.write_bytes(b"a\tb\nc\td\n")
+        with GpfdistServer(host="localhost") as server:
+            url = server.add_file("data.txt", str(path))
+            eq_(url, "gpfdist://localhost:%d/data.txt" % server.port)
+            eq_(self._get(server, "data.txt", 0, False), b"a\tb\nc\td\n")
+
+
+class GpfdistLoadTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_bound_rows(self):
+        import enum
+        from sqlalchemy.dialects.postgresql import ARRAY
+        from sqlalchemy_greenplum.gpfdist import _bound_rows
+
+        class Color(enum.Enum):
+            red = 1
+
+        class Upper(sqlalchemy.types.TypeDecorator):
+            impl = String
+            cache_ok = True
+
+            def process_bind_param(self, value, dialect):
+                return value.upper()
+
+        tbl = Table("gpfdist_types", MetaData(), Column("doc", sqlalchemy.JSON),
+                    Column("color", sqlalchemy.Enum(Color)), Column("code", Upper(5)))
+        eq_(list(_bound_rows(testing.db.dialect, list(tbl.c), [[{"a": 1}, Color.red, "ab"]])),
+            [['{"a": 1}', "red", "AB"]])
+        tags = Table("gpfdist_arrays", MetaData(), Column("tags", ARRAY(String)))
+        assert_raises(exc.ArgumentError, _bound_rows, testing.db.dialect, list(tags.c), [])
+
+    def test_failed_load_raises_its_error(self):
+        if testing.db.dialect.greenplum_version_info is None:
+            testing.config.skip_test("external tables need Greenplum")
+        from sqlalchemy_greenplum.gpfdist import load_table
+        m = MetaData()
+        tbl = Table("gpfdist_target", m, Column("id", Integer), Column("name", String(5)))
+        m.create_all(testing.db)
+        try:
+            with testing.db.connect() as conn:
+                trans = conn.begin()
+                try:
+                    load_table(conn, tbl, [[1, "a"], [2, "too long a name"]])
+                except exc.DBAPIError as err:
+                    assert "too long" in str(err.orig), err
+                else:
+                    assert False, "the load did not fail"
+                trans.rollback()
+        finally:
+            m.drop_all(testing.db)
+
+
+class ParallelRetrieveTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def _table(self):
+        return Table("facts", MetaData(), Column("id", Integer), Column("name", String(20)))
+
+    def test_declare_parallel_retrieve_cursor(self):
+        from sqlalchemy_greenplum.parallel import DeclareParallelRetrieveCursor
+        facts = self._table()
+        self.assert_compile(
+            DeclareParallelRetrieveCursor("prc_1", select(facts.c.id).where(facts.c.name == "x")),
+            "DECLARE prc_1 PARALLEL RETRIEVE CURSOR FOR "
+            "SELECT facts.id FROM facts WHERE facts.name = %(name_1)s")
+
+    def test_segment_statements(self):
+        from sqlalchemy_greenplum.parallel import segment_statements
+        facts = self._table()
+        stmts = segment_statements(select(facts.c.id).where(facts.c.id > 5), facts, [0, 1])
+        eq_(len(stmts), 2)
+        self.assert_compile(
+            stmts[1],
+            "SELECT facts.id FROM facts WHERE facts.id > %(id_1)s AND facts.gp_segment_id = %(gp_segment_id_1)s",
+            checkparams={"id_1": 5, "gp_segment_id_1": 1})
+
+    def test_segment_statements_rejects_aggregates(self):
+        from sqlalchemy_greenplum.parallel import segment_statements
+        facts = self._table()
+        assert_raises(
+            exc.ArgumentError,
+            segment_statements, select(facts.c.name, func.count()).group_by(facts.c.name), facts, [0])
+        assert_raises(exc.ArgumentError, segment_statements, select(facts.c.name).limit(5), facts, [0])
+        assert_raises(exc.ArgumentError, segment_statements, select(func.count()).select_from(facts), facts, [0])
+        assert_raises(exc.ArgumentError, segment_statements, select(facts.c.name).order_by(facts.c.id), facts, [0])
+        assert_raises(
+            exc.ArgumentError,
+            segment_statements, select(facts.c.name, func.row_number().over()), facts, [0])
+        segment_statements(select(func.lower(facts.c.name)), facts, [0])
+
+    def test_segment_id_fan_out_driving_table(self):
+        from sqlalchemy_greenplum.parallel import _leftmost_table, parallel_retrieve, segment_statements
+        facts = self._table()
+        dims = Table("dims", MetaData(), Column("id", Integer), greenplum_distributed_by="REPLICATED")
+        join = facts.join(dims, facts.c.id == dims.c.id)
+        self.assert_compile(
+            segment_statements(select(facts.c.name).select_from(join), _leftmost_table(join), [1])[0],
+            "SELECT facts.name FROM facts JOIN dims ON facts.id = dims.id "
+            "WHERE facts.gp_segment_id = %(gp_segment_id_1)s")
+        assert_raises(
+            exc.ArgumentError, parallel_retrieve, testing.db, select(dims.c.id), segment_ids=[0],
+            use_parallel_retrieve_cursor=False)
+
+    def test_segment_statements_rejects_outer_joins(self):
+        from sqlalchemy_greenplum.parallel import segment_statements
+        facts = self._table()
+        dims = Table("dims", MetaData(), Column("id", Integer))
+        outer = facts.outerjoin(dims, facts.c.id == dims.c.id)
+        segment_statements(select(facts.c.name).select_from(outer), facts, [0])
+        assert_raises(exc.ArgumentError, segment_statements, select(dims.c.id).select_from(outer), dims, [0])
+        full = facts.join(dims, facts.c.id == dims.c.id, full=True)
+        assert_raises(exc.ArgumentError, segment_statements, select(facts.c.id).select_from(full), facts, [0])
+        union = sqlalchemy.union_all(select(facts.c.id), select(dims.c.id))
+        assert_raises(exc.ArgumentError, segment_statements, union, facts, [0])
+
+    def test_merged_and_per_segment_rows(self):
+        from sqlalchemy_greenplum.parallel import ParallelResult, SegmentRows
+
+        closed = []
+
+        def batches(segment_id):
+            def fetch():
+                for start in range(0, 100, 10):
+                    yield [(segment_id, i) for i in range(start, start + 10)]
+            return fetch
+
+        segments = [SegmentRows(segment_id, batches(segment_id)) for segment_id in range(4)]
+        result = ParallelResult(["segment", "i"], segments, 2, closed.append)
+        eq_(sorted(result), sorted((s, i) for s in range(4) for i in range(100)))
+        eq_(closed, [True])
+
+        segments = [SegmentRows(segment_id, batches(segment_id)) for segment_id in range(2)]
+        with ParallelResult(["segment", "i"], segments, 2, closed.append) as result:
+            eq_([list(rows)[:2] for rows in result.segments()], [[(0, 0), (0, 1)], [(1, 0), (1, 1)]])
+        eq_(closed, [True, True])
+
+    def test_merged_rows_early_close(self):
+        from sqlalchemy_greenplum.parallel import ParallelResult, SegmentRows
+
+        closed = []
+
+        def fetch():
+            for start in range(0, 10000, 10):
+                yield [(start, )] * 10
+
+        result = ParallelResult(["i"], [SegmentRows(s, fetch) for s in range(3)], 3, closed.append)
+        rows = iter(result)
+        eq_(next(rows), (0, ))
+        rows.close()
+        eq_(closed, [False])
+
+
+class ColumnBatchTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def _stream(self, rows):
+        import struct
+        data = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+        for row in rows:
+            data += struct.pack(">h", len(row))
+            for value in row:
+                if value is None:
+                    data += struct.pack(">i", -1)
+                else:
+                    data += struct.pack(">i", len(value)) + value
+        return data + struct.pack(">h", -1)
+
+    def test_decode_fixed_width_with_nulls(self):
+        import struct
+        __import__("pytest").importorskip("numpy")
+        from sqlalchemy_greenplum.columnar import CopyBinaryDecoder, _COLUMN_TYPES, _to_numpy
+
+        columns = [_COLUMN_TYPES[23]("i", 23), _COLUMN_TYPES[701]("f", 701), _COLUMN_TYPES[1082]("d", 1082)]
+        rows = [
+            [struct.pack(">i", i), None if i == 3 else struct.pack(">d", i / 2.0), struct.pack(">i", i)]
+            for i in range(10)
+        ]
+        stream = self._stream(rows)
+        decoder = CopyBinaryDecoder(columns)
+        fragments = [[] for _ in columns]
+        decoded = 0
+        # feed in awkward pieces so rows straddle chunk boundaries
+        for start in range(0, len(stream), 7):
+            decoder.feed(stream[start:start + 7])
+            count, new = decoder.decode(100)
+            decoded += count
+            for fragment, part in zip(fragments, new):
+                fragment.extend(part)
+        eq_(decoded, 10)
+        assert decoder.done
+
+        ints, floats, dates = [_to_numpy(column, fragment) for column, fragment in zip(columns, fragments)]
+        eq_(ints.tolist(), list(range(10)))
+        eq_(floats.mask.tolist(), [i == 3 for i in range(10)])
+        eq_(floats[4], 2.0)
+        eq_(str(dates[1]), "2000-01-02")
+
+    def test_decode_numeric(self):
+        import decimal
+        import struct
+        from sqlalchemy_greenplum.columnar import _decode_numeric
+
+        def numeric(ndigits, weight, sign, dscale, *digits):
+            return struct.pack(">hhHh%dh" % ndigits, ndigits, weight, sign, dscale, *digits)
+
+        eq_(_decode_numeric(numeric(2, 0, 0, 3, 12, 3450), 0, 0), decimal.Decimal("12.345"))
+        eq_(_decode_numeric(numeric(1, 1, 0x4000, 0, 5), 0, 0), decimal.Decimal("-50000"))
+        eq_(_decode_numeric(numeric(1, -1, 0, 2, 500), 0, 0), decimal.Decimal("0.05"))
+        assert _decode_numeric(numeric(0, 0, 0xC000, 0), 0, 0).is_nan()
+
+    def test_fetch_column_batches(self, connection):
+        numpy = __import__("pytest").importorskip("numpy")
+        from sqlalchemy_greenplum.columnar import fetch_column_batches
+
+        series = func.generate_series(1, 2500).column_valued("g")
+        stmt = select(
+            series.label("i"),
+            cast(series, Float).label("f"),
+            case((series % 100 == 0, None), else_=series).label("n"),
+            ("row" + cast(series, String)).label("s"),
+        ).where(series > 500)
+        batches = list(fetch_column_batches(connection, stmt, batch_size=1000))
+        eq_([len(batch["i"]) for batch in batches], [1000, 1000])
+        eq_(sorted(batches[0]), ["f", "i", "n", "s"])
+        eq_(batches[0]["i"][:2].tolist(), [501, 502])
+        eq_(batches[1]["f"].dtype, numpy.dtype("f8"))
+        eq_(int(batches[1]["n"].mask.sum()), 10)
+        eq_(batches[1]["s"][-1], "row2500")
+
+    def test_fetch_column_batches_client_encoding(self, connection):
+        __import__("pytest").importorskip("numpy")
+        from sqlalchemy_greenplum.columnar import fetch_column_batches
+
+        dbapi_connection = connection.connection.dbapi_connection
+        dbapi_connection.set_client_encoding("LATIN1")
+        try:
+            stmt = select(sqlalchemy.literal_column("'caf' || chr(233)").label("s"))
+            batches = list(fetch_column_batches(connection, stmt))
+        finally:
+            dbapi_connection.set_client_encoding("UTF8")
+        eq_(batches[0]["s"].tolist(), [u"caf\xe9"])
+
+
+class VersionFeatureTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def _dialect(self, greenplum_version, server_version):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        dialect = GreenplumDialect()
+        dialect.server_version_info = server_version
+        dialect.greenplum_version_info = greenplum_version
+        dialect._set_greenplum_features()
+        return dialect
+
+    def test_parse_greenplum_version(self):
+        from sqlalchemy_greenplum.dialect import parse_greenplum_version
+        eq_(parse_greenplum_version(
+            "PostgreSQL 9.4.26 (Greenplum Database 6.20.3 build commit:24a3c2e) on x86_64-unknown-linux-gnu, "
+            "compiled by gcc (GCC) 6.4.0, 64-bit compiled on Apr 12 2022 16:43:22"), (6, 20, 3))
+        eq_(parse_greenplum_version(
+            "PostgreSQL 12.12 (Greenplum Database 7.0.0-beta.1 build dev) on x86_64-pc-linux-gnu"), (7, 0, 0))
+        eq_(parse_greenplum_version(
+            "PostgreSQL 8.3.23 (Greenplum Database 5.28.1 build commit:abc) on x86_64-pc-linux-gnu"), (5, 28, 1))
+        eq_(parse_greenplum_version("PostgreSQL 16.2 on x86_64-pc-linux-gnu"), None)
+
+    def test_greenplum_6_features(self):
+        dialect = self._dialect((6, 20, 3), (9, 4, 26))
+        eq_(dialect.implicit_returning, False)
+        eq_(dialect._supports_on_conflict, False)
+        eq_(dialect._supports_create_index_concurrently, False)
+        eq_(dialect._supports_parallel_retrieve_cursor, None)
+
+    def test_greenplum_7_features(self):
+        dialect = self._dialect((7, 0, 0), (12, 12))
+        eq_(dialect.implicit_returning, True)
+        eq_(dialect._supports_on_conflict, True)
+        eq_(dialect._supports_create_index_concurrently, True)
+        eq_(dialect._supports_parallel_retrieve_cursor, True)
+
+    def test_greenplum_5_features(self):
+        dialect = self._dialect((5, 28, 1), (8, 3, 23))
+        eq_(dialect._supports_parallel_retrieve_cursor, False)
+        eq_(dialect._supports_on_conflict, False)
+
+    def test_create_index_concurrently(self):
+        tbl = Table("atable", MetaData(), Column("id", Integer))
+        idx = schema.Index("idx", tbl.c.id, greenplum_concurrently=True)
+        self.assert_compile(
+            schema.CreateIndex(idx), "CREATE INDEX idx ON atable (id)",
+            dialect=self._dialect((6, 20, 3), (9, 4, 26)))
+        self.assert_compile(
+            schema.CreateIndex(idx), "CREATE INDEX CONCURRENTLY idx ON atable (id)",
+            dialect=self._dialect((7, 0, 0), (12, 12)))
+
+    def test_on_conflict(self):
+        from sqlalchemy.dialects.postgresql import insert
+        tbl = Table("atable", MetaData(), Column("id", Integer, primary_key=True))
+        stmt = insert(tbl).values(id=1).on_conflict_do_nothing()
+        self.assert_compile(
+            stmt, "INSERT INTO atable (id) VALUES (%(id)s) ON CONFLICT DO NOTHING",
+            dialect=self._dialect((7, 0, 0), (12, 12)))
+        assert_raises(
+            exc.CompileError,
+            stmt.compile, dialect=self._dialect((6, 20, 3), (9, 4, 26)))
+
+    def test_version_detected_once(self):
+        dialect = testing.db.dialect
+        with testing.db.connect() as conn:
+            eq_(dialect.greenplum_version_info,
+                dialect._get_greenplum_version_info(conn))
+
+
+class TableOptionsReflectionTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_distributed_by_option(self):
+        from sqlalchemy_greenplum.reflection import distributed_by_option
+        preparer = testing.db.dialect.identifier_preparer
+        eq_(distributed_by_option(preparer, None, None), None)
+        eq_(distributed_by_option(preparer, 'r', []), 'REPLICATED')
+        eq_(distributed_by_option(preparer, 'p', []), 'RANDOM')
+        eq_(distributed_by_option(preparer, 'p', ['id', 'Name']), 'id,"Name"')
+
+    def test_storage_params_option(self):
+        from sqlalchemy_greenplum.reflection import storage_params_option
+        eq_(storage_params_option(None, None), None)
+        eq_(storage_params_option(['fillfactor=70'], 'heap'), 'fillfactor=70')
+        eq_(storage_params_option(['compresstype=zlib'], 'ao_column'),
+            'appendonly=true,orientation=column,compresstype=zlib')
+        eq_(storage_params_option(['appendonly=true', 'compresstype=zlib'], 'ao_row'),
+            'appendonly=true,compresstype=zlib')
+
+    def test_partition_by_option(self):
+        from sqlalchemy_greenplum.reflection import partition_by_option
+        eq_(partition_by_option(None), None)
+        eq_(partition_by_option('RANGE (d)'), 'RANGE (d)')
+        eq_(partition_by_option("PARTITION BY LIST(region) (PARTITION usa VALUES('usa'))"),
+            "LIST(region) (PARTITION usa VALUES('usa'))")
+
+    def test_table_options_query_per_release(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        from sqlalchemy_greenplum.reflection import table_options_query
+        for greenplum_version, server_version in (((5, 28), (8, 3)), ((6, 20), (9, 4)), ((7, 0), (12, 12))):
+            dialect = GreenplumDialect()
+            dialect.greenplum_version_info = greenplum_version
+            dialect.server_version_info = server_version
+            sql = str(table_options_query(dialect, 'public', True))
+            assert 'gp_distribution_policy' in sql
+            assert ('pg_get_partition_def' in sql) == (greenplum_version < (7, ))
+            assert ('p.attrnums' in sql) == (greenplum_version < (6, ))
+
+    @testing.provide_metadata
+    def test_reflect_table_options(self, connection):
+        metadata = self.metadata
+        Table('options_plain', metadata, Column('id', Integer))
+        Table('options_fillfactor', metadata, Column('id', Integer), greenplum_storage_params='fillfactor=70')
+        metadata.create_all(connection)
+        connection.exec_driver_sql('CREATE TABLE options_parted (id INTEGER, d DATE) PARTITION BY RANGE (d)')
+        try:
+            reflected = MetaData()
+            reflected.reflect(connection, only=['options_plain', 'options_fillfactor', 'options_parted'])
+            eq_(reflected.tables['options_plain'].dialect_options['greenplum']['storage_params'], None)
+            eq_(reflected.tables['options_fillfactor'].dialect_options['greenplum']['storage_params'],
+                'fillfactor=70')
+            eq_(reflected.tables['options_parted'].dialect_options['greenplum']['partition_by'], 'RANGE (d)')
+            eq_(testing.db.dialect.get_table_options(connection, 'options_fillfactor'),
+                {'greenplum_storage_params': 'fillfactor=70'})
+        finally:
+            connection.exec_driver_sql('DROP TABLE options_parted')
+
+    @testing.provide_metadata
+    def test_table_options_once_per_schema(self, connection):
+        metadata = self.metadata
+        for name in ('options_a', 'options_b', 'options_c'):
+            Table(name, metadata, Column('id', Integer), greenplum_storage_params='fillfactor=70')
+        metadata.create_all(connection)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'c.reloptions' in statement:
+                statements.append(statement)
+        event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+        try:
+            reflected = MetaData()
+            reflected.reflect(connection, only=['options_a', 'options_b', 'options_c'])
+        finally:
+            event.remove(connection, 'before_cursor_execute', before_cursor_execute)
+        eq_(len(statements), 1)
+        for name in ('options_a', 'options_b', 'options_c'):
+            eq_(reflected.tables[name].dialect_options['greenplum']['storage_params'], 'fillfactor=70')
+
+
+class PartitionReflectionTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    @testing.fixture
+    def partitioned(self, connection):
+        connection.exec_driver_sql('CREATE TABLE parted (id INTEGER, d DATE, region TEXT) PARTITION BY RANGE (d)')
+        connection.exec_driver_sql(
+            "CREATE TABLE parted_2020 PARTITION OF parted FOR VALUES FROM ('2020-01-01') TO ('2021-01-01') "
+            "PARTITION BY LIST (region)")
+        connection.exec_driver_sql("CREATE TABLE parted_2020_us PARTITION OF parted_2020 FOR VALUES IN ('us')")
+        connection.exec_driver_sql('CREATE TABLE parted_other PARTITION OF parted DEFAULT')
+        yield connection
+        connection.exec_driver_sql('DROP TABLE parted')
+
+    def test_table_names_exclude_partitions(self, partitioned):
+        dialect = testing.db.dialect
+        names = dialect.get_table_names(partitioned)
+        assert 'parted' in names
+        assert 'parted_2020' not in names
+        assert 'parted_2020_us' not in names
+
+        names = dialect.get_table_names(partitioned, include_partitions=True)
+        assert set(['parted', 'parted_2020', 'parted_2020_us', 'parted_other']).issubset(names)
+
+    def test_get_partitions(self, partitioned):
+        partitions = inspect(partitioned).get_partitions('parted')
+        eq_(
+            [(p['name'], p['parent'], p['level'], p['is_default']) for p in partitions],
+            [('parted_2020', 'parted', 0, False), ('parted_other', 'parted', 0, True),
+             ('parted_2020_us', 'parted_2020', 1, False)]
+        )
+        eq_(partitions[2]['bound'], "FOR VALUES IN ('us')")
+
+    def test_greenplum_6_queries(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        from sqlalchemy_greenplum.reflection import table_names_query, partitions_query
+        dialect = GreenplumDialect()
+        dialect.greenplum_version_info = (6, 20)
+        dialect.server_version_info = (9, 4)
+        assert 'pg_partition_rule' in str(table_names_query(dialect, False))
+        assert 'pg_partition_rule' not in str(table_names_query(dialect, True))
+        assert 'pg_partitions' in str(partitions_query(dialect))
+
+
+class ReflectionCacheTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_expiry_and_eviction(self):
+        from sqlalchemy_greenplum.reflection import ReflectionCache
+        cache = ReflectionCache(ttl=60, maxsize=2)
+        cache['a'] = [1]
+        cache['b'] = [2]
+        eq_(cache.get('a'), [1])
+        cache['c'] = [3]
+        # b was the least recently used
+        eq_(cache.get('b'), None)
+        eq_(cache.get('c'), [3])
+        eq_((cache.hits, cache.misses, cache.evictions), (2, 1, 1))
+
+        cache.get('a').append(2)
+        eq_(cache.get('a'), [1])
+
+        cache = ReflectionCache(ttl=0, maxsize=2)
+        cache['a'] = [1]
+        eq_(cache.get('a'), None)
+        eq_(len(cache), 0)
+
+    def test_shared_between_inspectors(self, metadata):
+        from sqlalchemy_greenplum.reflection import invalidate_reflection_cache
+        engine = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)
+        other = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)
+        invalidate_reflection_cache(engine.url)
+        Table('cached', metadata, Column('id', Integer))
+        metadata.create_all(engine)
+
+        cache = inspect(engine).info_cache
+        eq_(len(inspect(engine).get_columns('cached')), 1)
+        misses = cache.misses
+        eq_(len(inspect(other).get_columns('cached')), 1)
+        eq_(cache.misses, misses)
+        assert inspect(other).info_cache is cache
+
+        with engine.begin() as conn:
+            conn.exec_driver_sql('ALTER TABLE cached ADD COLUMN other INTEGER')
+        eq_(len(inspect(other).get_columns('cached')), 2)
+        assert cache.misses > misses
+
+        Table('cached_too', metadata, Column('id', Integer)).create(engine)
+        eq_(len(cache), 0)
+        engine.dispose()
+        other.dispose()
+
+    def test_separate_for_reflection_settings(self):
+        engine = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)
+        partitions = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60, include_partitions=True)
+        shorter = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=5)
+        cache = inspect(engine).info_cache
+        assert inspect(partitions).info_cache is not cache
+        assert inspect(shorter).info_cache is not cache
+        assert inspect(sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)).info_cache is cache
+        for e in (engine, partitions, shorter):
+            e.dispose()
+
+    def test_invalidated_on_rollback(self, metadata):
+        from sqlalchemy_greenplum.reflection import invalidate_reflection_cache
+        engine = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)
+        other = sqlalchemy.create_engine(testing.db.url, reflection_cache_ttl=60)
+        invalidate_reflection_cache(engine.url)
+        Table('cached', metadata, Column('id', Integer))
+        metadata.create_all(engine)
+
+        with engine.connect() as conn:
+            trans = conn.begin()
+            conn.exec_driver_sql('ALTER TABLE cached ADD COLUMN other INTEGER')
+            # reflected by another connection while the ALTER is not committed
+            eq_(len(inspect(other).get_columns('cached')), 1)
+            assert len(inspect(other).info_cache) > 0
+            trans.rollback()
+            eq_(len(inspect(other).info_cache), 0)
+        eq_(len(inspect(other).get_columns('cached')), 1)
+        engine.dispose()
+        other.dispose()
+
+
+class PartitionCompileTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def _sales(self, partition_by):
+        return Table(
+            'sales', MetaData(),
+            Column('id', Integer), Column('d', Date), Column('region', String),
+            greenplum_partition_by=partition_by)
+
+    def test_range_every_and_default(self):
+        from sqlalchemy_greenplum.partition import RangePartitionBy, RangePartition, DefaultPartition
+        tbl = self._sales(RangePartitionBy('d', [
+            RangePartition(start=datetime.date(2020, 1, 1), end=datetime.date(2021, 1, 1), every='1 month',
+                           storage_params={'appendonly': 'true', 'compresstype': 'zlib'}),
+            RangePartition('y2021', start=datetime.date(2021, 1, 1), end=datetime.date(2022, 1, 1),
+                           tablespace='archive'),
+            DefaultPartition('outlying'),
+        ]))
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE sales (id INTEGER, d DATE, region VARCHAR) "
+            "PARTITION BY RANGE (d) (  "
+            "START (DATE '2020-01-01') INCLUSIVE END (DATE '2021-01-01') EXCLUSIVE EVERY (INTERVAL '1 month') "
+            "WITH (APPENDONLY=TRUE,COMPRESSTYPE=ZLIB),  "
+            "PARTITION y2021 START (DATE '2021-01-01') INCLUSIVE END (DATE '2022-01-01') EXCLUSIVE "
+            "TABLESPACE archive,  "
+            "DEFAULT PARTITION outlying)")
+
+    def test_list_with_subpartition_template(self):
+        from sqlalchemy_greenplum.partition import ListPartitionBy, RangePartitionBy, ListPartition, \
+            RangePartition, DefaultPartition
+        tbl = self._sales(ListPartitionBy(
+            'region',
+            [ListPartition('usa', ['usa']), ListPartition('eu', ['fr', 'de'])],
+            subpartition_by=RangePartitionBy('id', [RangePartition(start=0, end=1000, every=100)])))
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE sales (id INTEGER, d DATE, region VARCHAR) "
+            "PARTITION BY LIST (region) "
+            "SUBPARTITION BY RANGE (id) "
+            "SUBPARTITION TEMPLATE (    START (0) INCLUSIVE END (1000) EXCLUSIVE EVERY (100)  ) "
+            "(  PARTITION usa VALUES ('usa'),  PARTITION eu VALUES ('fr', 'de'))")
+
+    def test_subpartitions_per_partition(self):
+        from sqlalchemy_greenplum.partition import ListPartitionBy, RangePartitionBy, ListPartition, \
+            RangePartition, DefaultPartition
+        tbl = self._sales(RangePartitionBy(
+            'd',
+            [RangePartition('y2020', start=datetime.date(2020, 1, 1), end=datetime.date(2021, 1, 1),
+                            subpartitions=[ListPartition('usa', ['usa']), DefaultPartition('other')])],
+            subpartition_by=ListPartitionBy('region')))
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE sales (id INTEGER, d DATE, region VARCHAR) "
+            "PARTITION BY RANGE (d) "
+            "SUBPARTITION BY LIST (region) "
+            "(  PARTITION y2020 START (DATE '2020-01-01') INCLUSIVE END (DATE '2021-01-01') EXCLUSIVE "
+            "(    SUBPARTITION usa VALUES ('usa'),    DEFAULT SUBPARTITION other  ))")
+
+    def test_partition_by_string(self):
+        tbl = self._sales('RANGE (d) (START (1) END (10) EVERY (1))')
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE sales (id INTEGER, d DATE, region VARCHAR) "
+            "PARTITION BY RANGE (d) (START (1) END (10) EVERY (1))")
+
+    def test_validation(self):
+        from sqlalchemy_greenplum.partition import ListPartitionBy, RangePartitionBy, ListPartition, \
+            RangePartition, DefaultPartition
+        for partition_by in (
+                RangePartitionBy('missing', [RangePartition(start=1, end=2)]),
+                RangePartitionBy('id', [ListPartition('a', [1])]),
+                RangePartitionBy('id', [RangePartition()]),
+                RangePartitionBy('id', [RangePartition(start=1, every=1)]),
+                RangePartitionBy('id', [RangePartition(start=0, end=10), RangePartition(start=5, end=20)]),
+                RangePartitionBy('id', [RangePartition(start=10, end=0)]),
+                RangePartitionBy('id', [DefaultPartition('a'), DefaultPartition('b')]),
+                ListPartitionBy('region', [ListPartition('a', ['x']), ListPartition('a', ['y'])]),
+                ListPartitionBy('region', [ListPartition('a', [])]),
+                ListPartitionBy('region', [ListPartition(values=['x'])]),
+        ):
+            assert_raises(exc.CompileError, schema.CreateTable(self._sales(partition_by)).compile,
+                          dialect=testing.db.dialect)
+
+    def test_alter_partitions(self):
+        from sqlalchemy_greenplum.partition import RangePartitionBy, RangePartition, DefaultPartition, PartitionFor
+        from sqlalchemy_greenplum.ddl import AddPartition, DropPartition, SplitPartition, ExchangePartition
+        tbl = self._sales(RangePartitionBy('d', [DefaultPartition('outlying')]))
+        self.assert_compile(
+            AddPartition(tbl, RangePartition('y2022', start=datetime.date(2022, 1, 1), end=datetime.date(2023, 1, 1))),
+            "ALTER TABLE sales ADD PARTITION y2022 "
+            "START (DATE '2022-01-01') INCLUSIVE END (DATE '2023-01-01') EXCLUSIVE")
+        self.assert_compile(
+            AddPartition(tbl, DefaultPartition('other')),
+            "ALTER TABLE sales ADD DEFAULT PARTITION other")
+        self.assert_compile(
+            DropPartition(tbl, 'y2020', if_exists=True),
+            "ALTER TABLE sales DROP PARTITION IF EXISTS y2020")
+        self.assert_compile(
+            DropPartition(tbl, PartitionFor(datetime.date(2020, 3, 1))),
+            "ALTER TABLE sales DROP PARTITION FOR (DATE '2020-03-01')")
+        self.assert_compile(
+            DropPartition(tbl, default=True),
+            "ALTER TABLE sales DROP DEFAULT PARTITION")
+        self.assert_compile(
+            SplitPartition(tbl, ['h1', 'h2'], partition='y2021', at=datetime.date(2021, 7, 1)),
+            "ALTER TABLE sales SPLIT PARTITION y2021 AT (DATE '2021-07-01') INTO (PARTITION h1, PARTITION h2)")
+        self.assert_compile(
+            SplitPartition(tbl, ['y2023', 'outlying'], default=True,
+                           start=datetime.date(2023, 1, 1), end=datetime.date(2024, 1, 1)),
+            "ALTER TABLE sales SPLIT DEFAULT PARTITION "
+            "START (DATE '2023-01-01') INCLUSIVE END (DATE '2024-01-01') EXCLUSIVE "
+            "INTO (PARTITION y2023, DEFAULT PARTITION outlying)")
+        self.assert_compile(
+            ExchangePartition(tbl, Table('sales_stage', MetaData()), PartitionFor(datetime.date(2021, 1, 1)),
+                              with_validation=False),
+            "ALTER TABLE sales EXCHANGE PARTITION FOR (DATE '2021-01-01') WITH TABLE sales_stage WITHOUT VALIDATION")
+
+
+class ColumnarStorageCompileTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def test_typed_storage_options(self):
+        tbl = Table(
+            'facts', MetaData(), Column('id', Integer),
+            greenplum_storage_params='fillfactor=100',
+            greenplum_appendoptimized=True, greenplum_orientation='column',
+            greenplum_compresstype='zstd', greenplum_compresslevel=5, greenplum_blocksize=65536)
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE facts (id INTEGER) WITH (FILLFACTOR=100,APPENDOPTIMIZED=TRUE,ORIENTATION=COLUMN,"
+            "COMPRESSTYPE=ZSTD,COMPRESSLEVEL=5,BLOCKSIZE=65536)")
+
+    def test_column_encoding(self):
+        tbl = Table(
+            'facts', MetaData(),
+            Column('id', Integer, nullable=False, greenplum_encoding={'compresstype': 'rle_type'}),
+            Column('body', String, greenplum_encoding={'compresstype': 'zstd', 'compresslevel': 9}),
+            Column('other', Integer),
+            greenplum_storage_params='appendonly=true, orientation=column')
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE facts (id INTEGER NOT NULL ENCODING (compresstype=rle_type), "
+            "body VARCHAR ENCODING (compresstype=zstd, compresslevel=9), other INTEGER) "
+            "WITH (APPENDONLY=TRUE, ORIENTATION=COLUMN)")
+
+    def test_storage_validation(self):
+        for column_kw, table_kw in (
+                ({}, {'greenplum_compresstype': 'zstd'}),
+                ({}, {'greenplum_appendoptimized': True, 'greenplum_compresstype': 'lz4'}),
+                ({}, {'greenplum_appendoptimized': True, 'greenplum_orientation': 'diagonal'}),
+                ({}, {'greenplum_appendoptimized': True, 'greenplum_compresslevel': 20}),
+                ({}, {'greenplum_appendoptimized': True, 'greenplum_blocksize': 10000}),
+                ({'greenplum_encoding': {'compresstype': 'zstd'}}, {'greenplum_appendoptimized': True}),
+                ({'greenplum_encoding': {'checksum': True}},
+                 {'greenplum_appendoptimized': True, 'greenplum_orientation': 'column'}),
+        ):
+            tbl = Table('facts', MetaData(), Column('id', Integer, **column_kw), **table_kw)
+            assert_raises(exc.CompileError, schema.CreateTable(tbl).compile, dialect=testing.db.dialect)
+
+    def test_encoding_option(self):
+        from sqlalchemy_greenplum.reflection import encoding_option
+        eq_(encoding_option(['compresstype=none', 'compresslevel=0', 'blocksize=32768']), None)
+        eq_(encoding_option(['compresstype=zstd', 'compresslevel=5', 'blocksize=32768']),
+            {'compresstype': 'zstd', 'compresslevel': 5})
+        eq_(encoding_option(['compresstype=rle_type', 'compresslevel=1', 'blocksize=65536']),
+            {'compresstype': 'rle_type', 'compresslevel': 1, 'blocksize': 65536})
+
+
+class UpsertTest(fixtures.TablesTest, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    run_deletes = "each"
+
+    @classmethod
+    def define_tables(cls, metadata):
+        Table(
+            "upsert_target", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=False),
+            Column("name", String(50)),
+            Column("amount", Integer),
+        )
+
+    def _load(self, connection):
+        upsert_target = self.tables.upsert_target
+        connection.execute(upsert_target.insert(), [{"id": i, "name": "old", "amount": 0} for i in range(5)])
+
+    def _rows(self, connection):
+        upsert_target = self.tables.upsert_target
+        return connection.execute(select(upsert_target).order_by(upsert_target.c.id)).fetchall()
+
+    def _test_upsert(self, connection, method):
+        from sqlalchemy_greenplum.dml import upsert
+        upsert_target = self.tables.upsert_target
+        self._load(connection)
+        eq_(upsert(connection, upsert_target, [{"id": i, "name": "new", "amount": i} for i in range(3, 8)],
+                   method=method), 5)
+        eq_(self._rows(connection), [
+            (0, "old", 0), (1, "old", 0), (2, "old", 0),
+            (3, "new", 3), (4, "new", 4), (5, "new", 5), (6, "new", 6), (7, "new", 7)])
+
+        eq_(upsert(connection, upsert_target, [{"id": i, "name": "x"} for i in range(6, 10)],
+                   update_columns=[], method=method), 2)
+        eq_(self._rows(connection)[5:], [
+            (5, "new", 5), (6, "new", 6), (7, "new", 7), (8, "x", None), (9, "x", None)])
+
+    def test_upsert_staging(self, connection):
+        self._test_upsert(connection, "staging")
+
+    def test_upsert_staging_autocommit(self):
+        from sqlalchemy_greenplum.dml import upsert
+        upsert_target = self.tables.upsert_target
+
+        def staging_tables(conn):
+            return conn.exec_driver_sql(
+                "SELECT count(*) FROM pg_catalog.pg_class WHERE relname LIKE 'tmp_upsert_target%%' "
+                "AND relpersistence = 't'").scalar()
+
+        with testing.db.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            self._load(conn)
+            eq_(upsert(conn, upsert_target, [{"id": i, "name": "new", "amount": i} for i in range(3, 8)],
+                       method="staging"), 5)
+            eq_(len(self._rows(conn)), 8)
+            eq_(staging_tables(conn), 0)
+            assert_raises(
+                exc.DataError, upsert, conn, upsert_target, [{"id": 1, "name": "x" * 60, "amount": 1}],
+                method="staging")
+            eq_(staging_tables(conn), 0)
+
+    def test_upsert_on_conflict(self, connection):
+        if not connection.dialect._supports_on_conflict:
+            return
+        # the ON CONFLICT clauses of SQLAlchemy 1.4 do not take part in statement caching
+        with testing.expect_warnings("Class OnConflictDo", assert_=False):
+            self._test_upsert(connection, "on_conflict")
+
+    def test_upsert_arguments(self, connection):
+        from sqlalchemy_greenplum.dml import upsert
+        upsert_target = self.tables.upsert_target
+        eq_(upsert(connection, upsert_target, []), 0)
+        assert_raises(exc.ArgumentError, upsert, connection, upsert_target, [{"id": 1}], method="merge")
+        assert_raises(exc.ArgumentError, upsert, connection, upsert_target, [{"name": "a"}])
+
+    def test_staging_table_distribution(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        from sqlalchemy_greenplum.dml import _staging_table
+
+        class connection(object):
+            dialect = GreenplumDialect()
+
+        connection.dialect.greenplum_version_info = (6, 20, 3)
+        target = Table(
+            "target", MetaData(), Column("id", Integer, primary_key=True), Column("name", String(50)),
+            greenplum_distributed_by="id")
+        staging = _staging_table(connection, target, list(target.c), [target.c.id])
+        self.assert_compile(
+            schema.CreateTable(staging),
+            "CREATE TEMPORARY TABLE %s (id INTEGER, name VARCHAR(50)) "
+            "ON COMMIT DROP DISTRIBUTED BY (id)" % staging.name,
+            dialect=connection.dialect)
+
+        rows_table = Table(
+            "rows_target", MetaData(), Column("id", Integer), Column("region", String(10)),
+            greenplum_distributed_by="region")
+        staging = _staging_table(connection, rows_table, [rows_table.c.id], [rows_table.c.id])
+        self.assert_compile(
+            schema.CreateTable(staging),
+            "CREATE TEMPORARY TABLE %s (id INTEGER) ON COMMIT DROP DISTRIBUTED BY (id)" % staging.name,
+            dialect=connection.dialect)
+
+    def test_insert_on_conflict_before_greenplum_7(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        from sqlalchemy_greenplum.dml import insert
+        dialect = GreenplumDialect()
+        dialect.greenplum_version_info = (6, 20, 3)
+        dialect._set_greenplum_features()
+        stmt = insert(self.tables.upsert_target).values(id=1).on_conflict_do_nothing()
+        assert_raises(exc.CompileError, stmt.compile, dialect=dialect)
+
+
+class SetBasedExecutemanyTest(fixtures.TablesTest):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    run_deletes = "each"
+
+    @classmethod
+    def define_tables(cls, metadata):
+        Table(
+            "set_based_target", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=False),
+            Column("name", String(50)),
+            Column("amount", Integer),
+        )
+
+    def _staging_contexts(self, connection):
+        contexts = []
+
+        @event.listens_for(connection, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if executemany and not context.isinsert:
+                contexts.append(context._greenplum_staging_columns is not None)
+
+        return contexts
+
+    def _load(self, connection, count=1200):
+        connection.execute(
+            self.tables.set_based_target.insert(), [{"id": i, "name": "old", "amount": i} for i in range(count)])
+
+    def test_staging_columns(self):
+        from sqlalchemy_greenplum.staging import staging_columns_for_executemany
+        target = self.tables.set_based_target
+        dialect = testing.db.dialect
+
+        def columns(stmt, parameters):
+            compiled = stmt.compile(dialect=dialect, column_keys=list(parameters[0]))
+            result = staging_columns_for_executemany(compiled, parameters)
+            if result is not None:
+                return [[(column.name, bind_name) for column, bind_name in part] for part in result]
+
+        by_key = target.update().where(target.c.id == sqlalchemy.bindparam("key"))
+        eq_(columns(by_key, [{"key": 1, "name": "a"}, {"key": 2, "name": "b"}]),
+            [[("name", "name")], [("id", "key")]])
+        eq_(columns(by_key.values(amount=sqlalchemy.bindparam("key")), [{"key": 1}, {"key": 2}]),
+            [[("amount", "key")], [("id", "key")]])
+        eq_(columns(target.delete().where(target.c.id == sqlalchemy.bindparam("key")), [{"key": 1}, {"key": 2}]),
+            [[], [("id", "key")]])
+        # repeated keys, other criteria, inline values and RETURNING keep the regular executemany path
+        eq_(columns(by_key, [{"key": 1, "name": "a"}, {"key": 1, "name": "b"}]), None)
+        eq_(columns(by_key.where(target.c.amount > 0), [{"key": 1, "name": "a"}]), None)
+        eq_(columns(by_key.values(name=func.lower("A")), [{"key": 1}]), None)
+        eq_(columns(by_key.returning(target.c.id), [{"key": 1, "name": "a"}]), None)
+        eq_(columns(target.update(), [{"id": 1, "name": "a"}]), None)
+
+    def test_update_through_staging(self, connection):
+        target = self.tables.set_based_target
+        self._load(connection)
+        contexts = self._staging_contexts(connection)
+        result = connection.execution_options(greenplum_set_based_executemany=True).execute(
+            target.update().where(target.c.id == sqlalchemy.bindparam("key")),
+            [{"key": i, "name": "new %d" % i} for i in range(0, 2400, 2)])
+        eq_(contexts, [True])
+        eq_(result.rowcount, 600)
+        eq_(connection.execute(
+            select(target).where(target.c.id.in_([0, 1, 1198])).order_by(target.c.id)).fetchall(),
+            [(0, "new 0", 0), (1, "old", 1), (1198, "new 1198", 1198)])
+
+    def test_delete_through_staging(self, connection):
+        target = self.tables.set_based_target
+        self._load(connection)
+        contexts = self._staging_contexts(connection)
+        result = connection.execution_options(greenplum_set_based_executemany=True).execute(
+            target.delete().where(target.c.id == sqlalchemy.bindparam("key")),
+            [{"key": i} for i in range(100, 1300)])
+        eq_(contexts, [True])
+        eq_(result.rowcount, 1100)
+        eq_(connection.scalar(select(func.count()).select_from(target)), 100)
+
+    def test_failed_update_leaves_no_staging_table(self):
+        target = self.tables.set_based_target
+        stmt = target.update().where(target.c.id == sqlalchemy.bindparam("key"))
+        rows = [{"key": i, "name": "x" * (60 if i == 1100 else 1)} for i in range(1200)]
+
+        def staging_tables(conn):
+            return conn.exec_driver_sql(
+                "SELECT count(*) FROM pg_catalog.pg_class WHERE relname LIKE 'staging%%' AND relpersistence = 't'"
+            ).scalar()
+
+        with testing.db.connect() as conn:
+            autocommit = conn.execution_options(isolation_level="AUTOCOMMIT", greenplum_set_based_executemany=True)
+            assert_raises(exc.DataError, autocommit.execute, stmt, rows)
+            eq_(staging_tables(autocommit), 0)
+        with testing.db.connect() as conn:
+            trans = conn.begin()
+            # the error of the load, not one of a DROP in the aborted transaction
+            assert_raises(
+                exc.DataError, conn.execution_options(greenplum_set_based_executemany=True).execute, stmt, rows)
+            trans.rollback()
+            eq_(staging_tables(conn), 0)
+
+    def test_below_threshold_and_disabled(self, connection):
+        target = self.tables.set_based_target
+        self._load(connection)
+        contexts = self._staging_contexts(connection)
+        stmt = target.update().where(target.c.id == sqlalchemy.bindparam("key"))
+        connection.execution_options(greenplum_set_based_executemany=True).execute(
+            stmt, [{"key": 1, "name": "a"}, {"key": 2, "name": "b"}])
+        # off by default
+        connection.execute(stmt, [{"key": i, "name": "c"} for i in range(1200)])
+        eq_(contexts, [False, False])
+        eq_(connection.scalar(select(func.count()).where(target.c.name == "c")), 1200)
+
+    def test_staging_distribution(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        from sqlalchemy_greenplum.staging import staging_table
+        dialect = GreenplumDialect()
+        target = self.tables.set_based_target
+        eq_(dialect._staging_distribution(target, [(target.c.id, "key")]), None)
+
+        dialect.greenplum_version_info = (6, 20, 3)
+        eq_(dialect._staging_distribution(target, [(target.c.id, "key")]), "key")
+        other = Table(
+            "other", MetaData(), Column("id", Integer), Column("region", String(10)),
+            greenplum_distributed_by="region")
+        eq_(dialect._staging_distribution(other, [(other.c.id, "id")]), "id")
+        eq_(dialect._staging_distribution(other, [(other.c.id, "id"), (other.c.region, "region_1")]), "region_1")
+
+        staging = staging_table([(target.c.id, "key"), (target.c.amount, "key")], "key")
+        eq_(str(schema.CreateTable(staging).compile(dialect=dialect)).strip(),
+            "CREATE TEMPORARY TABLE %s (\n\tkey INTEGER\n)\n ON COMMIT DROP\n DISTRIBUTED BY (key)" % staging.name)
+
+
+class TemporaryTableLikeTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def _table(self, metadata=None, **kw):
+        return Table(
+            "facts", metadata if metadata is not None else MetaData(),
+            Column("id", Integer, primary_key=True), Column("region", String(10)), Column("amount", Numeric(10, 2)),
+            **kw)
+
+    def test_distribution_and_storage_copied(self):
+        from sqlalchemy_greenplum.staging import temporary_table_like
+        facts = self._table(
+            greenplum_distributed_by="region", greenplum_appendoptimized=True, greenplum_orientation="column",
+            greenplum_partition_by="RANGE (id)")
+        tmp = temporary_table_like(facts, name="tmp_facts")
+        self.assert_compile(
+            schema.CreateTable(tmp),
+            "CREATE TEMPORARY TABLE tmp_facts (id INTEGER, region VARCHAR(10), amount NUMERIC(10, 2)) "
+            "WITH (APPENDOPTIMIZED=TRUE,ORIENTATION=COLUMN) ON COMMIT DROP DISTRIBUTED BY (\"region\")")
+
+        tmp = temporary_table_like(
+            facts, ["id", facts.c.region], name="tmp_facts", on_commit="preserve_rows",
+            greenplum_appendoptimized=None, greenplum_orientation=None)
+        self.assert_compile(
+            schema.CreateTable(tmp),
+            "CREATE TEMPORARY TABLE tmp_facts (id INTEGER, region VARCHAR(10)) "
+            "ON COMMIT PRESERVE ROWS DISTRIBUTED BY (\"region\")")
+
+    def test_default_distribution(self):
+        from sqlalchemy_greenplum.staging import temporary_table_like
+        facts = self._table()
+        tmp = temporary_table_like(facts, name="tmp_facts", on_commit=None)
+        self.assert_compile(
+            schema.CreateTable(tmp),
+            "CREATE TEMPORARY TABLE tmp_facts (id INTEGER, region VARCHAR(10), amount NUMERIC(10, 2)) "
+            "DISTRIBUTED BY (\"id\")")
+        tmp = temporary_table_like(self._table(greenplum_distributed_by="RANDOM"), ["amount"], name="tmp_facts")
+        self.assert_compile(
+            schema.CreateTable(tmp),
+            "CREATE TEMPORARY TABLE tmp_facts (amount NUMERIC(10, 2)) ON COMMIT DROP DISTRIBUTED RANDOMLY")
+        assert_raises(exc.ArgumentError, temporary_table_like, facts, ["amount"])
+        tmp = temporary_table_like(facts, ["amount"], name="tmp_facts", greenplum_distributed_by="amount")
+        eq_(tmp.dialect_options["greenplum"]["distributed_by"], "amount")
+
+    def test_create_and_join(self, connection):
+        from sqlalchemy_greenplum.staging import temporary_table_like
+        metadata = MetaData()
+        facts = self._table(metadata)
+        metadata.create_all(connection)
+        try:
+            connection.execute(facts.insert(), [{"id": i, "region": "r%d" % (i % 3), "amount": i} for i in range(9)])
+            tmp = temporary_table_like(facts, ["id"], connection=connection)
+            if connection.dialect.greenplum_version_info is None:
+                eq_(tmp.dialect_options["greenplum"]["distributed_by"], None)
+            tmp.create(connection)
+            connection.execute(tmp.insert(), [{"id": 1}, {"id": 2}])
+            joined = facts.join(tmp, facts.c.id == tmp.c.id)
+            eq_(connection.scalar(select(func.sum(facts.c.amount)).select_from(joined)), 3)
+        finally:
+            metadata.drop_all(connection)
+
+
+class ColocationCheckTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def _tables(self):
+        metadata = MetaData()
+        sales = Table(
+            "sales", metadata, Column("id", Integer, primary_key=True), Column("customer_id", Integer),
+            Column("region", String(10)), greenplum_distributed_by="customer_id")
+        customers = Table(
+            "customers", metadata, Column("id", Integer, primary_key=True), Column("region", String(10)))
+        regions = Table(
+            "regions", metadata, Column("region", String(10)), greenplum_distributed_by="REPLICATED")
+        events = Table(
+            "events", metadata, Column("customer_id", Integer), greenplum_distributed_by="RANDOM")
+        return sales, customers, regions, events
+
+    def _findings(self, stmt):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        findings = []
+        stmt.compile(dialect=GreenplumDialect(colocation_check=findings.append))
+        return findings
+
+    def test_colocated_joins(self):
+        sales, customers, regions, events = self._tables()
+        eq_(self._findings(select(sales.c.id).select_from(
+            sales.join(customers, sales.c.customer_id == customers.c.id))), [])
+        eq_(self._findings(select(sales.c.id).select_from(
+            sales.join(regions, sales.c.region == regions.c.region))), [])
+        eq_(self._findings(select(sales.c.id).select_from(
+            sales.join(customers, customers.c.id == sales.c.customer_id)
+            .join(regions, customers.c.region == regions.c.region))), [])
+        other = customers.alias("other")
+        eq_(self._findings(select(other.c.id).select_from(customers.join(other, customers.c.id == other.c.id))), [])
+        subquery = select(sales.c.customer_id).subquery()
+        eq_(self._findings(select(customers.c.id).select_from(
+            customers.join(subquery, subquery.c.customer_id == customers.c.region))), [])
+
+    def test_motion_joins(self):
+        sales, customers, regions, events = self._tables()
+        eq_(self._findings(select(sales.c.id).select_from(
+            sales.join(customers, sales.c.region == customers.c.region))),
+            ["Join of sales (distributed by customer_id) with customers (distributed by id) is not co-located, "
+             "it needs a Redistribute or Broadcast Motion"])
+        eq_(self._findings(select(sales.c.id).select_from(
+            sales.join(events, sales.c.customer_id == events.c.customer_id))),
+            ["Join of sales (distributed by customer_id) with events (distributed randomly) is not co-located, "
+             "it needs a Redistribute or Broadcast Motion"])
+        other = customers.alias("other")
+        eq_(len(self._findings(select(other.c.id).select_from(
+            customers.join(other, customers.c.id == other.c.region)))), 1)
+
+    def test_check_modes(self):
+        from sqlalchemy_greenplum.colocation import ColocationWarning
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        sales, customers, regions, events = self._tables()
+        stmt = select(sales.c.id).select_from(sales.join(customers, sales.c.region == customers.c.region))
+        assert_raises(exc.CompileError, stmt.compile, dialect=GreenplumDialect(colocation_check="raise"))
+        with testing.expect_warnings("Join of sales"):
+            stmt.compile(dialect=GreenplumDialect(colocation_check="warn"))
+        stmt.compile(dialect=GreenplumDialect())
+        assert issubclass(ColocationWarning, exc.SAWarning)
+        assert_raises(exc.ArgumentError, GreenplumDialect, colocation_check="strict")
+
+
+class ExplainCaptureTest(fixtures.TablesTest):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    @classmethod
+    def define_tables(cls, metadata):
+        Table(
+            "explain_target", metadata,
+            Column("id", Integer, primary_key=True, autoincrement=False),
+            Column("name", String(50)),
+        )
+
+    def test_plan_metrics(self):
+        from sqlalchemy_greenplum.explain import plan_metrics
+        plan = [{
+            "Plan": {
+                "Node Type": "Gather Motion", "Senders": 3, "Receivers": 1, "Slice": 2, "Segments": 3,
+                "Actual Rows": 300, "Actual Loops": 1,
+                "Plans": [{
+                    "Node Type": "Hash Join", "Slice": 2, "Segments": 3, "Workfile Spilling": 2,
+                    "Executor Memory": {"Average": 100, "Workers": 3, "Maximum Memory Used": 128},
+                    "Extra Text": "Rows out:  Avg 100.0 rows x 3 workers.  Max 180 rows (seg2) with 1 ms to end.",
+                    "Plans": [
+                        {"Node Type": "Seq Scan", "Relation Name": "sales", "Slice": 2, "Segments": 3},
+                        {"Node Type": "Hash", "Plans": [{
+                            "Node Type": "Redistribute Motion", "Senders": 3, "Receivers": 3, "Slice": 1,
+                            "Plans": [{"Node Type": "Seq Scan", "Relation Name": "customers", "Slice": 1}]}]},
+                    ],
+                }],
+            },
+            "Planning Time": 1.5,
+            "Execution Time": 12.25,
+        }]
+        metrics = plan_metrics(plan, "SELECT 1", True)
+        eq_(metrics["slices"], 3)
+        eq_(metrics["motions"]["Gather Motion"], 1)
+        eq_(metrics["motions"]["Redistribute Motion"], 1)
+        eq_(metrics["motions"]["Broadcast Motion"], 0)
+        eq_(metrics["execution_time_ms"], 12.25)
+        eq_(metrics["spilling_nodes"], 1)
+        eq_(metrics["max_skew"], 1.8)
+        eq_([node["node_type"] for node in metrics["nodes"]],
+            ["Gather Motion", "Hash Join", "Seq Scan", "Hash", "Redistribute Motion", "Seq Scan"])
+        join = metrics["nodes"][1]
+        eq_((join["memory_kb"], join["avg_rows"], join["max_rows"], join["max_segment"]), (128, 100.0, 180.0, 2))
+        eq_(metrics["nodes"][0]["senders"], 3)
+        eq_(metrics["nodes"][2]["relation"], "sales")
+
+        # depth first: every node is followed by its subtree
+        plan[0]["Plan"]["Plans"][0]["Plans"].reverse()
+        eq_([node["node_type"] for node in plan_metrics(plan, "SELECT 1", True)["nodes"]],
+            ["Gather Motion", "Hash Join", "Hash", "Redistribute Motion", "Seq Scan", "Seq Scan"])
+
+    def test_capture_through_execution_option(self, connection):
+        explain_target = self.tables.explain_target
+        captured = []
+        dialect = connection.dialect
+        sink = dialect.explain_sink
+        dialect.explain_sink = captured.append
+        try:
+            connection.execute(explain_target.insert(), [{"id": i, "name": "a"} for i in range(5)])
+            eq_(captured, [])
+            query = select(explain_target.c.id).where(explain_target.c.id > 2).order_by(explain_target.c.id)
+            explained = connection.execution_options(greenplum_explain=True)
+            eq_(explained.execute(query).fetchall(), [(3, ), (4, )])
+            eq_(connection.execution_options(greenplum_explain="analyze").execute(query).fetchall(), [(3, ), (4, )])
+            eq_(explained.execute(explain_target.update().values(name="b")).rowcount, 5)
+            explained.execute(explain_target.insert(), {"id": 10, "name": "c"})
+            explained.execute(explain_target.insert(), [{"id": 11, "name": "d"}, {"id": 12, "name": "e"}])
+        finally:
+            dialect.explain_sink = sink
+        eq_([metrics["analyzed"] for metrics in captured], [False, True, False, False])
+        assert captured[0]["nodes"][0]["node_type"]
+        eq_(captured[0]["statement"].split()[0], "SELECT")
+        # the UPDATE was only planned, not run a second time
+        eq_(connection.scalar(select(func.count()).where(explain_target.c.name == "b")), 5)
+
+    def test_failed_explain(self, connection):
+        from sqlalchemy_greenplum import explain
+        explain_target = self.tables.explain_target
+        explain_prefix = explain.explain_prefix
+        explain.explain_prefix = lambda analyze: "EXPLAIN (NO_SUCH_OPTION) "
+        try:
+            explained = connection.execution_options(greenplum_explain="analyze")
+            explained.execute(explain_target.insert(), {"id": 1, "name": "a"})
+            eq_(explained.execute(select(explain_target.c.id)).fetchall(), [(1, )])
+        finally:
+            explain.explain_prefix = explain_prefix
+        # the transaction was not aborted by the EXPLAIN
+        eq_(connection.scalar(select(func.count()).select_from(explain_target)), 1)
+
+
+class TableHealthTest(fixtures.TablesTest):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    @classmethod
+    def define_tables(cls, metadata):
+        Table("health_target", metadata, Column("id", Integer, primary_key=True, autoincrement=False))
+
+    def _dialect(self, greenplum_version, server_version):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        dialect = GreenplumDialect()
+        dialect.server_version_info = server_version
+        dialect.greenplum_version_info = greenplum_version
+        return dialect
+
+    def test_health_queries(self):
+        from sqlalchemy_greenplum import health
+        gp6, gp7 = self._dialect((6, 20, 3), (9, 4, 26)), self._dialect((7, 0, 0), (12, 12))
+        assert "pg_appendonly" in str(health.table_health_query(gp6))
+        assert "pg_am" in str(health.table_health_query(gp7))
+        assert "relallvisible" not in str(health.table_health_query(self._dialect((5, 28, 1), (8, 3, 23))))
+        assert "pg_appendonly" in str(health.ao_bloat_query(gp6))
+        assert "'ao_row', 'ao_column'" in str(health.ao_bloat_query(gp7))
+        eq_(str(health.segment_row_counts_query(gp6.identifier_preparer, "Sales", "public")),
+            'SELECT gp_segment_id AS segment_id, count(*) AS row_count FROM public."Sales" GROUP BY gp_segment_id')
+        eq_(health.ratio(5, 0), None)
+        eq_(health.ratio(None, 10), None)
+        eq_(health.ratio(1, 4), 0.25)
+
+    def test_get_table_health(self, connection):
+        connection.execute(self.tables.health_target.insert(), [{"id": i} for i in range(100)])
+        tables = dict((table["table_name"], table) for table in inspect(connection).get_table_health())
+        target = tables["health_target"]
+        assert target["size_bytes"] > 0
+        assert target["total_size_bytes"] >= target["size_bytes"]
+        if connection.dialect.greenplum_version_info is not None:
+            eq_(target["access_method"], "heap")
+
+    def test_get_segment_health(self, connection):
+        if connection.dialect.greenplum_version_info is None:
+            return
+        connection.execute(self.tables.health_target.insert(), [{"id": i} for i in range(100)])
+        insp = inspect(connection)
+        eq_(sum(insp.get_segment_row_counts("health_target").values()), 100)
+        sizes = dict((table["table_name"], table) for table in insp.get_segment_sizes())
+        assert sizes["health_target"]["skew"] >= 1.0
+        insp.get_missing_statistics()
+
+
+class RedistributionTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+
+    def test_alter_distribution(self):
+        from sqlalchemy_greenplum.ddl import SetDistributedBy, ReorganizeTable, ExpandTable, SetStorageParams
+        tbl = Table('sales', MetaData(), Column('id', Integer), Column('Customer', Integer), schema='s1')
+        self.assert_compile(
+            SetDistributedBy(tbl, '"Customer"'),
+            'ALTER TABLE s1.sales SET DISTRIBUTED BY ("Customer")')
+        self.assert_compile(
+            SetDistributedBy(tbl, 'RANDOM', reorganize=False),
+            "ALTER TABLE s1.sales SET WITH (REORGANIZE=FALSE) DISTRIBUTED RANDOMLY")
+        self.assert_compile(
+            SetDistributedBy(tbl, 'REPLICATED', reorganize=True),
+            "ALTER TABLE s1.sales SET WITH (REORGANIZE=TRUE) DISTRIBUTED REPLICATED")
+        self.assert_compile(ReorganizeTable(tbl), "ALTER TABLE s1.sales SET WITH (REORGANIZE=TRUE)")
+        self.assert_compile(ExpandTable(tbl), "ALTER TABLE s1.sales EXPAND TABLE")
+        self.assert_compile(
+            SetStorageParams(tbl, {'appendoptimized': True, 'compresstype': 'zstd', 'compresslevel': 5}),
+            "ALTER TABLE s1.sales SET WITH (APPENDOPTIMIZED=TRUE,COMPRESSTYPE=ZSTD,COMPRESSLEVEL=5)")
+        self.assert_compile(
+            SetStorageParams(tbl, 'fillfactor=70', reorganize=True),
+            "ALTER TABLE s1.sales SET WITH (REORGANIZE=TRUE,FILLFACTOR=70)")
+        assert_raises(exc.CompileError, SetDistributedBy(tbl, None).compile, dialect=testing.db.dialect)
+        assert_raises(exc.CompileError, SetStorageParams(tbl, {'compresstype': 'lz4'}).compile,
+                      dialect=testing.db.dialect)
+
+    def test_expand_table_version(self):
+        from sqlalchemy_greenplum.ddl import ExpandTable
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        dialect = GreenplumDialect()
+        dialect.greenplum_version_info = (5, 28, 1)
+        assert_raises(exc.CompileError, ExpandTable(Table('sales', MetaData())).compile, dialect=dialect)
+
+    def test_distribution_change(self):
+        from sqlalchemy_greenplum.alembic_gp import distribution_change
+        eq_(distribution_change('id', Table('t', MetaData(), Column('id', Integer))), None)
+        eq_(distribution_change('id', Table('t', MetaData(), Column('id', Integer), greenplum_distributed_by='"id"')),
+            None)
+        eq_(distribution_change('id', Table('t', MetaData(), Column('id', Integer), greenplum_distributed_by='RANDOM')),
+            'RANDOM')
+        eq_(distribution_change('RANDOM', Table('t', MetaData(), Column('id', Integer), Column('k', Integer),
+                                                greenplum_distributed_by='id, k')),
+            'id, k')
+
+    def test_storage_params_change(self):
+        from sqlalchemy_greenplum.alembic_gp import storage_params_change
+        eq_(storage_params_change(None, Table('t', MetaData(), Column('id', Integer))), None)
+        eq_(storage_params_change('fillfactor=70', Table('t', MetaData(), Column('id', Integer),
+                                                         greenplum_storage_params='fillfactor=50')),
+            None)
+        eq_(storage_params_change('appendonly=true,compresstype=zlib', Table(
+            't', MetaData(), Column('id', Integer), greenplum_appendoptimized=True, greenplum_compresstype='zlib')),
+            None)
+        eq_(storage_params_change('appendonly=true,compresstype=zlib', Table(
+            't', MetaData(), Column('id', Integer),
+            greenplum_storage_params='appendoptimized=true, orientation=column', greenplum_compresstype='zstd')),
+            ({'orientation': 'column', 'compresstype': 'zstd'}, {'orientation': 'row', 'compresstype': 'zlib'}))
+        eq_(storage_params_change(None, Table('t', MetaData(), Column('id', Integer), greenplum_appendoptimized=True)),
+            ({'appendoptimized': True}, {'appendoptimized': False}))
+
+
+class ParallelDDLTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_create_and_drop_all(self):
+        from sqlalchemy_greenplum import parallel_ddl
+        metadata = MetaData()
+        Table("pddl_parent", metadata, Column("id", Integer, primary_key=True), Column("n", Integer, index=True))
+        for i in range(6):
+            Table("pddl_child%d" % i, metadata, Column("id", Integer, primary_key=True),
+                  Column("parent_id", Integer, sqlalchemy.ForeignKey("pddl_parent.id")))
+        try:
+            timings = parallel_ddl.create_all(testing.db, metadata, max_workers=3)
+            eq_(len(timings), 8)
+            eq_(timings[0]["table"], "pddl_parent")
+            assert timings[1]["statement"].startswith("CREATE INDEX")
+            eq_(parallel_ddl.create_all(testing.db, metadata), [])
+            names = inspect(testing.db).get_table_names()
+            assert all(table.name in names for table in metadata.sorted_tables)
+        finally:
+            timings = parallel_ddl.drop_all(testing.db, metadata, max_workers=3)
+        eq_(len(timings), 7)
+        eq_(timings[-1]["table"], "pddl_parent")
+        names = inspect(testing.db).get_table_names()
+        assert not any(table.name in names for table in metadata.sorted_tables)
+
+    def test_time_statements_once_per_connection(self):
+        from sqlalchemy_greenplum.parallel_ddl import _time_statements
+        first, second = [], []
+        with testing.db.connect() as conn:
+            with _time_statements(conn, "pddl_a", first):
+                conn.exec_driver_sql("CREATE TEMPORARY TABLE pddl_a (id INTEGER)")
+            with _time_statements(conn, "pddl_b", second):
+                conn.exec_driver_sql("CREATE TEMPORARY TABLE pddl_b (id INTEGER)")
+            assert "greenplum_ddl_timing" not in conn.info
+            conn.exec_driver_sql("DROP TABLE pddl_a")
+        eq_([timing["table"] for timing in first], ["pddl_a"])
+        eq_([timing["table"] for timing in second], ["pddl_b"])
+
+
+class PartitionedIndexTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    @testing.fixture
+    def partitioned(self):
+        greenplum_version = testing.db.dialect.greenplum_version_info
+        if greenplum_version is not None and greenplum_version < (7, ):
+            testing.config.skip_test("Greenplum %s has no PARTITION OF" % (greenplum_version, ))
+        with testing.db.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE pidx (id INTEGER, d INTEGER, region TEXT) PARTITION BY RANGE (d)")
+            for year in range(3):
+                conn.exec_driver_sql(
+                    "CREATE TABLE pidx_%d PARTITION OF pidx FOR VALUES FROM (%d) TO (%d) PARTITION BY LIST (region)"
+                    % (year, year * 10, year * 10 + 10))
+                for region in ("us", "eu"):
+                    conn.exec_driver_sql(
+                        "CREATE TABLE pidx_%d_%s PARTITION OF pidx_%d FOR VALUES IN ('%s')" % (year, region, year, region))
+        yield Table("pidx", MetaData(), Column("id", Integer), Column("d", Integer), Column("region", String))
+        with testing.db.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE pidx")
+
+    def _valid(self, name):
+        with testing.db.connect() as conn:
+            return conn.exec_driver_sql(
+                "SELECT indisvalid FROM pg_catalog.pg_index WHERE indexrelid = to_regclass('%s')" % name).scalar()
+
+    def test_create_partitioned_index(self, partitioned):
+        from sqlalchemy_greenplum import parallel_ddl
+        index = sqlalchemy.Index("pidx_id", partitioned.c.id)
+        calls = []
+
+        def fail_after_two(done, total, name):
+            calls.append((done, total))
+            if done == 2:
+                raise ZeroDivisionError()
+
+        assert_raises(ZeroDivisionError, parallel_ddl.create_partitioned_index, testing.db, index, max_workers=1,
+                      progress=fail_after_two)
+        eq_(calls, [(1, 6), (2, 6)])
+        eq_(self._valid("pidx_id"), False)
+
+        timings = parallel_ddl.create_partitioned_index(testing.db, index, max_workers=3, concurrently=True)
+        concurrently = [timing for timing in timings if timing["statement"].startswith("CREATE INDEX CONCURRENTLY")]
+        eq_(len(concurrently), 4 if testing.db.dialect._supports_create_index_concurrently else 0)
+        eq_(self._valid("pidx_id"), True)
+        eq_(self._valid("pidx_id_pidx_1"), True)
+        eq_(parallel_ddl.create_partitioned_index(testing.db, index), [])
+
+    def test_create_index_before_greenplum_7(self):
+        from sqlalchemy_greenplum import parallel_ddl
+        greenplum_version = testing.db.dialect.greenplum_version_info
+        if greenplum_version is None or greenplum_version >= (7, ):
+            testing.config.skip_test("Indexes can be attached to partitioned indexes")
+        with testing.db.begin() as conn:
+            conn.exec_driver_sql(
+                "CREATE TABLE pidx6 (id INTEGER, d INTEGER) DISTRIBUTED BY (id) "
+                "PARTITION BY RANGE (d) (START (0) END (30) EVERY (10))")
+        try:
+            tbl = Table("pidx6", MetaData(), Column("id", Integer), Column("d", Integer))
+            timings = parallel_ddl.create_partitioned_index(testing.db, sqlalchemy.Index("pidx6_id", tbl.c.id))
+            eq_([timing["statement"] for timing in timings], ["CREATE INDEX pidx6_id ON pidx6 (id)"])
+            eq_(self._valid("pidx6_id"), True)
+            eq_(parallel_ddl.create_partitioned_index(testing.db, sqlalchemy.Index("pidx6_id", tbl.c.id)), [])
+        finally:
+            with testing.db.begin() as conn:
+                conn.exec_driver_sql("DROP TABLE pidx6")
+
+    def test_index_on_only(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        tbl = Table("sales", MetaData(), Column("id", Integer))
+        index = sqlalchemy.Index("sales_id", tbl.c.id, greenplum_only=True)
+        dialect = GreenplumDialect()
+        dialect.server_version_info = (12, 12)
+        dialect.greenplum_version_info = (7, 0, 0)
+        self.assert_compile(schema.CreateIndex(index), "CREATE INDEX sales_id ON ONLY sales (id)", dialect=dialect)
+        dialect.server_version_info = (9, 4, 26)
+        dialect.greenplum_version_info = (6, 20, 3)
+        assert_raises(exc.CompileError, schema.CreateIndex(index).compile, dialect=dialect)
+
+    def test_partition_index_name(self):
+        from sqlalchemy_greenplum.parallel_ddl import partition_index_name
+        eq_(partition_index_name("ix", "sales_1"), "ix_sales_1")
+        name = partition_index_name("ix_" + "a" * 40, "sales_" + "b" * 40)
+        eq_(len(name), 63)
+        assert name != partition_index_name("ix_" + "a" * 40, "sales_" + "b" * 41)
+
+
+class ImportTimeTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+
+    def _import_times(self, code):
+        """Run code in a fresh interpreter with -X importtime, returning the cumulative microseconds per module"""
+        import subprocess
+        import sys
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code], stderr=subprocess.PIPE, universal_newlines=True)
+        eq_(process.returncode, 0, process.stderr[-2000:])
+        times = {}
+        for line in process.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _, cumulative, module = line[len("import time:"):].split("|")
+                if cumulative.strip().isdigit():
+                    times[module.strip()] = int(cumulative)
+        return times
+
+    def test_dialect_import_leaves_alembic_out(self):
+        times = self._import_times("import sqlalchemy_greenplum.dialect")
+        assert "sqlalchemy_greenplum.dialect" in times
+        eq_(sorted(module for module in times if module.split(".")[0] in ("alembic", "numpy", "pyarrow")), [])
+
+    def test_columnar_import_without_psycopg2(self):
+        times = self._import_times(
+            "import sys\n"
+            "sys.modules['psycopg2'] = None\n"
+            "import sqlalchemy_greenplum.columnar\n")
+        assert "sqlalchemy_greenplum.columnar" in times
+
+    def test_alembic_registration_after_import(self):
+        import subprocess
+        import sys
+        if subprocess.run([sys.executable, "-c", "import alembic.ddl"], stderr=subprocess.DEVNULL).returncode:
+            testing.config.skip_test("alembic cannot be imported with this SQLAlchemy")
+        times = self._import_times(
+            "import sqlalchemy_greenplum.dialect\n"
+            "from alembic.ddl import impl\n"
+            "from alembic.operations import Operations\n"
+            "assert impl._impls['greenplum'].__name__ == 'GreenplumImpl'\n"
+            "assert hasattr(Operations, 'set_distributed_by')\n")
+        assert "sqlalchemy_greenplum.alembic_gp" in times
+
+
+class AsyncDialectTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def _dialect_cls(self, driver):
+        if driver == "asyncpg":
+            from sqlalchemy_greenplum.asyncpg import GreenplumDialect_asyncpg
+            return GreenplumDialect_asyncpg
+        try:
+            from sqlalchemy_greenplum.psycopg import GreenplumDialectAsync_psycopg
+        except ImportError:
+            testing.config.skip_test("the psycopg dialect needs SQLAlchemy 2.0")
+        return GreenplumDialectAsync_psycopg
+
+    def _check_compile(self, driver):
+        dialect = self._dialect_cls(driver)()
+        assert dialect.is_async
+        eq_(dialect.name, "greenplum")
+        m = MetaData()
+        tbl = Table("atable", m, Column("id", Integer),
+                    Column("name", String(20), greenplum_encoding={"compresstype": "zstd"}),
+                    greenplum_distributed_by="id", greenplum_appendoptimized=True, greenplum_orientation="column")
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE atable (id INTEGER, name VARCHAR(20) ENCODING (compresstype=zstd)) "
+            "WITH (APPENDOPTIMIZED=TRUE,ORIENTATION=COLUMN) DISTRIBUTED BY (id)",
+            dialect=dialect)
+        self.assert_compile(
+            schema.CreateTable(Table("distributed", m, Column("id", Integer), greenplum_distributed_by="id")),
+            'CREATE TABLE "distributed" (id INTEGER) DISTRIBUTED BY (id)',
+            dialect=dialect)
+
+    def test_asyncpg_compile(self):
+        self._check_compile("asyncpg")
+
+    def test_psycopg_async_compile(self):
+        self._check_compile("psycopg_async")
+
+    def _run(self, driver, fn):
+        import asyncio
+        import importlib
+        try:
+            importlib.import_module("asyncpg" if driver == "asyncpg" else "psycopg")
+        except ImportError:
+            testing.config.skip_test("%s is not installed" % driver)
+        self._dialect_cls(driver)
+        from sqlalchemy.ext.asyncio import create_async_engine
+        engine = create_async_engine(
+            testing.db.url.set(drivername="greenplum+%s" % driver), copy_executemany=True,
+            copy_executemany_threshold=2)
+
+        async def run():
+            try:
+                await fn(engine)
+            finally:
+                await engine.dispose()
+        asyncio.run(run())
+
+    def _check_copy_roundtrip(self, driver):
+        from sqlalchemy_greenplum.async_copy import copy_in, copy_out
+        m = MetaData()
+        tbl = Table("async_copy", m, Column("id", Integer), Column("name", String(20)),
+                    Column("amount", Numeric(10, 2)), Column("at", DateTime))
+
+        async def rows(count):
+            for i in range(count):
+                yield i, "n\t%d" % i if i % 3 else None, i / 2, datetime.datetime(2024, 1, 1)
+
+        async def go(engine):
+            async with engine.begin() as conn:
+                await conn.run_sync(m.create_all)
+            try:
+                async with engine.begin() as conn:
+                    eq_(await copy_in(conn, tbl, rows(500), chunk_size=1000), 500)
+                    await conn.execute(tbl.insert(), [{"id": 1000 + i, "name": "x"} for i in range(5)])
+                async with engine.connect() as conn:
+                    await copy_in(conn, tbl, [(2000, "y")], columns=["id", "name"])
+                    await conn.rollback()
+                    eq_((await conn.execute(select(func.count()).select_from(tbl))).scalar(), 505)
+                    data = b"".join([chunk async for chunk in copy_out(
+                        conn, select(tbl.c.id, tbl.c.name).where(tbl.c.id < 3).order_by(tbl.c.id), format="csv")])
+                    eq_(data, b"0,\n1,n\t1\n2,n\t2\n")
+                    chunks = copy_out(conn, tbl, format="binary")
+                    async for chunk in chunks:
+                        assert chunk.startswith(b"PGCOPY\n")
+                        break
+                    await chunks.aclose()
+                    await conn.rollback()
+                    eq_((await conn.execute(select(func.sum(tbl.c.amount)))).scalar(), 62375)
+            finally:
+                async with engine.begin() as conn:
+                    await conn.run_sync(m.drop_all)
+        self._run(driver, go)
+
+    def test_asyncpg_copy_roundtrip(self):
+        self._check_copy_roundtrip("asyncpg")
+
+    def test_psycopg_async_copy_roundtrip(self):
+        self._check_copy_roundtrip("psycopg_async")
+
+    def test_copy_needs_async_greenplum_connection(self):
+        from sqlalchemy_greenplum.async_copy import _greenplum_dialect
+
+        class Connection(object):
+            dialect = testing.db.dialect
+        assert_raises(exc.InvalidRequestError, _greenplum_dialect, Connection())
+
+
+class PsycopgDialectTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def _engine(self, **kw):
+        try:
+            import psycopg  # noqa: F401
+        except ImportError:
+            testing.config.skip_test("psycopg is not installed")
+        try:
+            from sqlalchemy_greenplum.psycopg import GreenplumDialect_psycopg  # noqa: F401
+        except ImportError:
+            testing.config.skip_test("the psycopg dialect needs SQLAlchemy 2.0")
+        return sqlalchemy.create_engine(testing.db.url.set(drivername="greenplum+psycopg"), **kw)
+
+    def test_compile(self):
+        self._engine()
+        from sqlalchemy_greenplum.psycopg import GreenplumDialect_psycopg
+        dialect = GreenplumDialect_psycopg()
+        assert not dialect.is_async
+        eq_(dialect.name, "greenplum")
+        tbl = Table("atable", MetaData(), Column("id", Integer), greenplum_distributed_by="id",
+                    greenplum_appendoptimized=True)
+        self.assert_compile(
+            schema.CreateTable(tbl),
+            "CREATE TABLE atable (id INTEGER) WITH (APPENDOPTIMIZED=TRUE) DISTRIBUTED BY (id)",
+            dialect=dialect)
+
+    def test_binary_results(self):
+        import decimal
+        engine = self._engine(binary_results=True)
+        try:
+            with engine.connect() as conn:
+                query = sqlalchemy.text("SELECT 1::integer, 2.5::numeric, 'x'::text")
+                result = conn.execute(query)
+                eq_(result.cursor.pgresult.fformat(0), 1)
+                eq_(result.fetchall(), [(1, decimal.Decimal("2.5"), "x")])
+                result = conn.execution_options(greenplum_binary_results=False).execute(query)
+                eq_(result.cursor.pgresult.fformat(0), 0)
+                eq_(result.fetchall(), [(1, decimal.Decimal("2.5"), "x")])
+        finally:
+            engine.dispose()
+
+    def test_copy_executemany(self):
+        engine = self._engine(copy_executemany=True, copy_executemany_threshold=2)
+        m = MetaData()
+        tbl = Table("psycopg_copy", m, Column("id", Integer), Column("name", String(20)))
+        m.create_all(engine)
+        try:
+            with engine.begin() as conn:
+                conn.execute(tbl.insert(), [{"id": i, "name": "n\t%d" % i} for i in range(100)])
+            with engine.connect() as conn:
+                eq_(conn.execute(select(func.count(), func.sum(tbl.c.id))).one(), (100, 4950))
+                eq_(conn.execute(select(tbl.c.name).where(tbl.c.id == 7)).scalar(), "n\t7")
+        finally:
+            m.drop_all(engine)
+            engine.dispose()
+
+    def test_execute_pipelined(self):
+        engine = self._engine()
+        from sqlalchemy_greenplum.psycopg import execute_pipelined
+        m = MetaData()
+        tbl = Table("psycopg_pipeline", m, Column("id", Integer, primary_key=True, autoincrement=False),
+                    Column("name", String(20)))
+        m.create_all(engine)
+        try:
+            with engine.connect() as conn:
+                eq_(execute_pipelined(conn, [
+                    tbl.insert().values(id=1, name="a"),
+                    (tbl.insert(), {"id": 2, "name": "b"}),
+                    ("UPDATE psycopg_pipeline SET name = :name WHERE id < :id", {"name": "c", "id": 3}),
+                    tbl.delete().where(tbl.c.id == 2),
+                ]), [1, 1, 2, 1])
+                conn.commit()
+                driver_connection = conn.connection.driver_connection
+                cursor, opened = driver_connection.cursor, []
+                driver_connection.cursor = lambda: opened.append(cursor()) or opened[-1]
+                try:
+                    execute_pipelined(conn, [
+                        tbl.insert().values(id=3),
+                        "INSERT INTO psycopg_pipeline (id) VALUES (1)",
+                        tbl.insert().values(id=4),
+                    ])
+                except exc.IntegrityError as err:
+                    eq_(err.statement, "INSERT INTO psycopg_pipeline (id) VALUES (1)")
+                else:
+                    assert False, "the duplicate key was not reported"
+                finally:
+                    del driver_connection.cursor
+                eq_([c.closed for c in opened], [True, True, True])
+                conn.rollback()
+                eq_(conn.execute(select(tbl.c.id, tbl.c.name)).all(), [(1, "c")])
+            with testing.db.connect() as conn:
+                assert_raises(exc.InvalidRequestError, execute_pipelined, conn, [])
+        finally:
+            m.drop_all(engine)
+            engine.dispose()
+
+
+class ReloadTest(fixtures.TestBase, AssertsCompiledSQL):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_compile(self):
+        from sqlalchemy_greenplum.ddl import Analyze, RenameTable
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        tbl = Table("sales", MetaData(), Column("id", Integer), Column("Region", String), schema="s1")
+        self.assert_compile(Analyze(tbl), "ANALYZE s1.sales")
+        self.assert_compile(Analyze(tbl, columns=[tbl.c.id, "Region"]), 'ANALYZE s1.sales (id, "Region")')
+        self.assert_compile(Analyze(tbl, rootpartition=True), "ANALYZE ROOTPARTITION s1.sales")
+        self.assert_compile(RenameTable(tbl, "Sales_old"), 'ALTER TABLE s1.sales RENAME TO "Sales_old"')
+        dialect = GreenplumDialect()
+        dialect.greenplum_version_info = (4, 3, 33)
+        assert_raises(exc.CompileError, Analyze(tbl, rootpartition=True).compile, dialect=dialect)
+
+    def test_shadow_table_like(self):
+        from sqlalchemy_greenplum.reload import shadow_table_like
+        tbl = Table("dim", MetaData(), Column("id", Integer), Column("code", String(10)),
+                    sqlalchemy.PrimaryKeyConstraint("id", name="dim_key"), sqlalchemy.Index("ix_dim_code", "code"),
+                    greenplum_distributed_by="id", greenplum_appendoptimized=True, greenplum_compresstype="zstd",
+                    schema="s1")
+        shadow = shadow_table_like(tbl, suffix="x1", greenplum_compresstype="zlib")
+        eq_(shadow.name, "dim_x1")
+        eq_(shadow.schema, "s1")
+        eq_([index.name for index in shadow.indexes], ["ix_dim_code_x1"])
+        self.assert_compile(
+            schema.CreateTable(shadow),
+            "CREATE TABLE s1.dim_x1 (id INTEGER NOT NULL, code VARCHAR(10), CONSTRAINT dim_key_x1 PRIMARY KEY (id)) "
+            "WITH (APPENDOPTIMIZED=TRUE,COMPRESSTYPE=ZLIB) DISTRIBUTED BY (id)")
+        eq_(tbl.dialect_options["greenplum"]["compresstype"], "zstd")
+        eq_(len(shadow_table_like(tbl, suffix="a" * 8).name), len(shadow_table_like(tbl).name))
+
+    def test_reload_table(self):
+        from sqlalchemy_greenplum.reload import reload_table
+        m = MetaData()
+        tbl = Table("reload_dim", m, Column("id", Integer, primary_key=True), Column("code", String(10), unique=True),
+                    sqlalchemy.Index("ix_reload_dim_code", "code"))
+        m.create_all(testing.db)
+
+        def index_names(conn):
+            return sorted(conn.exec_driver_sql(
+                "SELECT c.relname FROM pg_catalog.pg_index i JOIN pg_catalog.pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = 'reload_dim'::regclass").scalars().all())
+
+        try:
+            with testing.db.begin() as conn:
+                conn.execute(tbl.insert(), [{"code": "a"}, {"code": "b"}])
+                indexes = index_names(conn)
+            with testing.db.connect() as conn:
+                eq_(reload_table(conn, tbl, [{"id": i, "code": "c%d" % i} for i in range(5)]), 5)
+                assert not conn.in_transaction()
+                eq_(reload_table(conn, tbl, select((tbl.c.id + 10).label("id"), tbl.c.code)), 5)
+
+                def fail(connection, shadow):
+                    connection.execute(shadow.insert().values(id=1))
+                    raise ZeroDivisionError()
+                assert_raises(ZeroDivisionError, reload_table, conn, tbl, fail)
+            with testing.db.begin() as conn:
+                conn.execute(tbl.insert().values(code="new"))
+                eq_(conn.execute(select(tbl.c.id, tbl.c.code).order_by(tbl.c.id)).all(),
+                    [(3, "new")] + [(10 + i, "c%d" % i) for i in range(5)])
+                eq_(index_names(conn), indexes)
+                eq_(sorted(conn.exec_driver_sql(
+                    "SELECT relname FROM pg_catalog.pg_class WHERE relname LIKE '%%reload_dim%%'").scalars().all()),
+                    sorted(indexes + ["reload_dim", "reload_dim_id_seq"]))
+        finally:
+            m.drop_all(testing.db)
+
+    def test_shadow_table_like_reflects_storage(self):
+        if testing.db.dialect.greenplum_version_info is None:
+            testing.config.skip_test("append optimized tables need Greenplum")
+        from sqlalchemy_greenplum.reload import shadow_table_like
+        m = MetaData()
+        Table("reload_ao", m, Column("id", Integer),
+              Column("code", String(10), greenplum_encoding={"compresstype": "zlib"}),
+              greenplum_distributed_by="id", greenplum_appendoptimized=True, greenplum_orientation="column")
+        m.create_all(testing.db)
+        try:
+            # declared without its storage options, like most Tables of an application
+            tbl = Table("reload_ao", MetaData(), Column("id", Integer), Column("code", String(10)))
+            with testing.db.connect() as conn:
+                shadow = shadow_table_like(tbl, suffix="x1", connection=conn)
+                ddl = str(schema.CreateTable(shadow).compile(dialect=conn.dialect)).lower()
+                assert "appendonly=true" in ddl or "appendoptimized=true" in ddl, ddl
+                assert "orientation=column" in ddl, ddl
+                assert "encoding (compresstype=zlib" in ddl, ddl
+                assert "distributed by (id)" in ddl, ddl
+        finally:
+            m.drop_all(testing.db)
+
+    def test_reload_partition(self):
+        if testing.db.dialect.greenplum_version_info is None:
+            testing.config.skip_test("EXCHANGE PARTITION needs Greenplum")
+        from sqlalchemy_greenplum.partition import RangePartitionBy, RangePartition, PartitionFor
+        from sqlalchemy_greenplum.reload import reload_partition
+        m = MetaData()
+        tbl = Table("reload_sales", m, Column("id", Integer), Column("day", Integer), greenplum_distributed_by="id",
+                    greenplum_partition_by=RangePartitionBy("day", [
+                        RangePartition("p1", start=0, end=10), RangePartition("p2", start=10, end=20)]))
+        m.create_all(testing.db)
+        try:
+            with testing.db.begin() as conn:
+                conn.execute(tbl.insert(), [{"id": i, "day": i} for i in range(20)])
+            with testing.db.connect() as conn:
+                eq_(reload_partition(conn, tbl, [{"id": i, "day": 5} for i in range(3)], partition=PartitionFor(5)), 3)
+                eq_(conn.execute(select(tbl.c.day, func.count()).group_by(tbl.c.day).order_by(tbl.c.day)).all()[:2],
+                    [(5, 3), (10, 1)])
+        finally:
+            m.drop_all(testing.db)
+
+
+class AutoAnalyzeTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_arguments(self):
+        from sqlalchemy_greenplum.dialect import GreenplumDialect
+        assert_raises(exc.ArgumentError, GreenplumDialect, auto_analyze="always")
+        eq_(GreenplumDialect(auto_analyze="commit").auto_analyze, "commit")
+        eq_(GreenplumDialect().auto_analyze, None)
+
+    def _run(self, mode):
+        m = MetaData()
+        tbl = Table("auto_analyze", m, Column("id", Integer), Column("code", String(10)),
+                    greenplum_analyze_columns=["id"])
+        engine = sqlalchemy.create_engine(testing.db.url, auto_analyze=mode, auto_analyze_threshold=1000)
+
+        def reltuples():
+            if mode == "background":
+                engine.dialect._auto_analyze_executor.submit(lambda: None).result()
+            with engine.connect() as conn:
+                return conn.exec_driver_sql(
+                    "SELECT reltuples FROM pg_catalog.pg_class WHERE relname = 'auto_analyze'").scalar()
+
+        m.create_all(engine)
+        try:
+            with engine.begin() as conn:
+                conn.execute(tbl.insert(), [{"id": i} for i in range(50)])
+            eq_(reltuples(), 50)
+            with engine.begin() as conn:
+                # below 10% of the estimate
+                conn.execute(tbl.insert(), [{"id": i} for i in range(3)])
+            eq_(reltuples(), 50)
+            eq_(engine.dialect._rows_written, {(None, "auto_analyze"): [3, ["id"]]})
+            with engine.connect() as conn:
+                trans = conn.begin()
+                conn.execute(tbl.insert(), [{"id": i} for i in range(500)])
+                trans.rollback()
+            with engine.begin() as conn:
+                conn.execution_options(greenplum_auto_analyze=False).execute(tbl.delete().where(tbl.c.id < 10))
+            eq_(engine.dialect._rows_written, {(None, "auto_analyze"): [3, ["id"]]})
+            with engine.begin() as conn:
+                conn.execute(tbl.update().where(tbl.c.id.between(10, 11)).values(code="x"))
+            eq_(reltuples(), 40)
+            eq_(engine.dialect._rows_written, {})
+        finally:
+            m.drop_all(engine)
+            engine.dispose()
+
+    def test_commit(self):
+        self._run("commit")
+
+    def test_background(self):
+        self._run("background")
+
+
+class SettingsTest(fixtures.TestBase):
+
+    __only_on__ = "greenplum"
+    __backend__ = True
+
+    def test_resolve_settings(self):
+        from sqlalchemy_greenplum.settings import resolve_settings, set_config_statement
+        presets = {"etl": {"statement_mem": "2GB", "optimizer": False}}
+        eq_(resolve_settings("etl", presets), {"statement_mem": "2GB", "optimizer": "off"})
+        eq_(resolve_settings({"GPCC.Enable": True, "work_mem": 4096}), {"gpcc.enable": "on", "work_mem": "4096"})
+        assert_raises(exc.ArgumentError, resolve_settings, "adhoc", presets)
+        assert_raises(exc.ArgumentError, resolve_settings, {"work_mem; DROP TABLE x": "1"})
+        assert_raises(exc.ArgumentError, resolve_settings, {"work_mem": None})
+        literal = sqlalchemy.String().literal_processor(dialect=testing.db.dialect)
+        eq_(set_config_statement({"search_path": "a, 'b'", "optimizer": "off"}, True, literal),
+            "SELECT set_config('optimizer', 'off', true), set_config('search_path', 'a, ''b''', true)")
+
+    def _settings(self, conn):
+        return conn.exec_driver_sql(
+            "SELECT current_setting('work_mem'), current_setting('enable_hashjoin'), "
+            "current_setting('application_name')").one()
+
+    def test_settings(self):
+        engine = sqlalchemy.create_engine(
+            testing.db.url, pool_size=1, max_overflow=0, session_settings={"work_mem": "8MB"},
+            settings_presets={"etl": {"work_mem": "64MB", "enable_hashjoin": False, "application_name": "etl"}})
+        try:
+            with engine.connect() as conn:
+                eq_(self._settings(conn), ("8MB", "on", ""))
+            with engine.connect() as conn:
+                conn = conn.execution_options(greenplum_settings="etl")
+                eq_(self._settings(conn), ("64MB", "off", "etl"))
+            with engine.connect() as conn:
+                # only the ones of the preset were reset, work_mem back to the one of the engine
+                eq_(self._settings(conn), ("8MB", "on", ""))
+            query = select(func.current_setting("work_mem")).execution_options(greenplum_settings={"work_mem": "1MB"})
+            with engine.begin() as conn:
+                eq_(conn.execute(query).scalar(), "1MB")
+                # set back once the statement ran, not at the end of the transaction
+                eq_(self._settings(conn), ("8MB", "on", ""))
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                eq_(conn.execute(query).scalar(), "1MB")
+                eq_(self._settings(conn), ("8MB", "on", ""))
+                assert_raises(
+                    exc.DBAPIError, conn.execute,
+                    sqlalchemy.text("SELECT 1 / 0").execution_options(greenplum_settings={"work_mem": "1MB"}))
+                eq_(self._settings(conn), ("8MB", "on", ""))
+            with engine.connect() as conn:
+                eq_(self._settings(conn), ("8MB", "on", ""))
+            with engine.execution_options(greenplum_settings="etl").connect() as conn:
+                eq_(self._settings(conn), ("64MB", "off", "etl"))
+                eq_(conn.execute(select(func.current_setting("enable_hashjoin"))).scalar(), "off")
+            with engine.connect() as conn:
+                eq_(self._settings(conn), ("8MB", "on", ""))
+        finally:
+            engine.dispose()
+
+    def test_unknown_preset(self):
+        assert_raises(exc.ArgumentError, sqlalchemy.create_engine, testing.db.url, session_settings="etl")